@@ -154,6 +154,15 @@ class upnp_device(MyLog, object):
     def fileno(self):
         return self.socket.fileno()
 
+    def close(self):
+        self.listener.remove_device(self)
+        for fileno, (client_socket, client_address) in list(self.client_sockets.items()):
+            self.poller.remove(self, fileno)
+            client_socket.close()
+        self.client_sockets = {}
+        self.poller.remove(self)
+        self.socket.close()
+
     def do_read(self, fileno):
         if fileno == self.socket.fileno():
             (client_socket, client_address) = self.socket.accept()
@@ -405,6 +414,11 @@ class upnp_broadcast_responder(MyLog, object):
         self.devices.append(device)
         self.LogInfo("UPnP broadcast listener: new device registered")
 
+    def remove_device(self, device):
+        if device in self.devices:
+            self.devices.remove(device)
+            self.LogInfo("UPnP broadcast listener: device removed")
+
 
 class debounce_handler(object):
     """Use this handler to keep multiple Amazon Echo devices from reacting to
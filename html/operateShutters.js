@@ -76,6 +76,30 @@ function locateUser() {
     mymap.locate({setView : true});
 }
 
+function nextAstroTime(timeValue) {
+   // time of an astro event within the next days, from the sun times sent with the config
+   if (!config.SunTimes) {
+      return "";
+   }
+   var sun = timeValue.substring(0, 6) == "sunset" ? "sunset" : "sunrise";
+   var offset = parseInt(timeValue.substring(sun.length)) || 0;
+   var now = new Date();
+   var days = Object.keys(config.SunTimes).sort();
+   for (var i = 0; i < days.length; i++) {
+      var sunTime = config.SunTimes[days[i]][sun];
+      if (sunTime == null) {
+         continue;
+      }
+      var parts = (days[i] + " " + sunTime).split(/[\/ :]/);
+      var eventTime = new Date(parts[0], parts[1] - 1, parts[2], parts[3], parts[4], parts[5]);
+      eventTime.setMinutes(eventTime.getMinutes() + offset);
+      if (eventTime > now) {
+         return " (next: " + days[i] + " " + ("0" + eventTime.getHours()).slice(-2) + ":" + ("0" + eventTime.getMinutes()).slice(-2) + ")";
+      }
+   }
+   return "";
+}
+
 function prettyPrintSchedule(evt, shutters) {
    outstr = ""
    if (evt['active'] == "paused") {
@@ -104,19 +128,19 @@ function prettyPrintSchedule(evt, shutters) {
    } else if (evt['timeType'] == "astro") {
       if (evt['timeValue'].substring(0, 6) == "sunset") {
          if (evt['timeValue'].substring(6, 7) == "+") {
-            outstr += evt['timeValue'].substring(7) + " minutes after sunset, ";
+            outstr += evt['timeValue'].substring(7) + " minutes after sunset" + nextAstroTime(evt['timeValue']) + ", ";
          } else if (evt['timeValue'].substring(6, 7) == "-") {
-            outstr += evt['timeValue'].substring(7) + " minutes before sunset, ";
+            outstr += evt['timeValue'].substring(7) + " minutes before sunset" + nextAstroTime(evt['timeValue']) + ", ";
          } else {
-            outstr += "at sunset, "
+            outstr += "at sunset" + nextAstroTime(evt['timeValue']) + ", "
          }
       } else if (evt['timeValue'].substring(0, 7) == "sunrise") {
          if (evt['timeValue'].substring(7, 8) == "+") {
-            outstr += evt['timeValue'].substring(8) + " minutes after sunrise, ";
+            outstr += evt['timeValue'].substring(8) + " minutes after sunrise" + nextAstroTime(evt['timeValue']) + ", ";
          } else if (evt['timeValue'].substring(7, 8) == "-") {
-            outstr += evt['timeValue'].substring(8) + " minutes before sunrise, ";
+            outstr += evt['timeValue'].substring(8) + " minutes before sunrise" + nextAstroTime(evt['timeValue']) + ", ";
          } else {
-            outstr += "at sunrise, ";
+            outstr += "at sunrise" + nextAstroTime(evt['timeValue']) + ", ";
          }
       }
    }
@@ -16,6 +16,7 @@ import pigpio
 import socket
 import signal, atexit, subprocess, traceback
 import threading
+import queue
 
 try:
     from mylog import MyLog
@@ -69,14 +70,38 @@ class Alexa(threading.Thread, MyLog, debounce_handler):
         self.poller.add(self.upnp_responder)
 
         # Register the device callback as a fauxmo handler
-        dbh = device_handler(log=self.log, shutter=self.shutter, config=self.config)
+        self.dbh = device_handler(log=self.log, shutter=self.shutter, config=self.config)
+        self.devices = {}
+        self.pendingChanges = queue.Queue()
         for shutter, shutterId in sorted(self.config.ShuttersByName.items(), key=lambda kv: kv[1]):
-            portId = 50000 + (abs(int(shutterId,16)) % 10000)
-            self.LogInfo ("Remote address in dec: " + str(int(shutterId,16)) + ", WeMo port will be n°" + str(portId))
-            fauxmo.fauxmo(shutter, self.upnp_responder, self.poller, None, portId, dbh, log=self.log)
+            self.addDevice(shutter, shutterId)
                         
         return
 
+    def addDevice(self, shutter, shutterId):
+        portId = 50000 + (abs(int(shutterId,16)) % 10000)
+        self.LogInfo ("Remote address in dec: " + str(int(shutterId,16)) + ", WeMo port will be n°" + str(portId))
+        self.devices[shutterId] = fauxmo.fauxmo(shutter, self.upnp_responder, self.poller, None, portId, self.dbh, log=self.log)
+
+    def removeDevice(self, shutterId):
+        device = self.devices.pop(shutterId, None)
+        if device != None:
+            self.LogInfo ("Removing WeMo device for remote " + shutterId)
+            device.close()
+
+    def applyConfigChanges(self, changes):
+        # Called by the ConfigWatcher, the devices are changed by the polling loop
+        self.pendingChanges.put(changes)
+
+    def processConfigChanges(self):
+        while not self.pendingChanges.empty():
+            changes = self.pendingChanges.get()
+            for shutterId in changes.shuttersRemoved + list(changes.shuttersRenamed):
+                self.removeDevice(shutterId)
+            for shutterId in changes.shuttersAdded + list(changes.shuttersRenamed):
+                if shutterId in self.config.Shutters:
+                    self.addDevice(self.config.Shutters[shutterId]['name'], shutterId)
+
     def run(self):
         self.LogInfo("Entering fauxmo polling loop")
         error = 0
@@ -84,6 +109,7 @@ class Alexa(threading.Thread, MyLog, debounce_handler):
             # Loop and poll for incoming Echo requests
             try:
                 # Allow time for a ctrl-c to stop the process
+                self.processConfigChanges()
                 self.poller.poll(100)
                 time.sleep(0.01)
             except Exception as e:
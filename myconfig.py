@@ -1,12 +1,127 @@
 #!/usr/bin/python3
 
+import os
 import threading
+import contextlib
+import copy
 try:
     from ConfigParser import RawConfigParser
 except ImportError as e:
     from configparser import RawConfigParser
 
 from mylog import MyLog
+from myfiles import replaceFile
+from myrollingcodes import RollingCodeJournal
+
+#------------ ConfigChanges class ----------------------------------------------
+class ConfigChanges(object):
+    """Difference between the shutters and schedules loaded and those in the config file"""
+
+    def __init__(self):
+        self.shuttersAdded = []
+        self.shuttersRemoved = []
+        self.shuttersRenamed = {}       # shutterId -> (old name, new name)
+        self.shuttersChanged = []       # durations or intermediate position, includes renamed
+        self.schedulesAdded = []
+        self.schedulesRemoved = []
+        self.schedulesChanged = []
+
+    def isEmpty(self):
+        return not (self.shuttersAdded or self.shuttersRemoved or self.shuttersChanged or
+                    self.schedulesAdded or self.schedulesRemoved or self.schedulesChanged)
+
+    def __str__(self):
+        return ("shutters added: " + str(self.shuttersAdded) + ", removed: " + str(self.shuttersRemoved) +
+                ", renamed: " + str(self.shuttersRenamed) + ", changed: " + str(self.shuttersChanged) +
+                "; schedules added: " + str(self.schedulesAdded) + ", removed: " + str(self.schedulesRemoved) +
+                ", changed: " + str(self.schedulesChanged))
+
+#------------ ConfigDocument class ---------------------------------------------
+class ConfigDocument(object):
+    """Lines of the config file indexed by section and entry.
+
+    Comments and blank lines are kept as they are. Each entry points at its line, so an
+    update rewrites that line in place, a new entry is inserted after the last data line
+    of its section (as WriteValue always did) and a removed entry leaves no line behind."""
+
+    class Section(object):
+        def __init__(self, name):
+            self.name = name
+            self.lines = []             # [text], None once removed
+            self.entries = {}           # entry -> line
+            self.insertAt = 0           # position after the last data line
+
+    def __init__(self, lines = ()):
+        self.head = ConfigDocument.Section(None)        # lines before the first section
+        self.sections = []
+        self.index = {}                                  # lower case name -> Section
+        section = self.head
+        for line in lines:
+            if self.LineIsSection(line):
+                section = self.addSection(self.GetSectionName(line), line)
+                continue
+            section.lines.append([line])
+            stripped = line.strip()
+            if len(stripped) and stripped[0] != "#":
+                section.insertAt = len(section.lines)
+                if len(stripped.split('=')) >= 2:
+                    section.entries[stripped.split('=')[0].strip()] = section.lines[-1]
+
+    #---------------------ConfigDocument::addSection----------------------------
+    def addSection(self, name, line = None):
+        section = ConfigDocument.Section(name)
+        section.lines.append([line if line != None else "[" + name + "]"])
+        section.insertAt = 1
+        self.sections.append(section)
+        self.index.setdefault(name.lower(), section)
+        return section
+
+    #---------------------ConfigDocument::getSection----------------------------
+    def getSection(self, name):
+        return self.index.get(name.lower())
+
+    #---------------------ConfigDocument::set-----------------------------------
+    def set(self, sectionName, entry, value):
+        section = self.getSection(sectionName)
+        if section == None:
+            return False
+        text = entry + " = " + value
+        line = section.entries.get(entry)
+        if line != None:
+            line[0] = text
+        else:
+            line = [text]
+            section.lines.insert(section.insertAt, line)
+            section.insertAt += 1
+            section.entries[entry] = line
+        return True
+
+    #---------------------ConfigDocument::remove--------------------------------
+    def remove(self, sectionName, entry):
+        section = self.getSection(sectionName)
+        if section == None:
+            return False
+        line = section.entries.pop(entry, None)
+        if line != None:
+            line[0] = None
+        return True
+
+    #---------------------ConfigDocument::render--------------------------------
+    def render(self):
+        lines = []
+        for section in [self.head] + self.sections:
+            lines += [line[0] for line in section.lines if line[0] != None]
+        return "".join(line + "\n" for line in lines)
+
+    @staticmethod
+    def LineIsSection(line):
+        line = line.strip()
+        return line.startswith("[") and line.endswith("]") and len(line) >= 3
+
+    @staticmethod
+    def GetSectionName(line):
+        return line.strip()[1:-1]
+
 
 class MyConfig (MyLog):
     #---------------------MyConfig::__init__------------------------------------
@@ -16,12 +131,21 @@ class MyConfig (MyLog):
         self.log = log
         self.FileName = filename
         self.Section = section
-        self.CriticalLock = threading.Lock()        # Critical Lock (writing conf file)
+        self.CriticalLock = threading.Lock()        # Critical Lock (changing the document)
+        self.FlushLock = threading.Lock()           # writing conf file
+        self.FlushTimer = None
+        self.Dirty = False
+        self.WriteDelay = 0.5                       # seconds to collect changes before writing them
+        self.Transaction = threading.local()        # changes staged by transaction() in this thread
+        self.FileSignature = None                   # state of the file when it was last read or written
         self.InitComplete = False
 
         self.Rfm69ResetGPIO = 25
         self.Rfm69SPIChannel = 0
         self.Rfm69Enabled = False
+        self.Rfm69KeepWarm = False
+        self.Rfm69IdleTimeout = 300
+        self.Rfm69Dio0GPIO = -1
 
         self.PIGPIOHost = "localhost"
         self.PIGPIOPort = 8888
@@ -31,6 +155,10 @@ class MyConfig (MyLog):
         self.Latitude = 51.4769
         self.Longitude = 0
         self.SendRepeat = 1
+        self.UseWaveChain = False
+        self.PrestageWaves = False
+        self.PreUploadWaves = False
+        self.PrecisePartialStops = False
         self.UseHttps = False
         self.HTTPPort = 80
         self.HTTPSPort = 443
@@ -40,10 +168,20 @@ class MyConfig (MyLog):
         self.ShuttersByName = {}
         self.Schedule = {}
         self.Password = ""
+        self.RollingCodeJournal = True
+        self.RollingCodeLeaseSize = 32
+        self.CodeJournal = None
+        self.PersistPositions = True
+        self.ProgressInterval = 0
 
         try:
             self.config = RawConfigParser()
             self.config.read(self.FileName)
+            self.Document = ConfigDocument()
+            if self.FileName != None and os.path.isfile(self.FileName):
+                self.FileSignature = self.GetFileSignature()
+                with open(self.FileName, 'r') as ConfigFile:
+                    self.Document = ConfigDocument(ConfigFile.read().splitlines())
 
             if self.Section == None:
                 SectionList = self.GetSections()
@@ -56,9 +194,9 @@ class MyConfig (MyLog):
         self.InitComplete = True
 
     # -------------------- MyConfig::LoadConfig-----------------------------------
-    def LoadConfig(self):
+    def LoadConfig(self, openJournal = True):
 
-        parameters = {'LogLocation': str, 'LogToConsole':bool, 'Latitude': float, 'Longitude': float, 'SendRepeat': int, 'UseHttps': bool, 'HTTPPort': int, 'HTTPSPort': int, 'TXGPIO': int, 'Rfm69ResetGPIO': int, 'Rfm69SPIChannel': int, 'Rfm69Enabled': bool, 'PIGPIOHost': str, 'PIGPIOPort': int, 'RTS_Address': str, "Password": str}
+        parameters = {'LogLocation': str, 'LogToConsole':bool, 'Latitude': float, 'Longitude': float, 'SendRepeat': int, 'UseWaveChain': bool, 'PrestageWaves': bool, 'PreUploadWaves': bool, 'PrecisePartialStops': bool, 'UseHttps': bool, 'HTTPPort': int, 'HTTPSPort': int, 'TXGPIO': int, 'Rfm69ResetGPIO': int, 'Rfm69SPIChannel': int, 'Rfm69Enabled': bool, 'Rfm69KeepWarm': bool, 'Rfm69IdleTimeout': int, 'Rfm69Dio0GPIO': int, 'PIGPIOHost': str, 'PIGPIOPort': int, 'RTS_Address': str, "Password": str, 'RollingCodeJournal': bool, 'RollingCodeLeaseSize': int, 'PersistPositions': bool, 'ProgressInterval': float}
         
         self.SetSection("General");
         for key, type in parameters.items():
@@ -113,20 +251,152 @@ class MyConfig (MyLog):
             except Exception as e1:
                 self.LogErrorLine("Missing config file or config file entries in Section Scheduler for key "+key+": " + str(e1))
                 return False
-                                   
+
+        if openJournal and self.RollingCodeJournal and not self.openCodeJournal():
+            return False
+
         return True
 
+    #---------------------MyConfig::openCodeJournal-----------------------------
+    def openCodeJournal(self):
+        # Rolling codes are leased in blocks through a journal instead of rewriting the config
+        # file for every frame, the codes are copied back into ShutterRollingCodes on compaction.
+        try:
+            self.CodeJournal = RollingCodeJournal(self.FileName + ".codes", log = self.log, leaseSize = self.RollingCodeLeaseSize)
+            recovered = self.CodeJournal.load()
+            for shutterId, code in recovered.items():
+                if shutterId in self.Shutters and code > self.Shutters[shutterId]['code']:
+                    self.Shutters[shutterId]['code'] = code
+            if len(recovered):
+                self.compactCodes()
+            return True
+        except Exception as e1:
+            self.LogErrorLine("Error opening rolling code journal: " + str(e1))
+            return False
+
+    #---------------------MyConfig::compactCodes--------------------------------
+    def compactCodes(self, release = False):
+        # While running the end of each lease is stored so the leases stay valid, on shutdown
+        # (release) the codes themselves so no code is skipped on the next start.
+        if self.CodeJournal == None:
+            return True
+        for shutterId in self.Shutters:
+            code = self.Shutters[shutterId]['code']
+            leaseEnd = self.CodeJournal.leaseEnd(shutterId)
+            if not release and leaseEnd != None and leaseEnd > code:
+                code = leaseEnd
+            if not self.WriteValue(shutterId, str(code), section="ShutterRollingCodes"):
+                return False
+        try:
+            # the journal may only go once the config file is on disk
+            if not self.Flush():
+                return False
+            self.CodeJournal.truncate(release)
+            return True
+        except Exception as e1:
+            self.LogErrorLine("Error compacting rolling code journal: " + str(e1))
+            return False
+
+    #---------------------MyConfig::close---------------------------------------
+    def close(self):
+        if self.CodeJournal != None:
+            self.compactCodes(release = True)
+            self.CodeJournal.close()
+            self.CodeJournal = None
+        self.Flush()
+
+    #---------------------MyConfig::GetFileSignature----------------------------
+    def GetFileSignature(self):
+        try:
+            Stat = os.stat(self.FileName)
+            return (Stat.st_mtime_ns, Stat.st_size, Stat.st_ino)
+        except OSError:
+            return None
+
+    #---------------------MyConfig::FileChanged---------------------------------
+    def FileChanged(self):
+        # True if the file was changed by someone else since it was last read or written
+        with self.CriticalLock:
+            return self.GetFileSignature() != self.FileSignature
+
+    #---------------------MyConfig::Reload--------------------------------------
+    def Reload(self):
+        # Re-reads the config file and applies the shutters and schedules that changed,
+        # returns the ConfigChanges or None if the file could not be loaded. Rolling codes
+        # never go backwards, the higher of the file and the in-memory code is kept.
+        fresh = MyConfig(filename = self.FileName, log = self.log)
+        if not fresh.InitComplete or not fresh.LoadConfig(openJournal = False):
+            self.LogError("Error in Reload: not able to load " + str(self.FileName) + ", keeping the current configuration")
+            return None
+
+        changes = ConfigChanges()
+        with self.CriticalLock:
+            if self.Dirty:
+                self.LogWarn("Config file was changed while changes were waiting to be written, the changes in the file win")
+                self.Dirty = False
+            self.config = fresh.config
+            self.Document = fresh.Document
+            self.FileSignature = fresh.FileSignature
+
+            for shutterId in list(self.Shutters):
+                if shutterId not in fresh.Shutters:
+                    changes.shuttersRemoved.append(shutterId)
+                    del self.Shutters[shutterId]
+            for shutterId, shutter in fresh.Shutters.items():
+                current = self.Shutters.get(shutterId)
+                if current == None:
+                    changes.shuttersAdded.append(shutterId)
+                    self.Shutters[shutterId] = shutter
+                    continue
+                shutter['code'] = max(shutter['code'], current['code'])
+                if shutter['name'] != current['name']:
+                    changes.shuttersRenamed[shutterId] = (current['name'], shutter['name'])
+                if any(shutter[key] != current[key] for key in shutter if key != 'code'):
+                    changes.shuttersChanged.append(shutterId)
+                current.update(shutter)
+            self.ShuttersByName.clear()
+            self.ShuttersByName.update(fresh.ShuttersByName)
+
+            for scheduleId in list(self.Schedule):
+                if scheduleId not in fresh.Schedule:
+                    changes.schedulesRemoved.append(scheduleId)
+                    del self.Schedule[scheduleId]
+            for scheduleId, schedule in fresh.Schedule.items():
+                if scheduleId not in self.Schedule:
+                    changes.schedulesAdded.append(scheduleId)
+                elif schedule != self.Schedule[scheduleId]:
+                    changes.schedulesChanged.append(scheduleId)
+                self.Schedule[scheduleId] = schedule
+
+        self.LogInfo("Reloaded config file " + str(self.FileName) + ": " + str(changes))
+        return changes
+
     #---------------------MyConfig::setLocation---------------------------------
     def setLocation(self, lat, lng):
-        self.WriteValue("Latitude", lat, section="General");
-        self.WriteValue("Longitude", lng, section="General");
+        try:
+            with self.transaction():
+                self.WriteValue("Latitude", lat, section="General");
+                self.WriteValue("Longitude", lng, section="General");
+        except Exception as e1:
+            self.LogError("Error in setLocation: " + str(e1))
+            return False
         self.Latitude = lat
         self.Longitude = lng
+        return True
 
     #---------------------MyConfig::setCode---------------------------------
     def setCode(self, shutterId, code):
-        self.WriteValue(shutterId, str(code), section="ShutterRollingCodes");
+        if self.CodeJournal == None:
+            # written through, the code must be on disk before the frame is sent
+            self.WriteValue(shutterId, str(code), section="ShutterRollingCodes");
+            self.Flush()
+            self.Shutters[shutterId]['code'] = code
+            return
+        # only touches the disk when the code leaves the current lease
+        self.CodeJournal.lease(shutterId, code)
         self.Shutters[shutterId]['code'] = code
+        if self.CodeJournal.needsCompaction():
+            self.compactCodes()
         
 
     #---------------------MyConfig::HasOption-----------------------------------
@@ -184,6 +454,59 @@ class MyConfig (MyLog):
             return default
 
 
+    #---------------------MyConfig::transaction---------------------------------
+    @contextlib.contextmanager
+    def transaction(self):
+        # WriteSection/WriteValue calls made by this thread inside the block are staged and
+        # applied together when it ends, written with a single write of the file. If the block
+        # raises, one of the changes cannot be applied or the file cannot be written, none of
+        # them is. Reads inside the block still return the values from before it. Nested
+        # blocks join the outer one.
+        if getattr(self.Transaction, "changes", None) != None:
+            yield
+            return
+        self.Transaction.changes = []
+        try:
+            yield
+            changes = self.Transaction.changes
+        finally:
+            self.Transaction.changes = None
+
+        if not len(changes):
+            return
+        # The changes are made on a copy of the document, which only replaces the document once
+        # it is on disk. The lock keeps other writes out meanwhile.
+        with self.FlushLock:
+            with self.CriticalLock:
+                sections = set(section.name.lower() for section in self.Document.sections)
+                for change in changes:
+                    if change[0] == "section":
+                        sections.add(change[1].lower())
+                    elif change[1].lower() not in sections:
+                        raise Exception("NOT ABLE TO FIND SECTION:"+change[1])
+                Document = copy.deepcopy(self.Document)
+                for change in changes:
+                    if change[0] == "section":
+                        self._applySection(Document, change[1])
+                    else:
+                        self._applyValue(Document, *change[1:])
+                try:
+                    self.WriteFile(Document.render())
+                except Exception as e1:
+                    self.LogError("Error in transaction: " + str(e1))
+                    raise Exception("Error writing config file " + str(self.FileName))
+                if self.FlushTimer != None:
+                    self.FlushTimer.cancel()
+                    self.FlushTimer = None
+                self.Document = Document
+                self.Dirty = False
+                self.FileSignature = self.GetFileSignature()
+                for change in changes:
+                    if change[0] == "section":
+                        self._cacheSection(change[1])
+                    else:
+                        self._cacheValue(*change[1:])
+
     #---------------------MyConfig::WriteSection--------------------------------
     def WriteSection(self, SectionName):
 
@@ -192,14 +515,14 @@ class MyConfig (MyLog):
         if SectionName in SectionList:
             self.LogError("Error in WriteSection: Section already exist.")
             return True
+        if getattr(self.Transaction, "changes", None) != None:
+            self.Transaction.changes.append(("section", SectionName))
+            return True
         try:
             with self.CriticalLock:
-                with open(self.FileName, "a") as ConfigFile:
-                    ConfigFile.write("[" + SectionName + "]")
-                    ConfigFile.flush()
-                    ConfigFile.close()
-                    # update the read data that is cached
-                    self.config.read(self.FileName)
+                self._applySection(self.Document, SectionName)
+                self._cacheSection(SectionName)
+                self.ScheduleFlush()
             return True
         except Exception as e1:
             self.LogErrorLine("Error in WriteSection: " + str(e1))
@@ -211,55 +534,87 @@ class MyConfig (MyLog):
         if section != None:
             self.SetSection(section)
 
-        SectionFound = False
+        if getattr(self.Transaction, "changes", None) != None:
+            self.Transaction.changes.append(("value", self.Section, Entry, Value, remove))
+            return True
         try:
             with self.CriticalLock:
-                Found = False
-                ConfigFile = open(self.FileName,'r')
-                FileList = ConfigFile.read().splitlines()
-                ConfigFile.close()
-                
-                mySectionStart = -1;
-                mySectionEnd = -1;
-                myLine = -1; 
-                currentLastDataLine = -1;
-                for i, line in enumerate(FileList):
-                   if self.LineIsSection(line) and self.Section.lower() == self.GetSectionName(line).lower():
-                      mySectionStart = i
-                   elif mySectionStart >=0 and mySectionEnd == -1 and len(line.strip().split('=')) >= 2 and (line.strip().split('='))[0].strip() == Entry:
-                      myLine = i
-                   elif mySectionStart >=0 and mySectionEnd == -1 and self.LineIsSection(line):
-                      mySectionEnd = currentLastDataLine
-
-                   if not line.isspace() and not len(line.strip()) == 0 and not line.strip()[0] == "#":
-                      currentLastDataLine = i
-                if mySectionStart >=0 and mySectionEnd == -1:
-                    mySectionEnd = currentLastDataLine    
-
-                self.LogDebug("CONFIG FILE WRITE ->> mySectionStart = "+str(mySectionStart)+", mySectionEnd = "+str(mySectionEnd)+", myLine = "+str(myLine))
-                if mySectionStart == -1:
+                if self.Document.getSection(self.Section) == None:
                     raise Exception("NOT ABLE TO FIND SECTION:"+self.Section)
-
-                ConfigFile = open(self.FileName,'w')
-                for i, line in enumerate(FileList):
-                    if myLine >= 0 and myLine == i and not remove:      # I found my line, now write new value
-                       ConfigFile.write(Entry + " = " + Value + "\n")
-                    elif myLine == -1 and mySectionEnd == i:            # Here we have to insert the new record...
-                       ConfigFile.write(line+"\n")
-                       ConfigFile.write(Entry + " = " + Value + "\n")
-                    else:                                               # Nothing special, just copy the previous line....
-                       ConfigFile.write(line+"\n")
-
-                ConfigFile.flush()
-                ConfigFile.close()
-                # update the read data that is cached
-                self.config.read(self.FileName)
+                self._applyValue(self.Document, self.Section, Entry, Value, remove)
+                self._cacheValue(self.Section, Entry, Value, remove)
+                self.ScheduleFlush()
             return True
 
         except Exception as e1:
             self.LogError("Error in WriteValue: " + str(e1))
             return False
 
+    def _applySection(self, Document, SectionName):
+        # called with CriticalLock held
+        Document.addSection(SectionName)
+
+    def _applyValue(self, Document, SectionName, Entry, Value, remove):
+        # called with CriticalLock held, the section must exist
+        Section = Document.getSection(SectionName)
+        self.LogDebug("CONFIG WRITE ->> section = "+Section.name+", entry = "+Entry+(", removed" if remove else ""))
+        if remove:
+            Document.remove(Section.name, Entry)
+        else:
+            Document.set(Section.name, Entry, Value)
+
+    def _cacheSection(self, SectionName):
+        # called with CriticalLock held, updates the read data that is cached
+        if not self.config.has_section(SectionName):
+            self.config.add_section(SectionName)
+
+    def _cacheValue(self, SectionName, Entry, Value, remove):
+        # called with CriticalLock held once the section is in the document
+        SectionName = self.Document.getSection(SectionName).name
+        if not self.config.has_section(SectionName):
+            self.config.add_section(SectionName)
+        if remove:
+            self.config.remove_option(SectionName, Entry)
+        else:
+            self.config.set(SectionName, Entry, Value)
+
+    #---------------------MyConfig::ScheduleFlush-------------------------------
+    def ScheduleFlush(self):
+        # called with CriticalLock held, changes made within WriteDelay are written together
+        self.Dirty = True
+        if self.FlushTimer == None:
+            self.FlushTimer = threading.Timer(self.WriteDelay, self.Flush)
+            self.FlushTimer.daemon = True
+            self.FlushTimer.start()
+
+    #---------------------MyConfig::Flush---------------------------------------
+    def Flush(self):
+        # Writes the document if it has changes, returns False on error
+        try:
+            with self.FlushLock:
+                with self.CriticalLock:
+                    if self.FlushTimer != None:
+                        self.FlushTimer.cancel()
+                        self.FlushTimer = None
+                    if not self.Dirty:
+                        return True
+                    self.Dirty = False
+                    Content = self.Document.render()
+                self.WriteFile(Content)
+                with self.CriticalLock:
+                    self.FileSignature = self.GetFileSignature()
+            return True
+        except Exception as e1:
+            with self.CriticalLock:
+                self.Dirty = True
+            self.LogError("Error in Flush: " + str(e1))
+            return False
+
+    #---------------------MyConfig::WriteFile-----------------------------------
+    def WriteFile(self, Content):
+        # replaces the config file atomically, raises on error
+        replaceFile(self.FileName, Content, copyMode = True)
+
     #---------------------MyConfig::GetSectionName------------------------------
     def GetSectionName(self, Line):
 
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import sys
+import threading
+
+try:
+    from mylog import MyLog
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class ConfigWatcher(threading.Thread, MyLog):
+    """Reloads the config file when it is changed by hand.
+
+    The modification time, size and inode of the file are polled every interval seconds.
+    Writes made by MyConfig itself are not reported. A change is only applied once the file
+    has stayed the same for one interval, so an editor still writing it is not read half way.
+    The registered callbacks receive the ConfigChanges returned by MyConfig.Reload."""
+
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+        threading.Thread.__init__(self, group=group, target=target, name="ConfigWatcher")
+        self.shutdown_flag = threading.Event()
+
+        self.args = args
+        self.kwargs = kwargs
+        if kwargs["log"] != None:
+            self.log = kwargs["log"]
+        self.config = kwargs["config"]
+        self.interval = kwargs.get("interval", 2)
+
+        self.callback = []
+        self.pendingSignature = None
+        return
+
+    def registerCallBack(self, callbackFunction):
+        self.callback.append(callbackFunction)
+
+    #---------------------ConfigWatcher::checkForChanges-----------------------
+    def checkForChanges(self):
+        # returns the ConfigChanges applied, or None if there was nothing to do
+        if not self.config.FileChanged():
+            self.pendingSignature = None
+            return None
+        signature = self.config.GetFileSignature()
+        if signature == None or signature != self.pendingSignature:
+            # wait for the file to settle
+            self.pendingSignature = signature
+            return None
+        self.pendingSignature = None
+
+        changes = self.config.Reload()
+        if changes == None or changes.isEmpty():
+            return None
+        for function in self.callback:
+            try:
+                function(changes)
+            except Exception as e1:
+                self.LogError("Error applying config changes: " + str(e1))
+        return changes
+
+    def run(self):
+        self.LogInfo("Watching config file " + str(self.config.FileName) + " for changes")
+        while not self.shutdown_flag.wait(self.interval):
+            try:
+                self.checkForChanges()
+            except Exception as e1:
+                self.LogError("Error checking config file for changes: " + str(e1))
+
+        self.LogError("Received Signal to shut down ConfigWatcher thread")
+        return
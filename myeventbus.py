@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import sys
+import collections
+import threading
+import time
+
+try:
+    from mylog import MyLog
+    from mymetrics import LatencyStats
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class Subscriber(threading.Thread, MyLog):
+    """Delivers the events of an EventBus to one callback, on its own thread.
+
+    Undelivered events are kept per key: an event replaces the pending one with the same
+    key (e.g. the position of a shutter), so a slow callback only ever gets the latest
+    value and the backlog is bounded by the number of keys. Keys are delivered in the order
+    they first became pending. lag measures the time from publish to the end of delivery."""
+
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+        threading.Thread.__init__(self, group=group, target=target, name="Subscriber " + kwargs["name"])
+        MyLog.__init__(self)
+        self.daemon = True
+        self.shutdown_flag = threading.Event()
+
+        self.args = args
+        self.kwargs = kwargs
+        if kwargs["log"] != None:
+            self.log = kwargs["log"]
+        self.function = kwargs["function"]
+        self.slowThreshold = kwargs.get("slowThreshold", 1.0)
+
+        self.condition = threading.Condition()
+        self.pending = collections.OrderedDict()    # key -> (args, time of the oldest undelivered publish)
+        self.coalesced = 0
+        self.lag = LatencyStats("Event lag " + kwargs["name"])
+
+    #---------------------Subscriber::post-------------------------------------
+    def post(self, key, args, publishTime):
+        with self.condition:
+            if key in self.pending:
+                # the subscriber has not caught up, only the latest value is delivered
+                publishTime = self.pending[key][1]
+                self.coalesced += 1
+            self.pending[key] = (args, publishTime)
+            self.condition.notify()
+
+    #---------------------Subscriber::backlog----------------------------------
+    def backlog(self):
+        with self.condition:
+            return len(self.pending)
+
+    #---------------------Subscriber::shutdown---------------------------------
+    def shutdown(self, timeout = 2):
+        # events still pending are delivered for at most timeout seconds
+        with self.condition:
+            self.shutdown_flag.set()
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not len(self.pending) and not self.shutdown_flag.is_set():
+                    self.condition.wait()
+                if not len(self.pending):
+                    break
+                key, (args, publishTime) = self.pending.popitem(last = False)
+
+            startTime = time.monotonic()
+            try:
+                self.function(*args)
+            except Exception as e1:
+                self.LogError("Error in event callback " + self.kwargs["name"] + " for " + str(key) + ": " + str(e1))
+            endTime = time.monotonic()
+            self.lag.add(endTime - publishTime)
+            if endTime - startTime > self.slowThreshold:
+                self.LogWarn("Event callback " + self.kwargs["name"] + " took " + str(round(endTime - startTime, 1)) + " seconds, " + self.lag.summary())
+
+        self.LogDebug("Received Signal to shut down " + self.name + " thread")
+        return
+
+class EventBus(MyLog):
+    """Publishes events to subscribers without waiting for them.
+
+    publish() only queues the event for every subscriber and returns, each subscriber
+    runs its callback on its own thread (see Subscriber), so a stalled subscriber
+    neither delays the publisher nor the other subscribers."""
+
+    def __init__(self, log = None):
+        super(EventBus, self).__init__()
+        if log != None:
+            self.log = log
+        self.lock = threading.Lock()
+        self.subscribers = []
+
+    #---------------------EventBus::subscribe----------------------------------
+    def subscribe(self, function, name = None):
+        if name == None:
+            name = getattr(function, "__qualname__", str(function))
+        subscriber = Subscriber(kwargs={'log': self.log, 'function': function, 'name': name})
+        subscriber.start()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    #---------------------EventBus::publish------------------------------------
+    def publish(self, key, *args):
+        # events with the same key replace each other until delivered
+        publishTime = time.monotonic()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.post(key, args, publishTime)
+
+    #---------------------EventBus::summary------------------------------------
+    def summary(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        return "; ".join(subscriber.lag.summary() + ", backlog " + str(subscriber.backlog()) + ", coalesced " + str(subscriber.coalesced)
+                         for subscriber in subscribers)
+
+    #---------------------EventBus::shutdown-----------------------------------
+    def shutdown(self):
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.shutdown()
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+import os, shutil
+
+#---------------------readRecords----------------------------------------------
+def readRecords(filename, parse):
+    # Returns the records of the append-only file filename, each line turned into a record by
+    # parse (None if the line is not valid), and the first line that is not valid or None.
+    # Nothing valid can follow a torn write, the file is cut before that line so records
+    # appended later can be read back. A line without its newline is torn as well, else the
+    # next record would be appended to it.
+    records = []
+    tornLine = None
+    if not os.path.isfile(filename):
+        return records, tornLine
+    validBytes = 0
+    with open(filename, 'rb') as recordsFile:
+        for line in recordsFile:
+            record = parse(line.decode(errors = 'replace')) if line.endswith(b"\n") else None
+            if record == None:
+                tornLine = line.decode(errors = 'replace').strip()
+                break
+            records.append(record)
+            validBytes += len(line)
+    if tornLine != None:
+        with open(filename, 'r+b') as recordsFile:
+            recordsFile.truncate(validBytes)
+            recordsFile.flush()
+            os.fsync(recordsFile.fileno())
+    return records, tornLine
+
+#---------------------replaceFile----------------------------------------------
+def replaceFile(filename, content, copyMode = False):
+    # Writes content to a temporary file which then replaces filename, so the file on disk is
+    # always either the old or the new version, never a torn one. The directory is fsynced
+    # as well, else a power loss could undo the rename. Raises on error.
+    tempFileName = filename + ".tmp"
+    with open(tempFileName, 'w') as tempFile:
+        if copyMode and os.path.isfile(filename):
+            shutil.copymode(filename, tempFileName)
+        tempFile.write(content)
+        tempFile.flush()
+        os.fsync(tempFile.fileno())
+    os.replace(tempFileName, filename)
+    directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+import threading, collections, bisect
+
+#------------ LatencyStats class -----------------------------------------------
+class LatencyStats(object):
+    """Running statistics of a duration measured in seconds"""
+
+    def __init__(self, name, size = 100):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.last = None
+        self.min = None
+        self.max = None
+        self.recent = collections.deque(maxlen = size)
+
+    #---------------------LatencyStats::add------------------------------------
+    def add(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.min = seconds if self.min == None else min(self.min, seconds)
+            self.max = seconds if self.max == None else max(self.max, seconds)
+            self.recent.append(seconds)
+
+    #---------------------LatencyStats::asDict---------------------------------
+    def asDict(self):
+        with self.lock:
+            return {'count': self.count, 'last': self.last, 'min': self.min, 'max': self.max,
+                    'mean': self.total / self.count if self.count else None}
+
+    #---------------------LatencyStats::summary--------------------------------
+    def summary(self):
+        stats = self.asDict()
+        if not stats['count']:
+            return self.name + ": no samples"
+        return "%s: last %.1f ms, mean %.1f ms, max %.1f ms (n=%d)" % (self.name, stats['last'] * 1000,
+                                                                      stats['mean'] * 1000, stats['max'] * 1000, stats['count'])
+
+#------------ LatencyHistogram class -------------------------------------------
+class LatencyHistogram(object):
+    """Count of durations in seconds per bucket, bounds are the upper limits of the buckets"""
+
+    DEFAULT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1.0)
+
+    def __init__(self, name, bounds = DEFAULT_BOUNDS):
+        self.name = name
+        self.lock = threading.Lock()
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)      # the last bucket counts values above all bounds
+
+    #---------------------LatencyHistogram::add--------------------------------
+    def add(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+
+    #---------------------LatencyHistogram::asDict-----------------------------
+    def asDict(self):
+        with self.lock:
+            buckets = {"<=%g" % bound: count for bound, count in zip(self.bounds, self.counts)}
+            buckets[">%g" % self.bounds[-1]] = self.counts[-1]
+            return buckets
+
+    #---------------------LatencyHistogram::summary----------------------------
+    def summary(self):
+        with self.lock:
+            counts = list(self.counts)
+        if not sum(counts):
+            return self.name + ": no samples"
+        buckets = ["<=%g ms: %d" % (bound * 1000, count) for bound, count in zip(self.bounds, counts) if count]
+        if counts[-1]:
+            buckets.append(">%g ms: %d" % (self.bounds[-1] * 1000, counts[-1]))
+        return self.name + ": " + ", ".join(buckets)
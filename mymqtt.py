@@ -113,6 +113,24 @@ class MQTT(threading.Thread, MyLog):
         for shutter, shutterId in sorted(self.config.ShuttersByName.items(), key=lambda kv: kv[1]):
             self.sendMQTT("homeassistant/cover/"+shutterId+"/config", str(DiscoveryMsg(shutter, shutterId)))
 
+    def applyConfigChanges(self, changes):
+        # Called by the ConfigWatcher, only the shutters affected are (un)subscribed. If not
+        # connected there is nothing to do, on_connect subscribes to all shutters.
+        if not self.connected_flag:
+            return
+        for shutterId in changes.shuttersRemoved:
+            self.LogInfo("Unsubscribe from shutter: "+shutterId)
+            self.t.unsubscribe("somfy/"+shutterId+"/level/cmd")
+            if self.config.EnableDiscovery == True:
+                # an empty retained config removes the entity from Home Assistant
+                self.sendMQTT("homeassistant/cover/"+shutterId+"/config", "")
+        for shutterId in changes.shuttersAdded:
+            self.LogInfo("Subscribe to shutter: "+self.config.Shutters[shutterId]['name'])
+            self.t.subscribe("somfy/"+shutterId+"/level/cmd")
+        if self.config.EnableDiscovery == True:
+            for shutterId in changes.shuttersAdded + list(changes.shuttersRenamed):
+                self.sendMQTT("homeassistant/cover/"+shutterId+"/config", str(DiscoveryMsg(self.config.Shutters[shutterId]['name'], shutterId)))
+
     def on_connect(self, client, userdata, flags, rc):
         if rc==0:
             self.LogInfo("Connected to MQTT with result code "+str(rc))
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import sys, time
+import threading
+import pigpio
+
+try:
+    from mylog import MyLog
+    from mymetrics import LatencyStats
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+# PIGPIOHost running the in-process simulator instead of connecting to pigpiod
+SIMULATOR_HOST = "simulator"
+
+def createPi(host, port):
+    # the simulator is test scaffolding, only imported when asked for
+    if host == SIMULATOR_HOST:
+        from pigpioSimulator import SimulatedPi
+        return SimulatedPi(host, port)
+    return pigpio.pi(host, port)
+
+class PigpioConnection(MyLog):
+    """Long-lived connection to pigpiod, shared by the GPIO and RFM69 transmit backends.
+
+    The connection is opened on first use and re-used afterwards. If it has been idle for
+    longer than healthCheckInterval seconds it is checked before being handed out, and
+    reset() drops it so the next get() reconnects (e.g. after pigpiod was restarted)."""
+
+    def __init__(self, host = "localhost", port = 8888, log = None, healthCheckInterval = 30, factory = None):
+        super(PigpioConnection, self).__init__()
+        if log != None:
+            self.log = log
+        self.host = host
+        self.port = port
+        self.healthCheckInterval = healthCheckInterval
+        self.factory = factory if factory != None else createPi
+        self.lock = threading.Lock()
+        self.pi = None
+        self.lastUsedTime = 0
+        self.connectTime = LatencyStats("pigpio connect")
+
+    #---------------------PigpioConnection::get--------------------------------
+    def get(self):
+        with self.lock:
+            if (self.pi != None) and (time.monotonic() - self.lastUsedTime > self.healthCheckInterval) and not self._isHealthy():
+                self.LogWarn("pigpio connection to " + self.host + ":" + str(self.port) + " is not healthy anymore, reconnecting")
+                self._close()
+            if self.pi == None:
+                self._connect()
+            self.lastUsedTime = time.monotonic()
+            return self.pi
+
+    #---------------------PigpioConnection::reset------------------------------
+    def reset(self):
+        with self.lock:
+            self._close()
+
+    #---------------------PigpioConnection::stop-------------------------------
+    def stop(self):
+        self.reset()
+
+    def _connect(self):
+        startTime = time.monotonic()
+        pi = self.factory(self.host, self.port)
+        if not pi.connected:
+            raise RuntimeError("Cannot connect to pigpiod on " + self.host + ":" + str(self.port) + ", is the daemon running? (sudo pigpiod)")
+        self.pi = pi
+        self.connectTime.add(time.monotonic() - startTime)
+        self.LogInfo("Connected to pigpiod on " + self.host + ":" + str(self.port) + " (" + self.connectTime.summary() + ")")
+
+    def _close(self):
+        if self.pi != None:
+            try:
+                self.pi.stop()
+            except Exception as e1:
+                self.LogDebug("Error closing pigpio connection: " + str(e1))
+            self.pi = None
+
+    def _isHealthy(self):
+        try:
+            self.pi.get_current_tick()
+            return True
+        except Exception as e1:
+            self.LogDebug("pigpio health check failed: " + str(e1))
+            return False
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import sys, os
+import threading
+import zlib
+
+try:
+    from mylog import MyLog
+    from myfiles import readRecords, replaceFile
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class PositionStore(MyLog):
+    """Shutter positions kept on disk as a snapshot plus an append-only journal.
+
+    Every record is one line "<shutterId> <position> <direction> <time> <target> <crc32>": while
+    moving, the position the move started from at the wall clock time given, and the position
+    it ends at (target, '-' when not moving). update() only keeps the latest record of
+    each shutter in memory; they are appended to the journal together, with one fsync, after
+    writeDelay seconds. Once the journal holds compactEvery records the current state is
+    written to the snapshot (atomically replaced) and the journal is emptied. On startup
+    load() reads the snapshot and replays the journal over it."""
+
+    def __init__(self, filename, log = None, writeDelay = 1.0, compactEvery = 500):
+        super(PositionStore, self).__init__()
+        if log != None:
+            self.log = log
+        self.FileName = filename
+        self.JournalFileName = filename + ".journal"
+        self.writeDelay = writeDelay
+        self.compactEvery = compactEvery
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.states = {}            # shutterId -> (position, direction, time, target)
+        self.pending = {}           # shutterId -> record not yet in the journal, None if removed
+        self.flushTimer = None
+        self.records = 0            # records in the journal file
+        self.file = None
+
+    #---------------------PositionStore::load----------------------------------
+    def load(self):
+        # returns {shutterId: (position, direction, time, target)}
+        states = {}
+        self._read(self.FileName, states)
+        records = self._read(self.JournalFileName, states)
+        with self.lock:
+            self.states = states
+            self.records = records
+        if records:
+            self.compact()
+        else:
+            self._open()
+        self.LogDebug("Restored the position of " + str(len(states)) + " shutter(s) from " + self.FileName)
+        return dict(states)
+
+    #---------------------PositionStore::update--------------------------------
+    def update(self, shutterId, position, direction, time, target = None):
+        with self.lock:
+            self.pending[shutterId] = (position, direction, time, target)
+            self._scheduleFlush()
+
+    #---------------------PositionStore::remove--------------------------------
+    def remove(self, shutterId):
+        with self.lock:
+            self.pending[shutterId] = None
+            self._scheduleFlush()
+
+    #---------------------PositionStore::flush---------------------------------
+    def flush(self):
+        # appends the pending records to the journal, returns False on error
+        pending = {}
+        try:
+            with self.flushLock:
+                with self.lock:
+                    if self.flushTimer != None:
+                        self.flushTimer.cancel()
+                        self.flushTimer = None
+                    pending, self.pending = self.pending, {}
+                if not len(pending):
+                    return True
+                lines = ""
+                for shutterId, state in pending.items():
+                    lines += self._format(shutterId, state)
+                self.file.write(lines)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                with self.lock:
+                    for shutterId, state in pending.items():
+                        if state == None:
+                            self.states.pop(shutterId, None)
+                        else:
+                            self.states[shutterId] = state
+                    self.records += len(pending)
+                    compact = self.records >= self.compactEvery
+            if compact:
+                return self.compact()
+            return True
+        except Exception as e1:
+            with self.lock:
+                # keep the records for the next flush, newer updates win
+                pending.update(self.pending)
+                self.pending = pending
+            self.LogError("Error writing shutter positions: " + str(e1))
+            return False
+
+    #---------------------PositionStore::compact-------------------------------
+    def compact(self):
+        # writes the snapshot and empties the journal, returns False on error
+        try:
+            with self.flushLock:
+                with self.lock:
+                    states = dict(self.states)
+                lines = ""
+                for shutterId, state in states.items():
+                    lines += self._format(shutterId, state)
+                replaceFile(self.FileName, lines)
+
+                # the journal is only emptied once the snapshot holds its records
+                if self.file != None:
+                    self.file.close()
+                with open(self.JournalFileName, 'w') as journal:
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                with self.lock:
+                    self.records = 0
+                self._open()
+            return True
+        except Exception as e1:
+            self.LogError("Error writing shutter positions snapshot: " + str(e1))
+            if self.file == None or self.file.closed:
+                self._open()
+            return False
+
+    #---------------------PositionStore::close---------------------------------
+    def close(self):
+        self.flush()
+        self.compact()
+        with self.flushLock:
+            if self.file != None:
+                self.file.close()
+                self.file = None
+
+    def _scheduleFlush(self):
+        # called with lock held, updates made within writeDelay are written together
+        if self.flushTimer == None:
+            self.flushTimer = threading.Timer(self.writeDelay, self.flush)
+            self.flushTimer.daemon = True
+            self.flushTimer.start()
+
+    def _open(self):
+        self.file = open(self.JournalFileName, 'a')
+
+    def _read(self, filename, states):
+        # applies the records of filename to states, returns the number of records read
+        records, tornLine = readRecords(filename, self._parse)
+        if tornLine != None:
+            self.LogWarn("Ignoring incomplete shutter position record: " + tornLine)
+        for shutterId, state in records:
+            if state == None:
+                states.pop(shutterId, None)
+            else:
+                states[shutterId] = state
+        return len(records)
+
+    def _format(self, shutterId, state):
+        if state == None:
+            line = "%s - - - -" % shutterId
+        else:
+            position, direction, time, target = state
+            line = "%s %.2f %s %.3f %s" % (shutterId, position, direction if direction != None else '-', time, "%.2f" % target if target != None else '-')
+        return line + " %08x\n" % zlib.crc32(line.encode())
+
+    def _parse(self, line):
+        # records written before the target was saved have no target field
+        fields = line.split()
+        if len(fields) not in (5, 6):
+            return None
+        data = " ".join(fields[:-1])
+        try:
+            if int(fields[-1], 16) != zlib.crc32(data.encode()):
+                return None
+            if fields[1] == '-':
+                return fields[0], None
+            target = float(fields[4]) if len(fields) == 6 and fields[4] != '-' else None
+            return fields[0], (float(fields[1]), fields[2] if fields[2] != '-' else None, float(fields[3]), target)
+        except ValueError:
+            return None
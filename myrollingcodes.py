@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+import sys, os
+import threading
+import zlib
+
+try:
+    from mylog import MyLog
+    from myfiles import readRecords
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class RollingCodeJournal(MyLog):
+    """Append-only journal of rolling code leases, kept next to the config file.
+
+    Instead of storing every code, a block of leaseSize codes is reserved per shutter and
+    only the end of the block is written, as one line "<shutterId> <leaseEnd> <crc32>",
+    and fsynced before any code of the block is used. Codes inside the block are handed
+    out from memory, so only one frame in leaseSize touches the disk. After a crash the
+    next code of a shutter is the end of its last lease: codes of the block that were
+    never sent are skipped, but a code can never be used twice.
+
+    The owner copies the codes back into the config file from time to time (compaction)
+    and then calls truncate(). On a clean shutdown the journal is left empty."""
+
+    def __init__(self, filename, log = None, leaseSize = 32, compactEvery = 1000):
+        super(RollingCodeJournal, self).__init__()
+        if log != None:
+            self.log = log
+        self.FileName = filename
+        self.leaseSize = leaseSize
+        self.compactEvery = compactEvery
+        self.lock = threading.Lock()
+        self.leases = {}            # shutterId -> first code not covered by the lease
+        self.records = 0            # records in the journal file
+        self.file = None
+
+    #---------------------RollingCodeJournal::load-----------------------------
+    def load(self):
+        # returns {shutterId: code} with the end of the last lease found for each shutter
+        leases = {}
+        records, tornLine = readRecords(self.FileName, self._parse)
+        if tornLine != None:
+            self.LogWarn("Ignoring incomplete rolling code journal record: " + tornLine)
+        for shutterId, leaseEnd in records:
+            leases[shutterId] = max(leaseEnd, leases.get(shutterId, leaseEnd))
+        records = len(records)
+        if records:
+            self.LogWarn("Rolling code journal " + self.FileName + " was not compacted on shutdown, continuing " + str(len(leases)) + " shutter(s) from the end of their lease")
+        with self.lock:
+            # the leases found were not handed out in this run, the next code starts a new one
+            self.leases = {}
+            self.records = records
+            self._open()
+        return leases
+
+    #---------------------RollingCodeJournal::lease----------------------------
+    def lease(self, shutterId, code):
+        # Makes sure code (the next code to be sent) is covered by a durable lease, returns
+        # True if the disk had to be touched
+        with self.lock:
+            if code <= self.leases.get(shutterId, -1):
+                return False
+            leaseEnd = code + self.leaseSize
+            line = "%s %d" % (shutterId, leaseEnd)
+            self.file.write(line + " %08x\n" % zlib.crc32(line.encode()))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.leases[shutterId] = leaseEnd
+            self.records += 1
+            return True
+
+    #---------------------RollingCodeJournal::leaseEnd-------------------------
+    def leaseEnd(self, shutterId):
+        with self.lock:
+            return self.leases.get(shutterId)
+
+    #---------------------RollingCodeJournal::needsCompaction------------------
+    def needsCompaction(self):
+        return self.records >= self.compactEvery
+
+    #---------------------RollingCodeJournal::truncate-------------------------
+    def truncate(self, release = False):
+        # Only to be called once the codes are durably stored elsewhere: the end of the
+        # leases while running, or the codes themselves with release set on shutdown.
+        with self.lock:
+            self.file.close()
+            with open(self.FileName, 'w') as journal:
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.records = 0
+            if release:
+                self.leases = {}
+            self._open()
+
+    #---------------------RollingCodeJournal::close----------------------------
+    def close(self):
+        with self.lock:
+            if self.file != None:
+                self.file.close()
+                self.file = None
+
+    def _open(self):
+        self.file = open(self.FileName, 'a')
+
+    def _parse(self, line):
+        fields = line.split()
+        if len(fields) != 3:
+            return None
+        data = fields[0] + " " + fields[1]
+        try:
+            if int(fields[2], 16) != zlib.crc32(data.encode()):
+                return None
+            return fields[0], int(fields[1])
+        except ValueError:
+            return None
@@ -13,9 +13,12 @@ import socket
 import signal, atexit, subprocess, traceback
 import logging, logging.handlers
 import threading
+import heapq
+import itertools
 
 try:
     from mylog import MyLog
+    from mysuntimes import SunTimes
 except Exception as e1:
     print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
     print("Error: " + str(e1))
@@ -27,7 +30,7 @@ class Event:
     ## repeatType: String: 'once' or 'weekday'
     ## repeatValue: Date in format "YYYY/MM/DD" or Array ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
     ## timeType: String: 'clock' or 'astro' are valid values
-    ## timeValue: String: Time in format "HH:MM" or values 'sunset' or 'sunrise' or 'sunset+MIN', 'sunset-MIN', 'sunrise+MIN', 'sunrise-MIN'
+    ## timeValue: String: Time in format "HH:MM" or "HH:MM:SS" or values 'sunset' or 'sunrise' or 'sunset+MIN', 'sunset-MIN', 'sunrise+MIN', 'sunrise-MIN'
     ## shutterAction: String: 'up', 'down' or 'stop' (My-Position) are valid values. If this is followed by an integer, this indicates the duration of the operation
     ## shutterIds: Array of shutterIds to operate
 
@@ -51,7 +54,7 @@ class Event:
             raise ValueError("%s is not a valid value for TIMETYPE." % timeType)
         self.timeType = timeType
 
-        if (timeType == "clock") and not time.strptime(timeValue, '%H:%M'):
+        if (timeType == "clock") and not time.strptime(timeValue, '%H:%M:%S' if timeValue.count(':') == 2 else '%H:%M'):
             raise ValueError("%s is not a valid value for TIMEVALUE (clock)." % timeValue )
         astro_parts = re.split('\+|\-', timeValue)
         if (timeType == "astro") and not ((astro_parts[0] in ('sunset', 'sunrise')) and ((len(astro_parts) == 1) or (astro_parts[1] == None or int(astro_parts[1])))):
@@ -85,6 +88,7 @@ class Schedule(MyLog):
         self.config = config
 
         self.schedule = {}
+        self.callback = []
         self.setUpdateTime()
         
     def addEvent(self, id, evt):
@@ -96,10 +100,10 @@ class Schedule(MyLog):
         try:
             self.LogDebug('addEvent: Lock aquired')
             self.schedule[id] = evt
-            self.setUpdateTime()
         finally:
             self.lock.release()
             self.LogDebug('addEvent: Lock released')
+        self.setUpdateTime(id)
             
     def getNewId(self):
         ids = []
@@ -175,8 +179,13 @@ class Schedule(MyLog):
         shutterIdsList = data['shutterIds[]']
         shutterIdsStr = "|".join(shutterIdsList)
            
-        self.config.WriteValue(str(id), active+","+repeatType+","+repeatValueStr+","+timeType+","+timeValue+","+shutterAction+","+shutterIdsStr, 
-                                   section="Scheduler");
+        try:
+            with self.config.transaction():
+                self.config.WriteValue(str(id), active+","+repeatType+","+repeatValueStr+","+timeType+","+timeValue+","+shutterAction+","+shutterIdsStr, 
+                                       section="Scheduler");
+        except Exception as e1:
+            self.LogError("Failed to add schedule: " + str(e1))
+            return {'status': 'ERROR', 'message': 'Not able to save the schedule'}
         self.config.Schedule[str(id)] = {'active': active, 'repeatType': repeatType, 'repeatValue': repeatValueStr, 
                                     'timeType': timeType, 'timeValue': timeValue, 'shutterAction': shutterAction, 
                                     'shutterIds': shutterIdsStr}
@@ -185,7 +194,6 @@ class Schedule(MyLog):
         evt =  Event(active,repeatType,repeatValueList,timeType,timeValue,shutterAction,shutterIdsList)
         self.addEvent(str(id), evt)
             
-        self.setUpdateTime()
         return { 'status': 'OK', 'id': str(id) }
 
     def editSchedule(self, id, data):
@@ -203,8 +211,13 @@ class Schedule(MyLog):
             shutterIdsList = data['shutterIds[]']
             shutterIdsStr = "|".join(shutterIdsList)
             
-            self.config.WriteValue(str(id), active+","+repeatType+","+repeatValueStr+","+timeType+","+timeValue+","+shutterAction+","+shutterIdsStr, 
-                                   section="Scheduler");
+            try:
+                with self.config.transaction():
+                    self.config.WriteValue(str(id), active+","+repeatType+","+repeatValueStr+","+timeType+","+timeValue+","+shutterAction+","+shutterIdsStr, 
+                                           section="Scheduler");
+            except Exception as e1:
+                self.LogError("Failed to edit schedule: " + str(e1))
+                return {'status': 'ERROR', 'message': 'Not able to save the schedule'}
             self.config.Schedule[id] = {'active': active, 'repeatType': repeatType, 'repeatValue': repeatValueStr, 
                                         'timeType': timeType, 'timeValue': timeValue, 'shutterAction': shutterAction, 
                                         'shutterIds': shutterIdsStr}
@@ -213,7 +226,6 @@ class Schedule(MyLog):
             evt =  Event(active,repeatType,repeatValueList,timeType,timeValue,shutterAction,shutterIdsList)
             self.addEvent(id, evt)
             
-            self.setUpdateTime()
             return {'status': 'OK'}
 
     def deleteSchedule(self, id):
@@ -226,9 +238,26 @@ class Schedule(MyLog):
                                             evt['shutterIds'], section="Scheduler");
             self.config.Schedule.pop(id, None)
             self.schedule.pop(id, None)
-            self.setUpdateTime()
+            self.setUpdateTime(id)
             return {'status': 'OK'}
             
+    def applyConfigChanges(self, changes):
+        # Called by the ConfigWatcher after the config file was changed by hand
+        for id in changes.schedulesRemoved:
+            self.schedule.pop(id, None)
+            self.setUpdateTime(id)
+        for id in changes.schedulesAdded + changes.schedulesChanged:
+            data = self.config.Schedule[id]
+            try:
+                repeatValue = data['repeatValue'].split("|") if data['repeatType'] == 'weekday' else data['repeatValue']
+                evt = Event(data['active'],data['repeatType'],repeatValue,data['timeType'],data['timeValue'],data['shutterAction'],data['shutterIds'].split("|"))
+            except ValueError as ex:
+                self.LogError("Failed to load schedule "+str(id)+" from config file: "+ str(ex))
+                self.schedule.pop(id, None)
+                self.setUpdateTime(id)
+                continue
+            self.addEvent(id, evt)
+
     def printSchedule(self):
         for id, evt in self.schedule.items():
            print ("")
@@ -246,19 +275,39 @@ class Schedule(MyLog):
                 obj[id] = item
         return obj
 
-    def setUpdateTime(self):
+    def registerCallBack(self, callbackFunction):
+        # called with the id of the changed event, or None if all events may have changed
+        self.callback.append(callbackFunction)
+
+    def setUpdateTime(self, id = None):
         self.updateTime = int(time.time())
+        for function in self.callback:
+            function(id)
 
     def getUpdateTime(self):
         return self.updateTime
         
 
 class Scheduler(threading.Thread, MyLog):
+    """Runs the events of a Schedule at their time, to the second.
+
+    The next fire time of every active event is kept in a heap, as a local (wall clock)
+    datetime. The thread sleeps until the earliest one and, once it has fired, only that
+    event is rescheduled; an edited event is rescheduled the same way, both in O(log n).
+    Entries replaced in the heap are skipped when they come up (version mismatch).
+    The sleep is timed by the monotonic clock, so a jump of the wall clock (NTP, DST)
+    is detected by comparing both clocks on wake up, and the whole heap is then rebuilt.
+    To notice jumps while idle, the thread wakes up at least every maxSleep seconds."""
+
+    weekDays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    maxSleep = 3600
+    clockJumpThreshold = 2
+    maxLateness = 3600              # events skipped by a wall clock jump forward fire late up to this
 
     def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
         threading.Thread.__init__(self, group=group, target=target, name="Scheduler")
         self.shutdown_flag = threading.Event()
-        
+
         self.args = args
         self.kwargs = kwargs
         if kwargs["log"] != None:
@@ -266,102 +315,196 @@ class Scheduler(threading.Thread, MyLog):
         self.schedule = kwargs["schedule"]
         self.shutter = kwargs["shutter"]
         self.config = kwargs["config"]
-        self.weekday = datetime.datetime.today().weekday()
-        self.lastScheduleUpdateTime = 0
-        self.currentSchedule = {}
 
-        self.homeLocation = ephem.Observer()
+        self.wakeup = threading.Event()
+        self.changesLock = threading.Lock()
+        self.changes = set()            # ids of the events changed since last wake up, None for all
+        self.heap = []                  # (fireTime, version, id)
+        self.entries = {}               # id -> (fireTime, version) of the valid heap entry
+        self.lastFired = {}             # id -> fireTime, an event never fires twice for the same time
+        self.version = itertools.count()
+
+        self.sunTimes = kwargs.get("sunTimes", None)
+        if self.sunTimes == None:
+            self.sunTimes = SunTimes(log=self.log, config=self.config)
         locale.setlocale(locale.LC_TIME,'')
+        self.schedule.registerCallBack(self.scheduleChanged)
         return
 
-    def updateSchedule(self):
-        weekDays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-        
-        self.homeLocation.lat = str(self.config.Latitude)
-        self.homeLocation.lon = str(self.config.Longitude)
-        self.homeLocation.date = datetime.datetime.now().strftime("%Y/%m/%d 00:00:00")
-        sunrise = ephem.localtime(self.homeLocation.next_rising(ephem.Sun()))
-        sunset = ephem.localtime(self.homeLocation.next_setting(ephem.Sun()))
-        weekday = weekDays[datetime.datetime.today().weekday()]
-        date    = datetime.datetime.today().strftime('%Y/%m/%d')
-        self.LogInfo("Today is "+date+", a "+weekday+", Sunrise is at "+str(sunrise.time())+" and Sunset is at "+ str(sunset.time()));
-
-        self.currentSchedule = {}
-        for id, event in self.schedule.getSchedule().items():
-            if ((event.active == "active") and (((event.repeatType == 'weekday') and (weekday in event.repeatValue)) or ((event.repeatType == 'once') and (date == event.repeatValue)))):
-                if (event.timeType == "clock"):
-                    eventTime = datetime.time(int(event.timeValue.split(":")[0]), int(event.timeValue.split(":")[1]), 0)
-                elif ((event.timeType == "astro") and (event.timeValue.startswith("sunrise"))):
-                    eventTime = (sunrise + datetime.timedelta(minutes=int(event.timeValue[7:] or 0))).time()
-                elif ((event.timeType == "astro") and (event.timeValue.startswith("sunset"))):
-                    eventTime = (sunset + datetime.timedelta(minutes=int(event.timeValue[6:] or 0))).time()
-
-                if (eventTime > datetime.datetime.now().time()): 
-                    eventTimeStr = "%02d:%02d" % (eventTime.hour, eventTime.minute)
-                    if not eventTimeStr in self.currentSchedule:
-                        self.currentSchedule[eventTimeStr] = []
-                    self.currentSchedule[eventTimeStr].append([event.shutterIds, event.shutterAction])  
-        self.LogDebug(str(self.currentSchedule))
-    
+    #---------------------Scheduler::scheduleChanged---------------------------
+    def scheduleChanged(self, id = None):
+        # called by Schedule, id None means every event may have changed (e.g. the location)
+        with self.changesLock:
+            if id == None or self.changes == None:
+                self.changes = None
+            else:
+                self.changes.add(id)
+        self.wakeup.set()
+
+    #---------------------Scheduler::shutdown----------------------------------
+    def shutdown(self):
+        self.shutdown_flag.set()
+        self.wakeup.set()
+
+    #---------------------Scheduler::getSunTimes-------------------------------
+    def getSunTimes(self, day):
+        # local sunrise and sunset of the date day, None if the sun does not rise or set
+        return self.sunTimes.get(day)
+
+    #---------------------Scheduler::getEventTime------------------------------
+    def getEventTime(self, event, day):
+        if (event.timeType == "clock"):
+            parts = [int(part) for part in event.timeValue.split(":")]
+            return datetime.datetime.combine(day, datetime.time(parts[0], parts[1], parts[2] if len(parts) > 2 else 0))
+        sunrise, sunset = self.getSunTimes(day)
+        if (event.timeValue.startswith("sunrise")):
+            return sunrise + datetime.timedelta(minutes=int(event.timeValue[7:] or 0)) if sunrise != None else None
+        return sunset + datetime.timedelta(minutes=int(event.timeValue[6:] or 0)) if sunset != None else None
+
+    #---------------------Scheduler::getNextFireTime---------------------------
+    def getNextFireTime(self, event, after):
+        # first time strictly after the datetime after at which event fires, None if never
+        if (event.active != "active"):
+            return None
+        if (event.repeatType == 'once'):
+            day = datetime.datetime.strptime(event.repeatValue, '%Y/%m/%d').date()
+            fireTime = self.getEventTime(event, day)
+            return fireTime if fireTime != None and fireTime > after else None
+        # an astro event with an offset can fall on the day before or after its date
+        for days in range(-1, 9):
+            day = after.date() + datetime.timedelta(days=days)
+            if (self.weekDays[day.weekday()] in event.repeatValue):
+                fireTime = self.getEventTime(event, day)
+                if (fireTime != None and fireTime > after):
+                    return fireTime
+        return None
+
+    #---------------------Scheduler::reschedule--------------------------------
+    def reschedule(self, id, after):
+        # replaces the heap entry of the event id, O(log n)
+        self.entries.pop(id, None)
+        event = self.schedule.getSchedule().get(id)
+        if (event == None):
+            return
+        if (id in self.lastFired):
+            after = max(after, self.lastFired[id])
+        try:
+            fireTime = self.getNextFireTime(event, after)
+        except Exception as e1:
+            self.LogError("Not able to schedule event " + str(id) + ": " + str(e1))
+            return
+        if (fireTime == None):
+            return
+        version = next(self.version)
+        self.entries[id] = (fireTime, version)
+        heapq.heappush(self.heap, (fireTime, version, id))
+        if (len(self.heap) > 2 * len(self.entries) + 16):
+            # too many replaced entries left behind, O(n) once in a while
+            self.heap = [(entry[0], entry[1], key) for key, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+        self.LogDebug("Event " + str(id) + " (" + event.shutterAction + ") scheduled for " + fireTime.strftime("%Y/%m/%d %H:%M:%S"))
+
+    #---------------------Scheduler::updateSchedule----------------------------
+    def updateSchedule(self, after):
+        self.heap = []
+        self.entries = {}
+        for id in list(self.schedule.getSchedule()):
+            self.reschedule(id, after)
+        sunrise, sunset = self.getSunTimes(after.date())
+        self.LogInfo("Today is "+after.strftime('%Y/%m/%d')+", a "+self.weekDays[after.weekday()]+", Sunrise is at "+(str(sunrise.time()) if sunrise != None else "-")+
+                     " and Sunset is at "+ (str(sunset.time()) if sunset != None else "-") +
+                     ", " + str(len(self.entries)) + " event(s) scheduled");
+
+    #---------------------Scheduler::nextEvent---------------------------------
+    def nextEvent(self):
+        # returns the valid head entry of the heap, dropping the replaced ones
+        while len(self.heap):
+            fireTime, version, id = self.heap[0]
+            if (self.entries.get(id) == (fireTime, version)):
+                return self.heap[0]
+            heapq.heappop(self.heap)
+        return None
+
+    #---------------------Scheduler::fireEvent---------------------------------
+    def fireEvent(self, event):
+        for shutterId in event.shutterIds:
+            try:
+                self.LogInfo("Send action \""+event.shutterAction+"\" to shutterId \""+shutterId+"\" at " + datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S"))
+                if (event.shutterAction.startswith("up")):
+                    s = event.shutterAction[2:].strip()
+                    s1 = int(s) if s else -1
+                    if (0 < s1 < 100):
+                        if (self.shutter.getPosition(shutterId) < s1):   #Is Shutter below requested Position?
+                            self.shutter.risePartial(shutterId, s1)
+                        else:
+                            self.LogWarn("Send action \""+event.shutterAction+"\" to shutterId \""+shutterId+"\" was canceled! Shutter was already at same or above requested position")                                      
+                    else :  
+                        for i in range(self.config.SendRepeat):
+                            self.shutter.rise(shutterId)
+                            time.sleep(5)
+                elif (event.shutterAction.startswith("down")):
+                    s = event.shutterAction[4:].strip()
+                    s1 = int(s) if s else -1
+                    if (0 < s1 < 100):
+                        if (self.shutter.getPosition(shutterId) > s1):   #Is Shutter above requested Position?
+                            self.shutter.lowerPartial(shutterId, s1)
+                        else:
+                            self.LogWarn("Send action \""+event.shutterAction+"\" to shutterId \""+shutterId+"\" was canceled! Shutter was already at same or below requested position")                                         
+                    else :  
+                        for i in range(self.config.SendRepeat):
+                            self.shutter.lower(shutterId)
+                            time.sleep(5)
+                elif (event.shutterAction.startswith("stop")):
+                    self.shutter.stop(shutterId)
+            except:
+                self.LogError ("Error: cannot open "+shutterId)
+                self.LogError (traceback.format_exc())
+
     def run(self):
-        # self.schedule.printSchedule()
+        now = datetime.datetime.now()
+        self.updateSchedule(now)
         while not self.shutdown_flag.is_set():
-            currentScheduleUpdateTime = self.schedule.getUpdateTime();
-            if ((self.lastScheduleUpdateTime < currentScheduleUpdateTime) or (self.weekday != datetime.datetime.today().weekday())):
-                self.updateSchedule()
-                self.weekday = datetime.datetime.today().weekday()
-                self.lastScheduleUpdateTime = currentScheduleUpdateTime
-               
-            ## check next event 
-            timeNow = datetime.datetime.now().time()
-            timeNowStr = "%02d:%02d" % (timeNow.hour, timeNow.minute)
-            eventsToDelete = [];
-            for eventTimeStr, eventDetails in self.currentSchedule.items():
-                if (eventTimeStr <= timeNowStr):
-                    for eventDetail in eventDetails:
-                        for shutterId in eventDetail[0]:
-                            try:
-                                self.LogInfo("Send action \""+eventDetail[1]+"\" to shutterId \""+shutterId+"\" at " + datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S"))
-                                if (eventDetail[1].startswith("up")):
-                                    s = eventDetail[1][2:].strip()
-                                    s1 = int(s) if s else -1
-                                    if (0 < s1 < 100):
-                                        if (self.shutter.getPosition(shutterId) < s1):   #Is Shutter below requested Position?
-                                            self.shutter.risePartial(shutterId, s1)
-                                        else:
-                                            self.LogWarn("Send action \""+eventDetail[1]+"\" to shutterId \""+shutterId+"\" was canceled! Shutter was already at same or above requested position")                                      
-                                    else :  
-                                        for i in range(self.config.SendRepeat):
-                                            self.shutter.rise(shutterId)
-                                            time.sleep(5)
-                                elif (eventDetail[1].startswith("down")):
-                                    s = eventDetail[1][4:].strip()
-                                    s1 = int(s) if s else -1
-                                    if (0 < s1 < 100):
-                                        if (self.shutter.getPosition(shutterId) > s1):   #Is Shutter above requested Position?
-                                            self.shutter.lowerPartial(shutterId, s1)
-                                        else:
-                                            self.LogWarn("Send action \""+eventDetail[1]+"\" to shutterId \""+shutterId+"\" was canceled! Shutter was already at same or below requested position")                                         
-                                    else :  
-                                        for i in range(self.config.SendRepeat):
-                                            self.shutter.lower(shutterId)
-                                            time.sleep(5)
-                                elif (eventDetail[1].startswith("stop")):
-                                    self.shutter.stop(shutterId)
-                            except:
-              	                self.LogError ("Error: cannot open "+shutterId)
-              	                self.LogError (traceback.format_exc())
-                    eventsToDelete.append(eventTimeStr);    
-            for key in eventsToDelete:
-                try:
-                    del self.currentSchedule[key] 
-                except KeyError:
-                    pass
-            if (len(eventsToDelete) > 0):
-                self.LogDebug(str(self.currentSchedule))
-         
-            self.shutdown_flag.wait(60 - datetime.datetime.now().time().second)
-            
+            with self.changesLock:
+                changes, self.changes = self.changes, set()
+            if (changes == None):
+                self.updateSchedule(now)
+            else:
+                for id in changes:
+                    self.reschedule(id, now)
+
+            ## fire the events that are due
+            while not self.shutdown_flag.is_set():
+                entry = self.nextEvent()
+                if (entry == None or entry[0] > datetime.datetime.now()):
+                    break
+                fireTime, version, id = heapq.heappop(self.heap)
+                self.lastFired[id] = fireTime
+                event = self.schedule.getSchedule().get(id)
+                if (event != None):
+                    self.fireEvent(event)
+                # an event late by a clock jump fires only once
+                self.reschedule(id, max(fireTime, datetime.datetime.now()))
+
+            ## sleep until the next event, a change of the schedule or a wall clock jump
+            entry = self.nextEvent()
+            now = datetime.datetime.now()
+            timeout = self.maxSleep
+            if (entry != None):
+                timeout = min(timeout, max(0, (entry[0] - now).total_seconds()))
+            sleepStart = time.monotonic()
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+            expected = now + datetime.timedelta(seconds=time.monotonic() - sleepStart)
+            now = datetime.datetime.now()
+            jump = (now - expected).total_seconds()
+            if (abs(jump) > self.clockJumpThreshold):
+                self.LogWarn("Wall clock jumped by " + str(round(jump)) + " seconds, rescheduling all events")
+                # recent events skipped by a jump forward are still fired (late), lastFired
+                # prevents firing them again after a jump backwards
+                with self.changesLock:
+                    self.changes = None
+                now = max(min(now, expected), now - datetime.timedelta(seconds=self.maxLateness))
+
         self.LogError("Received Signal to shut down Scheduler thread")
         return
-
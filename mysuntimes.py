@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+import sys, os
+import datetime
+import json
+import threading
+import time
+
+try:
+    import ephem
+    from mylog import MyLog
+    from myfiles import replaceFile
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class SunTimes(MyLog):
+    """Local sunrise and sunset of every day of a year, for the location of the config.
+
+    The table is computed in one batch, with a single ephem Observer, when the location
+    (or the time zone) changes or the requested day is past its end, and is saved to
+    filename (if given) so a restart only reads it back. get() is then an index into the
+    table. Times are stored as seconds since local midnight, None when the sun does not
+    rise or set that day."""
+
+    def __init__(self, filename = None, log = None, config = None, days = 366):
+        super(SunTimes, self).__init__()
+        if log != None:
+            self.log = log
+        self.FileName = filename
+        self.config = config
+        self.days = days
+        self.lock = threading.Lock()
+        self.location = None        # (latitude, longitude, time zone) of the table
+        self.start = None           # date of the first row
+        self.table = []             # [(sunrise, sunset)] in seconds since local midnight
+        if self.FileName != None:
+            self.load()
+
+    #---------------------SunTimes::get----------------------------------------
+    def get(self, day):
+        # returns the local sunrise and sunset datetimes of the date day
+        with self.lock:
+            index = (day - self.start).days if self.start != None else -1
+            if self.location != self.getLocation() or index < 0 or index >= len(self.table):
+                self._update(day - datetime.timedelta(days=1))
+                index = (day - self.start).days
+            sunrise, sunset = self.table[index]
+        midnight = datetime.datetime.combine(day, datetime.time())
+        return (midnight + datetime.timedelta(seconds=sunrise) if sunrise != None else None,
+                midnight + datetime.timedelta(seconds=sunset) if sunset != None else None)
+
+    #---------------------SunTimes::update-------------------------------------
+    def update(self):
+        # recomputes the table from yesterday on, e.g. after the location was changed
+        with self.lock:
+            self._update(datetime.date.today() - datetime.timedelta(days=1))
+
+    #---------------------SunTimes::upcoming-----------------------------------
+    def upcoming(self, days = 7):
+        # {"YYYY/MM/DD": {'sunrise': "HH:MM:SS", 'sunset': "HH:MM:SS"}} from today on, for the web UI
+        result = {}
+        for offset in range(days):
+            day = datetime.date.today() + datetime.timedelta(days=offset)
+            sunrise, sunset = self.get(day)
+            result[day.strftime('%Y/%m/%d')] = {'sunrise': sunrise.strftime('%H:%M:%S') if sunrise != None else None,
+                                                'sunset': sunset.strftime('%H:%M:%S') if sunset != None else None}
+        return result
+
+    #---------------------SunTimes::getLocation--------------------------------
+    def getLocation(self):
+        # local times depend on the time zone as much as on the coordinates
+        return (float(self.config.Latitude), float(self.config.Longitude), "%s %d %d" % ("/".join(time.tzname), time.timezone, time.altzone))
+
+    #---------------------SunTimes::load---------------------------------------
+    def load(self):
+        # a cache that cannot be read (e.g. torn by a power loss) is ignored and computed again
+        try:
+            if not os.path.isfile(self.FileName):
+                return False
+            with open(self.FileName, 'r') as cache:
+                data = json.load(cache)
+            location = (data['latitude'], data['longitude'], data['timezone'])
+            start = datetime.datetime.strptime(data['start'], '%Y/%m/%d').date()
+            table = [tuple(row) for row in data['table']]
+        except Exception as e1:
+            self.LogWarn("Ignoring sun times cache " + self.FileName + ": " + str(e1))
+            return False
+        with self.lock:
+            self.location, self.start, self.table = location, start, table
+        self.LogDebug("Loaded sun times from " + data['start'] + " for " + str(len(table)) + " days")
+        return True
+
+    def _update(self, start):
+        # called with lock held
+        location = self.getLocation()
+        startTime = time.monotonic()
+        observer = ephem.Observer()
+        observer.lat = str(location[0])
+        observer.lon = str(location[1])
+        sun = ephem.Sun()
+        table = []
+        for offset in range(self.days):
+            midnight = datetime.datetime.combine(start + datetime.timedelta(days=offset), datetime.time())
+            # ephem works in UTC, the search starts at local midnight
+            observer.date = datetime.datetime.fromtimestamp(time.mktime(midnight.timetuple()), datetime.timezone.utc)
+            table.append((self._secondsAfter(midnight, observer.next_rising, sun),
+                          self._secondsAfter(midnight, observer.next_setting, sun)))
+        self.location, self.start, self.table = location, start, table
+        self.LogInfo("Computed sun times of " + str(self.days) + " days from " + start.strftime('%Y/%m/%d') + " for " + str(location[0]) + ", " + str(location[1]) +
+                     " in " + str(round((time.monotonic() - startTime) * 1000)) + " ms")
+        self._save()
+
+    def _secondsAfter(self, midnight, function, body):
+        try:
+            seconds = int(round((ephem.localtime(function(body)) - midnight).total_seconds()))
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            return None
+        # the next event may be on the day after, e.g. no sunset on a polar day
+        return seconds if seconds < 86400 else None
+
+    def _save(self):
+        if self.FileName == None:
+            return
+        data = {'latitude': self.location[0], 'longitude': self.location[1], 'timezone': self.location[2],
+                'start': self.start.strftime('%Y/%m/%d'), 'table': self.table}
+        try:
+            replaceFile(self.FileName, json.dumps(data, separators=(',', ':')))
+        except Exception as e1:
+            self.LogError("Error saving sun times to " + self.FileName + ": " + str(e1))
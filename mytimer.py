@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+import sys
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    from mylog import MyLog
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class TimerHandle(object):
+    """A callback scheduled on the TimerService"""
+
+    def __init__(self, due, function, args, key, onCancel = None):
+        self.due = due
+        self.function = function
+        self.args = args
+        self.key = key
+        self.onCancel = onCancel
+        self.cancelled = False
+        self.fired = False
+
+    def cancel(self):
+        # onCancel is called if the timer is cancelled before it fired
+        if self.cancelled or self.fired:
+            return
+        self.cancelled = True
+        if self.onCancel != None:
+            self.onCancel()
+
+class TimerService(threading.Thread, MyLog):
+    """Single thread running delayed callbacks, whatever the number of timers pending.
+
+    Timers are kept in a heap ordered by due time (time.monotonic()), the thread sleeps
+    until the earliest one. A timer scheduled with a key replaces the pending timer with
+    the same key, e.g. a new command for a shutter makes its previous completion timer
+    obsolete. Callbacks run on the timer thread and must return quickly."""
+
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+        threading.Thread.__init__(self, group=group, target=target, name="Timers")
+        MyLog.__init__(self)
+        self.daemon = True
+        self.shutdown_flag = threading.Event()
+
+        self.args = args
+        self.kwargs = kwargs
+        if kwargs["log"] != None:
+            self.log = kwargs["log"]
+
+        self.condition = threading.Condition()
+        self.heap = []
+        self.keys = {}                  # key -> pending TimerHandle
+        self.sequence = itertools.count()
+
+    #---------------------TimerService::schedule-------------------------------
+    def schedule(self, delay, function, args = (), key = None, onCancel = None):
+        handle = TimerHandle(time.monotonic() + max(0, delay), function, args, key, onCancel)
+        with self.condition:
+            if key != None:
+                previous = self.keys.get(key)
+                if previous != None:
+                    previous.cancel()
+                self.keys[key] = handle
+            heapq.heappush(self.heap, (handle.due, next(self.sequence), handle))
+            # wake the thread up if this timer is now the earliest one
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+        return handle
+
+    #---------------------TimerService::cancel---------------------------------
+    def cancel(self, key):
+        # cancels the pending timer with this key, returns True if there was one
+        with self.condition:
+            handle = self.keys.pop(key, None)
+        if handle == None or handle.cancelled:
+            return False
+        handle.cancel()
+        return True
+
+    #---------------------TimerService::pending--------------------------------
+    def pending(self):
+        with self.condition:
+            return sum(1 for entry in self.heap if not entry[2].cancelled)
+
+    #---------------------TimerService::shutdown-------------------------------
+    def shutdown(self):
+        # timers still pending are cancelled
+        with self.condition:
+            self.shutdown_flag.set()
+            self.condition.notify()
+            pending, self.heap, self.keys = self.heap, [], {}
+        for entry in pending:
+            entry[2].cancel()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.shutdown_flag.is_set():
+                    while self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                    if self.heap and self.heap[0][0] <= time.monotonic():
+                        break
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                if self.shutdown_flag.is_set():
+                    break
+                due, sequence, handle = heapq.heappop(self.heap)
+                handle.fired = True
+                if handle.key != None and self.keys.get(handle.key) is handle:
+                    del self.keys[handle.key]
+
+            try:
+                handle.function(*handle.args)
+            except Exception as e1:
+                self.LogError("Error in timer callback for " + str(handle.key) + ": " + str(e1))
+
+        self.LogDebug("Received Signal to shut down Timer thread")
+        return
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import sys
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+try:
+    from mylog import MyLog
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class TransmitWorker(threading.Thread, MyLog):
+    """Single thread owning the radio, draining a priority queue of commands.
+
+    submit() returns a concurrent.futures.Future straight away, callers that need to
+    know when the frame has been sent wait on it. Lower priority values are sent first,
+    commands of the same priority are sent in the order they were submitted."""
+
+    PRIORITY_HIGH = 0       # STOP and PROG
+    PRIORITY_NORMAL = 1     # moves and button presses
+    PRIORITY_LOW = 2        # background work, e.g. staging the next waves
+
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs=None):
+        threading.Thread.__init__(self, group=group, target=target, name="Transmitter")
+        MyLog.__init__(self)
+        self.daemon = True
+        self.shutdown_flag = threading.Event()
+
+        self.args = args
+        self.kwargs = kwargs
+        if kwargs["log"] != None:
+            self.log = kwargs["log"]
+
+        self.condition = threading.Condition()
+        self.queue = []
+        self.commandIds = itertools.count(1)
+
+    #---------------------TransmitWorker::submit-------------------------------
+    def submit(self, function, args = (), priority = PRIORITY_NORMAL, key = None, supersede = False):
+        # If supersede is set, queued commands with the same key and a lower priority are
+        # cancelled, e.g. a STOP makes pending moves of the same shutter pointless.
+        future = Future()
+        future.commandId = next(self.commandIds)
+        with self.condition:
+            if supersede:
+                for queuedFuture in self.cancel(key, priority):
+                    self.LogDebug("Command " + str(queuedFuture.commandId) + " for " + str(key) + " superseded by command " + str(future.commandId))
+            heapq.heappush(self.queue, (priority, future.commandId, key, future, function, args))
+            self.condition.notify()
+        return future
+
+    #---------------------TransmitWorker::cancel-------------------------------
+    def cancel(self, key, priority = PRIORITY_HIGH):
+        # Cancels the queued commands with the key and a lower priority, which have not been
+        # sent yet. Returns their futures in the order they were submitted.
+        with self.condition:
+            cancelled = [item for item in self.queue if item[2] == key and item[0] > priority and not item[3].cancelled() and item[3].cancel()]
+        return [item[3] for item in sorted(cancelled, key = lambda item: item[1])]
+
+    #---------------------TransmitWorker::pending------------------------------
+    def pending(self):
+        with self.condition:
+            return sum(1 for item in self.queue if not item[3].cancelled())
+
+    #---------------------TransmitWorker::shutdown-----------------------------
+    def shutdown(self):
+        # Commands already queued are still sent before the thread ends
+        with self.condition:
+            self.shutdown_flag.set()
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.shutdown_flag.is_set():
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                priority, commandId, key, future, function, args = heapq.heappop(self.queue)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except Exception as e1:
+                self.LogError("Error sending command " + str(commandId) + " for " + str(key) + ": " + str(e1))
+                future.set_exception(e1)
+
+        self.LogDebug("Received Signal to shut down Transmitter thread")
+        return
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+import sys
+import threading
+
+try:
+    from mylog import MyLog
+    from somfyRtsWaveForm import createWaveForm, createWaveFrames, uploadWaveForm, deleteWaves, waveFormMicros, toPigpioPulses
+except Exception as e1:
+    print("\n\nThis program requires the modules located from the same github repository that are not present.\n")
+    print("Error: " + str(e1))
+    sys.exit(2)
+
+class StagedWave(object):
+    """Waveform of one button for a known rolling code, optionally already uploaded to pigpiod"""
+
+    def __init__(self, waveform, repeatWaveForm, wids = None):
+        self.waveform = waveform
+        self.repeatWaveForm = repeatWaveForm
+        self.micros = waveFormMicros(waveform, repeatWaveForm)
+        self.pulses = len(toPigpioPulses(waveform)) + (len(toPigpioPulses(repeatWaveForm)) if repeatWaveForm != None else 0)
+        self.waves = 2 if repeatWaveForm != None else 1
+        self.wids = wids
+
+class WaveCache(MyLog):
+    """Waves of the up/down/stop buttons for the next rolling code of each shutter.
+
+    The rolling code only ever increments, so the next frames can be built (and, with
+    preUpload, uploaded to pigpiod) while the radio is idle. take() hands out the wave
+    matching the code being sent and drops the other buttons of that shutter, which
+    are stale once the code has been consumed.
+
+    Uploaded waves use pigpiod's shared room for waves, at most uploadShare of it is
+    taken so the waves of a command that was not staged always fit. Beyond that the
+    shutters staged the longest ago (i.e. used the longest ago) only keep their waves
+    built, not uploaded."""
+
+    # limits of pigpiod with its default settings
+    pigpiodMaxWaves = 250
+    pigpiodMaxPulses = 12000
+
+    def __init__(self, txGpio, log = None, connection = None, preUpload = False, uploadShare = 0.5):
+        super(WaveCache, self).__init__()
+        if log != None:
+            self.log = log
+        self.txGpio = txGpio
+        self.connection = connection
+        self.preUpload = preUpload and connection != None
+        self.maxUploadedWaves = int(self.pigpiodMaxWaves * uploadShare)
+        self.maxUploadedPulses = int(self.pigpiodMaxPulses * uploadShare)
+        self.lock = threading.Lock()
+        self.entries = {}   # shutterId -> (code, repetition, chain, {button: StagedWave})
+
+    #---------------------WaveCache::stage-------------------------------------
+    def stage(self, shutterId, code, repetition, chain, buttons):
+        teleco = int(shutterId, 16)
+        staged = {}
+        for button in buttons:
+            if chain:
+                wf, repeatWf = createWaveFrames(self.txGpio, teleco, button, code, compact = True, logFrame = False)
+            else:
+                wf, repeatWf = createWaveForm(self.txGpio, teleco, button, code, repetition, compact = True, logFrame = False), None
+            staged[button] = StagedWave(wf, repeatWf)
+
+        if self.preUpload and self._makeRoom(shutterId, staged.values()):
+            try:
+                pi = self.connection.get()
+                for wave in staged.values():
+                    wave.wids = uploadWaveForm(pi, wave.waveform, wave.repeatWaveForm)
+            except Exception as e1:
+                # e.g. pigpiod is out of wave memory, keep the waves built but not uploaded
+                self.LogDebug("Not able to upload staged waves for " + shutterId + ": " + str(e1))
+                self._delete([wave for wave in staged.values() if wave.wids != None])
+                for wave in staged.values():
+                    wave.wids = None
+
+        with self.lock:
+            previous = self.entries.pop(shutterId, None)
+            self.entries[shutterId] = (code, repetition, chain, staged)
+        if previous != None:
+            self._delete(previous[3].values())
+        self.LogDebug("Staged waves for " + shutterId + " with rolling code " + str(code))
+
+    #---------------------WaveCache::take--------------------------------------
+    def take(self, shutterId, button, code, repetition, chain):
+        with self.lock:
+            entry = self.entries.pop(shutterId, None)
+        if entry == None:
+            return None
+        stagedCode, stagedRepetition, stagedChain, staged = entry
+        wave = None
+        if stagedCode == code and stagedChain == chain and (chain or stagedRepetition == repetition):
+            wave = staged.pop(button, None)
+        self._delete(staged.values())
+        return wave
+
+    #---------------------WaveCache::invalidate--------------------------------
+    def invalidate(self, shutterId = None):
+        with self.lock:
+            if shutterId == None:
+                entries = list(self.entries.values())
+                self.entries = {}
+            else:
+                entries = [self.entries.pop(shutterId)] if shutterId in self.entries else []
+        for entry in entries:
+            self._delete(entry[3].values())
+
+    #---------------------WaveCache::dropUploads------------------------------
+    def dropUploads(self, waves = ()):
+        # After a transmit error: the staged waves, and waves taken from the cache, are deleted
+        # from pigpiod and only their waveforms kept. pigpiod keeps waves when a client
+        # reconnects, so forgetting their ids would leak them.
+        with self.lock:
+            waves = list(waves)
+            for entry in self.entries.values():
+                waves += entry[3].values()
+        self._delete(waves)
+
+    def _makeRoom(self, shutterId, waves):
+        # Deletes the uploads of the least recently staged shutters until waves fit in the
+        # share of pigpiod given to the cache, returns False if they cannot fit at all
+        pulses = sum(wave.pulses for wave in waves)
+        count = sum(wave.waves for wave in waves)
+        if pulses > self.maxUploadedPulses or count > self.maxUploadedWaves:
+            return False
+        evicted = []
+        with self.lock:
+            uploaded = [wave for id, entry in self.entries.items() if id != shutterId for wave in entry[3].values() if wave.wids != None]
+            pulses += sum(wave.pulses for wave in uploaded)
+            count += sum(wave.waves for wave in uploaded)
+            # entries are kept in the order they were staged
+            for wave in uploaded:
+                if pulses <= self.maxUploadedPulses and count <= self.maxUploadedWaves:
+                    break
+                pulses -= wave.pulses
+                count -= wave.waves
+                evicted.append(wave)
+        if len(evicted):
+            self.LogDebug("Deleting " + str(len(evicted)) + " uploaded staged waves to make room for " + shutterId)
+            self._delete(evicted)
+        return True
+
+    def _delete(self, waves):
+        # best effort, a wave that cannot be deleted does not keep the others
+        wids = []
+        for wave in waves:
+            if wave.wids != None:
+                wids += wave.wids
+                wave.wids = None
+        if not len(wids):
+            return
+        try:
+            pi = self.connection.get()
+        except Exception as e1:
+            self.LogDebug("Not able to delete staged waves " + str(wids) + ": " + str(e1))
+            return
+        for wid in wids:
+            try:
+                deleteWaves(pi, [wid])
+            except Exception as e1:
+                self.LogDebug("Not able to delete staged wave " + str(wid) + ": " + str(e1))
@@ -34,7 +34,7 @@ class FlaskAppWrapper(MyLog):
     app = None
     CriticalLock = None
 
-    def __init__(self, name = __name__, static_url_path = '', log = None, shutter = None, schedule = None, config = None):
+    def __init__(self, name = __name__, static_url_path = '', log = None, shutter = None, schedule = None, config = None, sunTimes = None):
         if log != None:
             self.log = log
         logging.getLogger('werkzeug').setLevel(logging.ERROR)
@@ -42,6 +42,7 @@ class FlaskAppWrapper(MyLog):
         self.shutter = shutter
         self.schedule = schedule
         self.config = config
+        self.sunTimes = sunTimes
         
         self.app = Flask(import_name=name, static_url_path="", static_folder=static_url_path)
         self.app.after_request(self.add_header)
@@ -79,7 +80,7 @@ class FlaskAppWrapper(MyLog):
             # self.LogDebug("JSON: "+str(request.get_json()))
             # self.LogDebug("RAW: "+str(request.get_data()))
             command = args[1]['command']
-            if command in ["up", "down", "stop", "program", "press", "getConfig", "addSchedule", "editSchedule", "deleteSchedule", "addShutter", "editShutter", "deleteShutter", "setLocation" ]:
+            if command in ["up", "down", "stop", "program", "press", "getConfig", "getMetrics", "addSchedule", "editSchedule", "deleteSchedule", "addShutter", "editShutter", "deleteShutter", "setLocation" ]:
                 self.LogInfo("processing Command \"" + command + "\" with parameters: "+str(request.values))
                 result = getattr(self, command)(request.values)
                 return Response(json.dumps(result), status=200)
@@ -167,7 +168,10 @@ class FlaskAppWrapper(MyLog):
 
     def setLocation(self, params):
         self.LogDebug("set Location: "+params.get('lat', 0, type=str)+" / "+params.get('lng', 0, type=str))
-        self.config.setLocation(params.get('lat', 0, type=str), params.get('lng', 0, type=str))
+        if not self.config.setLocation(params.get('lat', 0, type=str), params.get('lng', 0, type=str)):
+            return {'status': 'ERROR', 'message': 'Not able to save the location'}
+        if self.sunTimes != None:
+            self.sunTimes.update()
         self.schedule.setUpdateTime()
         return {'status': 'OK'}
 
@@ -200,9 +204,14 @@ class FlaskAppWrapper(MyLog):
             id = "0x%0.2X" % tmp_id
             code = 1
             self.LogDebug("got a new shutter id: "+id)
-            self.config.WriteValue(str(id), str(name)+",True,"+str(duration), section="Shutters");
-            self.config.WriteValue(str(id), str(code), section="ShutterRollingCodes");
-            self.config.WriteValue(str(id), str(None), section="ShutterIntermediatePositions");
+            try:
+                with self.config.transaction():
+                    self.config.WriteValue(str(id), str(name)+",True,"+str(duration), section="Shutters");
+                    self.config.WriteValue(str(id), str(code), section="ShutterRollingCodes");
+                    self.config.WriteValue(str(id), str(None), section="ShutterIntermediatePositions");
+            except Exception as e1:
+                self.LogError("Failed to add shutter: " + str(e1))
+                return {'status': 'ERROR', 'message': 'Not able to save the shutter'}
             self.config.ShuttersByName[name] = id
             self.config.Shutters[id] = {'name': name, 'code': code, 'duration': duration, 'durationDown': int(duration), 'durationUp': int(duration), 'intermediatePosition': None}
             return {'status': 'OK', 'id': id}
@@ -235,6 +244,7 @@ class FlaskAppWrapper(MyLog):
             self.config.ShuttersByName['name'] = id
             self.config.Shutters[id]['name'] = name
             self.config.Shutters[id]['duration'] = duration
+            self.shutter.invalidateWaves(id)
             return {'status': 'OK'}
 
     def deleteShutter(self, params):
@@ -246,6 +256,7 @@ class FlaskAppWrapper(MyLog):
             self.config.WriteValue(str(id), self.config.Shutters[id]['name']+",False,"+self.config.Shutters[id]['duration'], section="Shutters");
             self.config.ShuttersByName.pop(self.config.Shutters[id]['name'], None)
             self.config.Shutters.pop(id, None)
+            self.shutter.invalidateWaves(id)
             return {'status': 'OK'}
 
     def addSchedule(self, params):
@@ -269,9 +280,16 @@ class FlaskAppWrapper(MyLog):
             shutters[k] = self.config.Shutters[k]['name']  
             durations[k] = self.config.Shutters[k]['durationDown']            
         obj = {'Latitude': self.config.Latitude, 'Longitude': self.config.Longitude, 'Shutters': shutters, 'ShutterDurations': durations, 'Schedule': self.schedule.getScheduleAsDict()}
+        if self.sunTimes != None:
+            obj['SunTimes'] = self.sunTimes.upcoming()
         self.LogDebug("getConfig called, sending: "+json.dumps(obj))
         return obj
 
+    def getMetrics(self, params):
+        if not self.validatePassword():
+            return {'status': 'ERROR'}
+        return self.shutter.getMetrics()
+
     def generate_adhoc_ssl_context(self):
         """Generates an adhoc SSL context for the development server."""
         #        crypto = _get_openssl_crypto_module()
@@ -13,22 +13,34 @@ import socket
 import signal, atexit, traceback
 import logging, logging.handlers
 import threading
+import functools
 import getpass
+from concurrent.futures import Future
 
 
 try:
     from myconfig import MyConfig
+    from myconfigwatcher import ConfigWatcher
     from mylog import SetupLogger
     from mylog import MyLog
+    from myeventbus import EventBus
     from myscheduler import Event
     from myscheduler import Schedule
     from myscheduler import Scheduler
+    from mysuntimes import SunTimes
     from mywebserver import FlaskAppWrapper
     from myalexa import Alexa
     from mymqtt import MQTT
+    from mymetrics import LatencyStats, LatencyHistogram
+    from mypositions import PositionStore
+    from mypigpio import PigpioConnection
+    from mytimer import TimerService
+    from mytransmitter import TransmitWorker
+    from mywavecache import WaveCache
     from shutil import copyfile
     from somfyRfm69Transmitter import SomfyRfm69Tx
-    from somfyRtsWaveForm import createWaveForm
+    from somfyRtsWaveForm import createWaveForm, createWaveFrames, transmitWaveForm, sendWaves, deleteWaves
+    from somfyRtsWaveForm import uploadWaveForm, waveFormMicros, sendMoveAndStop, motorReactionMicros
     from time import sleep
 
 except Exception as e1:
@@ -48,22 +60,64 @@ class Shutter(MyLog):
     buttonDown = 0x4
     buttonProg = 0x8
 
+    # longest pause of a precise partial move, the radio is busy for the whole move
+    preciseStopMaxDelay = 30
+
+    progressTimerKey = "progress"
+
+    # seconds from the start of a command until the motor acts on it
+    motorReaction = motorReactionMicros() / 1000000.0
+
     class ShutterState: # Definition of one shutter state
-        position = None # as percentage: 0 = closed (down), 100 = open (up)
+        position = None # as percentage: 0 = closed (down), 100 = open (up), kept as a float
+                        # while moving, the position the move started from
         lastCommandTime = None # get using time.monotonic()
         lastCommandDirection = None # 'up' or 'down' or None
+        motorStartTime = None # when the motor acted on the last command, get using time.monotonic()
+        target = None # position the current move ends at, None when not moving
+        rate = None # percentage per second of the current move
 
-        def __init__(self, initPosition = None):
+        def __init__(self, initPosition = None, onChange = None):
             self.position = initPosition
             self.lastCommandTime = time.monotonic()
-
-        def registerCommand(self, commandDirection):
+            self.motorStartTime = self.lastCommandTime
+            self.onChange = onChange
+
+        def registerCommand(self, commandDirection, target = None, rate = None):
+            now = time.monotonic()
+            if self.position != None:
+                # a new command interrupts the current move where it is
+                self.position = self.positionAt(now)
             self.lastCommandDirection = commandDirection
-            self.lastCommandTime = time.monotonic()
+            self.lastCommandTime = now
+            # estimate until the frame is on air, see Shutter.trackMotorStart
+            self.motorStartTime = now
+            self.target = target if commandDirection != None else None
+            self.rate = rate
+            if self.onChange != None:
+                self.onChange(self)
+
+        def positionAt(self, now):
+            # position along the current move at time.monotonic() now
+            if self.target == None or self.position == None:
+                return self.position
+            travelled = max(0, now - self.motorStartTime) * self.rate
+            if self.lastCommandDirection == 'up':
+                return min(self.target, self.position + travelled)
+            return max(self.target, self.position - travelled)
+
+        def isMoving(self, now):
+            return self.target != None and self.position != None and self.positionAt(now) != self.target
+
+        def snapshot(self):
+            return (self.position, self.lastCommandTime, self.lastCommandDirection, self.motorStartTime, self.target, self.rate)
+
+        def restore(self, snapshot):
+            # undoes the commands registered since snapshot was taken
+            self.position, self.lastCommandTime, self.lastCommandDirection, self.motorStartTime, self.target, self.rate = snapshot
 
     def __init__(self, log = None, config = None):
         super(Shutter, self).__init__()
-        self.lock = threading.Lock()
         if log != None:
             self.log = log
         if config != None:
@@ -74,33 +128,169 @@ class Shutter(MyLog):
         else:
             self.TXGPIO=4 # 433.42 MHz emitter on GPIO 4
 
-        self.callback = []
+        self.events = EventBus(log=self.log)   # position changes, see registerCallBack
+        self.movingShutters = set()             # shutters whose progress is published, see trackProgress
+        self.progressPublished = {}
+        self.progressScheduled = False
         self.shutterStateList = {}
         self.sutterStateLock = threading.Lock()
 
+        self.pigpio = PigpioConnection(host=self.config.PIGPIOHost, port=self.config.PIGPIOPort, log=self.log)
+        self.setupLatency = LatencyStats("Transmit setup latency")
+        self.airtime = LatencyStats("Transmit airtime")
+        self.completionOvershoot = LatencyStats("Transmit completion overshoot")
+        self.rfm69ReadyTime = LatencyHistogram("Rfm69 time to ready")
+
+        self.transmitter = TransmitWorker(kwargs={'log': self.log})
+        self.transmitter.start()
+
+        # one thread for the completion of all movements
+        self.timers = TimerService(kwargs={'log': self.log})
+        self.timers.start()
+
+        self.positions = None
+        if self.config.PersistPositions:
+            self.positions = PositionStore(self.config.FileName + ".positions", log=self.log)
+            self.restorePositions()
+
+        self.rfm69Tx = None
+        self.preciseMoves = {}      # shutterId -> abort event of the precise partial move being sent
+        self.waveCache = None
+        if self.config.PrestageWaves:
+            self.waveCache = WaveCache(self.TXGPIO, log=self.log, connection=self.pigpio, preUpload=self.config.PreUploadWaves and not self.config.Rfm69Enabled)
+
+    def close(self):
+        self.timers.shutdown()
+        self.transmitter.shutdown()
+        self.events.shutdown()
+        if self.positions != None:
+            self.positions.close()
+        self.closeRfm69Tx()
+        if self.waveCache != None:
+            self.waveCache.invalidate()
+        self.pigpio.stop()
+
     def getShutterState(self, shutterId, initialPosition = None):
         with self.sutterStateLock:
             if shutterId not in self.shutterStateList:
-                self.shutterStateList[shutterId] = self.ShutterState(initialPosition)
+                self.shutterStateList[shutterId] = self.ShutterState(initialPosition, functools.partial(self.stateChanged, shutterId))
             return self.shutterStateList[shutterId]
 
+    def restorePositions(self):
+        # The times saved are wall clock times, they are turned back into time.monotonic(). A move
+        # that was under way (e.g. the program was stopped before it completed) is continued from
+        # where it started, so the position is where the shutter is now, or its target.
+        try:
+            states = self.positions.load()
+        except Exception as e1:
+            self.LogErrorLine("Error restoring shutter positions: " + str(e1))
+            return
+        now, wallNow = time.monotonic(), time.time()
+        moving = []
+        with self.sutterStateLock:
+            for shutterId, (position, direction, startTime, target) in states.items():
+                if shutterId not in self.config.Shutters:
+                    continue
+                state = self.ShutterState(position, functools.partial(self.stateChanged, shutterId))
+                state.lastCommandDirection = direction
+                state.lastCommandTime = now - max(0, wallNow - startTime)
+                state.motorStartTime = state.lastCommandTime
+                if target != None and direction in ('up', 'down'):
+                    state.target = target
+                    state.rate = self.moveRate(shutterId, direction)
+                    if state.isMoving(now):
+                        moving.append((shutterId, abs(target - state.positionAt(now)) / state.rate, target))
+                    else:
+                        state.position, state.target = target, None
+                self.shutterStateList[shutterId] = state
+        for shutterId, timeToWait, target in moving:
+            self.scheduleFinalPosition(shutterId, timeToWait, target)
+
+    def stateChanged(self, shutterId, state):
+        # called by ShutterState.registerCommand, and once the motor start time of the command is known
+        self.saveState(shutterId, state)
+        if state.target != None and self.config.ProgressInterval > 0:
+            self.trackProgress(shutterId)
+
+    def trackProgress(self, shutterId):
+        # Only moving shutters are looked at, the progress timer stops once none is left
+        with self.sutterStateLock:
+            self.movingShutters.add(shutterId)
+            if self.progressScheduled:
+                return
+            self.progressScheduled = True
+        self.timers.schedule(self.config.ProgressInterval, self.publishProgress, key = self.progressTimerKey)
+
+    def publishProgress(self):
+        now = time.monotonic()
+        with self.sutterStateLock:
+            moving = [(shutterId, self.shutterStateList.get(shutterId)) for shutterId in self.movingShutters]
+        stopped = []
+        for shutterId, state in moving:
+            if state == None or not state.isMoving(now):
+                stopped.append(shutterId)
+                continue
+            position = int(round(state.positionAt(now)))
+            if self.progressPublished.get(shutterId) != position:
+                self.progressPublished[shutterId] = position
+                self.events.publish(shutterId, shutterId, position)
+        with self.sutterStateLock:
+            self.movingShutters.difference_update(stopped)
+            for shutterId in stopped:
+                self.progressPublished.pop(shutterId, None)
+            self.progressScheduled = len(self.movingShutters) > 0
+        if self.progressScheduled:
+            self.timers.schedule(self.config.ProgressInterval, self.publishProgress, key = self.progressTimerKey)
+
+    def saveState(self, shutterId, state):
+        # queued, the position store writes the changes of about a second together. While moving
+        # the position saved is where the move started, see restorePositions
+        if self.positions != None and state.position != None:
+            self.positions.update(shutterId, state.position, state.lastCommandDirection, time.time() - (time.monotonic() - state.motorStartTime), state.target)
+
     def getPosition(self, shutterId):
+        # interpolated while the shutter is moving
         state = self.getShutterState(shutterId, 0)
-        return state.position
+        return int(round(state.positionAt(time.monotonic())))
 
     def setPosition(self, shutterId, newPosition):
+        # The shutter is known to be at newPosition and not moving. The position is kept as
+        # a float, the callbacks get it as a whole percentage
         state = self.getShutterState(shutterId)
         with self.sutterStateLock:
             state.position = newPosition
-        for function in self.callback:
-            function(shutterId, newPosition)
+            state.target = None
+        self.saveState(shutterId, state)
+        self.events.publish(shutterId, shutterId, int(round(newPosition)))
+        self.LogDebug(self.events.summary())
 
-    def waitAndSetFinalPosition(self, shutterId, timeToWait, newPosition):
+    def trackMotorStart(self, shutterId, command):
+        # the future of a move command gives the time the motor acted on it, see sendFrame
         state = self.getShutterState(shutterId)
-        oldLastCommandTime = state.lastCommandTime
+        command.add_done_callback(functools.partial(self.motorStarted, state, state.lastCommandTime))
+
+    def motorStarted(self, state, commandTime, command):
+        if command.cancelled() or command.exception() != None or command.result() == None:
+            return
+        self.setMotorStartTime(state, commandTime, command.result())
 
+    def setMotorStartTime(self, state, commandTime, startTime):
+        with self.sutterStateLock:
+            # a newer command has its own start time
+            if state.lastCommandTime != commandTime:
+                return
+            state.motorStartTime = startTime
+        if state.onChange != None:
+            state.onChange(state)
+
+    def scheduleFinalPosition(self, shutterId, timeToWait, newPosition):
+        # replaces the completion timer of a previous command of this shutter
+        state = self.getShutterState(shutterId)
         self.LogDebug("["+self.config.Shutters[shutterId]['name']+"] Waiting for operation to complete for " + str(timeToWait) + " seconds")
-        time.sleep(timeToWait)
+        self.timers.schedule(timeToWait, self.setFinalPosition, (shutterId, newPosition, state.lastCommandTime), key = shutterId)
+
+    def setFinalPosition(self, shutterId, newPosition, oldLastCommandTime):
+        state = self.getShutterState(shutterId)
 
         # Only set new position if registerCommand has not been called in between
         if state.lastCommandTime == oldLastCommandTime:
@@ -113,86 +303,222 @@ class Shutter(MyLog):
         state = self.getShutterState(shutterId, 100)
 
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Going down")
-        self.sendCommand(shutterId, self.buttonDown, self.config.SendRepeat)
-        state.registerCommand('down')
+        command = self.sendCommand(shutterId, self.buttonDown, self.config.SendRepeat)
+        state.registerCommand('down', 0, self.moveRate(shutterId, 'down'))
+        self.trackMotorStart(shutterId, command)
 
         # wait and set final position only if not interrupted in between
         timeToWait = state.position/100*self.config.Shutters[shutterId]['durationDown']
-        t = threading.Thread(target = self.waitAndSetFinalPosition, args = (shutterId, timeToWait, 0))
-        t.start()
+        self.scheduleFinalPosition(shutterId, timeToWait, 0)
+        return command
 
     def lowerPartial(self, shutterId, percentage):
         state = self.getShutterState(shutterId, 100)
 
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Going down") 
-        self.sendCommand(shutterId, self.buttonDown, self.config.SendRepeat)
-        state.registerCommand('down')
-        time.sleep((state.position-percentage)/100*self.config.Shutters[shutterId]['durationDown'])
-        self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Stop at partial position requested")
-        self.sendCommand(shutterId, self.buttonStop, self.config.SendRepeat)
-
-        self.setPosition(shutterId, percentage)
+        timeToWait = (state.positionAt(time.monotonic())-percentage)/100*self.config.Shutters[shutterId]['durationDown']
+        return self.movePartial(shutterId, self.buttonDown, 'down', timeToWait, percentage)
 
     def rise(self, shutterId):
         state = self.getShutterState(shutterId, 0)
 
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Going up")
-        self.sendCommand(shutterId, self.buttonUp, self.config.SendRepeat)
-        state.registerCommand('up')
+        command = self.sendCommand(shutterId, self.buttonUp, self.config.SendRepeat)
+        state.registerCommand('up', 100, self.moveRate(shutterId, 'up'))
+        self.trackMotorStart(shutterId, command)
 
         # wait and set final position only if not interrupted in between
         timeToWait = (100-state.position)/100*self.config.Shutters[shutterId]['durationUp']
-        t = threading.Thread(target = self.waitAndSetFinalPosition, args = (shutterId, timeToWait, 100))
-        t.start()
+        self.scheduleFinalPosition(shutterId, timeToWait, 100)
+        return command
 
     def risePartial(self, shutterId, percentage):
         state = self.getShutterState(shutterId, 0)
 
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Going up")
-        self.sendCommand(shutterId, self.buttonUp, self.config.SendRepeat)
-        state.registerCommand('up')
-        time.sleep((percentage-state.position)/100*self.config.Shutters[shutterId]['durationUp'])
+        timeToWait = (percentage-state.positionAt(time.monotonic()))/100*self.config.Shutters[shutterId]['durationUp']
+        return self.movePartial(shutterId, self.buttonUp, 'up', timeToWait, percentage)
+
+    def movePartial(self, shutterId, button, direction, timeToWait, percentage):
+        # Sends the move frame and returns at once. The STOP is sent by the timer thread so
+        # that the motor receives it timeToWait seconds after it received the move frame,
+        # unless a newer command for the shutter came first. The Future returned completes once the STOP has been sent and
+        # is cancelled if the STOP was superseded.
+        state = self.getShutterState(shutterId)
+        done = Future()
+        self.timers.cancel(shutterId)
+        if self.config.PrecisePartialStops and not self.config.Rfm69Enabled and timeToWait <= self.preciseStopMaxDelay:
+            return self.movePartialPrecise(shutterId, button, direction, timeToWait, percentage, done)
+        command = self.sendCommand(shutterId, button, self.config.SendRepeat)
+        state.registerCommand(direction, percentage, self.moveRate(shutterId, direction))
+        self.trackMotorStart(shutterId, command)
+        command.add_done_callback(functools.partial(self.partialMoveSent, shutterId, timeToWait, percentage, state.lastCommandTime, done))
+        return done
+
+    def movePartialPrecise(self, shutterId, button, direction, timeToWait, percentage, done):
+        # The move frame, the pause and the STOP frame are sent as one wave chain, so the
+        # instant of the STOP is timed by DMA in pigpiod. A newer command for the shutter
+        # aborts the chain.
+        self.abortPreciseMove(shutterId)
+        state = self.getShutterState(shutterId)
+        previousState = state.snapshot()
+        state.registerCommand(direction, percentage, self.moveRate(shutterId, direction))
+        command = self.transmitter.submit(self.sendMoveAndStopFrames, (shutterId, button, self.config.SendRepeat, timeToWait, percentage, state.lastCommandTime),
+                                          key = shutterId)
+        command.previousState = previousState
+        command.add_done_callback(functools.partial(self.preciseMoveSent, done))
+        return done
+
+    def preciseMoveSent(self, done, command):
+        # sendMoveAndStopFrames returns False if the move was superseded
+        if command.done() and not command.cancelled() and command.exception() == None and not command.result():
+            done.cancel()
+        else:
+            self.completeFuture(done, command)
+
+    def abortPreciseMove(self, shutterId):
+        abort = self.preciseMoves.get(shutterId)
+        if abort != None:
+            abort.set()
+
+    def sendMoveAndStopFrames(self, shutterId, button, repetition, timeToWait, percentage, commandTime): # called by the transmit worker only
+        if self.getShutterState(shutterId).lastCommandTime != commandTime:
+            # a newer command was queued while this one was waiting, do not move at all
+            return False
+
+        teleco = int(shutterId, 16)
+        code = int(self.config.Shutters[shutterId]['code'])
+        self.config.setCode(shutterId, code+2)
+
+        self.LogInfo ("Remote  :		" + "0x%0.2X" % teleco + ' (' + self.config.Shutters[shutterId]['name'] + ')')
+        self.LogInfo ("Button  :		" + "0x%0.2X" % button + ", STOP after " + str(timeToWait) + " seconds")
+        self.LogInfo ("Rolling code : " + str(code) + ", " + str(code+1))
+        self.LogInfo ("")
+
+        if self.waveCache != None:
+            # the staged waves are for the code now used by the move frame
+            self.waveCache.invalidate(shutterId)
+        moveWf, moveRepeatWf = createWaveFrames(self.TXGPIO, teleco, button, code, self.log, compact = True)
+        stopWf, stopRepeatWf = createWaveFrames(self.TXGPIO, teleco, self.buttonStop, code+1, self.log, compact = True)
+        moveMicros, stopMicros = waveFormMicros(moveWf, moveRepeatWf), waveFormMicros(stopWf, stopRepeatWf)
+        # The motor acts on both frames at the same point of their first frame, so the
+        # pause is timeToWait less the move frames still on air after that point.
+        delayMicros = max(0, timeToWait * 1000000 - (moveMicros[0] + moveMicros[1] * (repetition - 1)))
+
+        abort = threading.Event()
+        self.preciseMoves[shutterId] = abort
+        setupStartTime = time.monotonic()
+        try:
+            pi = self.pigpio.get()
+            pi.set_mode(self.TXGPIO, pigpio.OUTPUT)
+            moveWids = uploadWaveForm(pi, moveWf, moveRepeatWf)
+            try:
+                stopWids = uploadWaveForm(pi, stopWf, stopRepeatWf)
+                try:
+                    self.setupLatency.add(time.monotonic() - setupStartTime)
+                    self.setMotorStartTime(self.getShutterState(shutterId), commandTime, time.monotonic() + self.motorReaction)
+                    airtime, overshoot = sendMoveAndStop(pi, moveWids, stopWids, repetition, delayMicros, moveMicros, stopMicros, abort)
+                finally:
+                    deleteWaves(pi, stopWids)
+            finally:
+                deleteWaves(pi, moveWids)
+        except Exception:
+            # the connection may be stale, the next command reconnects
+            self.pigpio.reset()
+            if self.waveCache != None:
+                self.waveCache.dropUploads()
+            raise
+        finally:
+            if self.preciseMoves.get(shutterId) is abort:
+                del self.preciseMoves[shutterId]
+
+        if self.waveCache != None:
+            self.transmitter.submit(self.stageWaves, (shutterId,), priority = TransmitWorker.PRIORITY_LOW)
+        if abort.is_set():
+            self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Precise partial move aborted by a newer command")
+            return False
+
+        self.airtime.add(airtime)
+        self.completionOvershoot.add(overshoot)
+        self.LogDebug(self.airtime.summary() + ", " + self.completionOvershoot.summary())
+        self.setPosition(shutterId, percentage)
+        return True
+
+    def partialMoveSent(self, shutterId, timeToWait, percentage, commandTime, done, command):
+        if command.cancelled() or command.exception() != None:
+            self.completeFuture(done, command)
+            return
+        if self.getShutterState(shutterId).lastCommandTime != commandTime:
+            done.cancel()
+            return
+        # command.result() is when the motor acted on the move frame, the STOP frame takes
+        # as long to reach it
+        delay = command.result() + timeToWait - self.motorReaction - time.monotonic()
+        self.timers.schedule(delay, self.stopAtPartialPosition, (shutterId, percentage, commandTime, done), key = shutterId, onCancel = done.cancel)
+
+    def stopAtPartialPosition(self, shutterId, percentage, commandTime, done):
+        if self.getShutterState(shutterId).lastCommandTime != commandTime:
+            done.cancel()
+            return
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Stop at partial position requested")
-        self.sendCommand(shutterId, self.buttonStop, self.config.SendRepeat)
+        command = self.sendCommand(shutterId, self.buttonStop, self.config.SendRepeat)
 
         self.setPosition(shutterId, percentage)
+        command.add_done_callback(functools.partial(self.completeFuture, done))
+
+    def moveRate(self, shutterId, direction):
+        # percentage per second
+        return 100.0 / self.config.Shutters[shutterId]['durationUp' if direction == 'up' else 'durationDown']
+
+    def completeFuture(self, future, source):
+        # passes the outcome of source on to future, a superseded command cancels it
+        if source.cancelled() or not source.done():
+            future.cancel()
+        elif source.exception() != None:
+            if not future.done():
+                future.set_exception(source.exception())
+        elif not future.done():
+            future.set_result(None)
 
     def stop(self, shutterId):
         state = self.getShutterState(shutterId, 50)
 
         self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Stopping")
-        self.sendCommand(shutterId, self.buttonStop, self.config.SendRepeat)
+        # Moves still queued are cancelled, the shutter is back to where it was before them
+        cancelled = [command.previousState for command in self.transmitter.cancel(shutterId) if command.previousState != None]
+        if len(cancelled):
+            with self.sutterStateLock:
+                state.restore(cancelled[0])
+            now = time.monotonic()
+            if not state.isMoving(now):
+                # The motor never received the moves and is stationary, a STOP would drive it
+                # to its "My" position
+                self.LogInfo("["+self.config.Shutters[shutterId]['name']+"] Queued move cancelled before it was sent, no STOP needed")
+                self.timers.cancel(shutterId)
+                self.setPosition(shutterId, state.positionAt(now))
+                state.registerCommand(None)
+                command = Future()
+                command.set_result(None)
+                return command
+        command = self.sendCommand(shutterId, self.buttonStop, self.config.SendRepeat)
 
         self.LogDebug("["+shutterId+"] Previous position: " + str(state.position))
-        secondsSinceLastCommand = int(round(time.monotonic() - state.lastCommandTime))
-        self.LogDebug("["+shutterId+"] Seconds since last command: " + str(secondsSinceLastCommand))
-
-        # Compute position based on time elapsed since last command & command direction
-        setupDurationDown = self.config.Shutters[shutterId]['durationDown']
-        setupDurationUp = self.config.Shutters[shutterId]['durationUp']
+        # estimate until the STOP is on air, see stopSent
+        stopTime = time.monotonic() + self.motorReaction
+        self.LogDebug("["+shutterId+"] Seconds since last command: %.3f" % (stopTime - state.motorStartTime))
 
+        # Compute position along the current move
+        currentPosition = state.positionAt(stopTime)
         fallback = False
-        if state.lastCommandDirection == 'up':
-            if secondsSinceLastCommand > 0 and secondsSinceLastCommand < setupDurationUp:
-                durationPercentage = int(round(secondsSinceLastCommand/setupDurationUp * 100))
-                self.LogDebug("["+shutterId+"] Up duration percentage: " + str(durationPercentage) + ", State position: "+ str(state.position))
-                if state.position > 0: # after rise from previous position
-                    newPosition = min (100 , state.position + durationPercentage)
-                else: # after rise from fully closed
-                    newPosition = durationPercentage
-            else:  #fallback
-                self.LogWarn("["+shutterId+"] Too much time since up command.")
-                fallback = True
-        elif state.lastCommandDirection == 'down':
-            if secondsSinceLastCommand > 0 and secondsSinceLastCommand < setupDurationDown:
-                durationPercentage = int(round(secondsSinceLastCommand/setupDurationDown * 100))
-                self.LogDebug("["+shutterId+"] Down duration percentage: " + str(durationPercentage) + ", State position: "+ str(state.position))
-                if state.position < 100: # after lower from previous position
-                    newPosition = max (0 , state.position - durationPercentage)
-                else: # after down from fully opened
-                    newPosition = 100 - durationPercentage
+        if state.lastCommandDirection in ('up', 'down'):
+            if state.isMoving(stopTime):
+                # the position is known once the STOP has been sent
+                self.timers.cancel(shutterId)
+                done = Future()
+                command.add_done_callback(functools.partial(self.stopSent, shutterId, state.lastCommandTime, done))
+                return done
             else:  #fallback
-                self.LogWarn("["+shutterId+"] Too much time since down command.")
+                self.LogWarn("["+shutterId+"] Too much time since " + state.lastCommandDirection + " command.")
                 fallback = True
         else: # consecutive stops
             self.LogWarn("["+shutterId+"] Stop pressed while stationary.")
@@ -200,96 +526,213 @@ class Shutter(MyLog):
 
         if fallback == True: # Let's assume it will end on the intermediate position ! If it exists !
             intermediatePosition = self.config.Shutters[shutterId]['intermediatePosition']
-            if (intermediatePosition == None) or (intermediatePosition == state.position):
+            if (intermediatePosition == None) or (intermediatePosition == currentPosition):
                 self.LogInfo("["+shutterId+"] Stay stationary.")
-                newPosition = state.position
+                newPosition = currentPosition
             else:
                 self.LogInfo("["+shutterId+"] Motor expected to move to intermediate position "+str(intermediatePosition))
-                if state.position > intermediatePosition:
-                    state.registerCommand('down')
-                    timeToWait = abs(state.position - intermediatePosition) / 100*self.config.Shutters[shutterId]['durationDown']
+                if currentPosition > intermediatePosition:
+                    state.registerCommand('down', intermediatePosition, self.moveRate(shutterId, 'down'))
+                    timeToWait = abs(currentPosition - intermediatePosition) / 100*self.config.Shutters[shutterId]['durationDown']
                 else:
-                    state.registerCommand('up')
-                    timeToWait = abs(state.position - intermediatePosition) / 100*self.config.Shutters[shutterId]['durationUp']
+                    state.registerCommand('up', intermediatePosition, self.moveRate(shutterId, 'up'))
+                    timeToWait = abs(currentPosition - intermediatePosition) / 100*self.config.Shutters[shutterId]['durationUp']
+                self.trackMotorStart(shutterId, command)
                 # wait and set final intermediate position only if not interrupted in between
-                t = threading.Thread(target = self.waitAndSetFinalPosition, args = (shutterId, timeToWait, intermediatePosition))
-                t.start()
-                return
+                self.scheduleFinalPosition(shutterId, timeToWait, intermediatePosition)
+                return command
 
-        # Save computed position
+        # Save computed position, the movement is over
+        self.timers.cancel(shutterId)
         self.setPosition(shutterId, newPosition)
 
         # Register command at the end to not impact the lastCommand timer
         state.registerCommand(None)
+        return command
+
+    def stopSent(self, shutterId, commandTime, done, command):
+        state = self.getShutterState(shutterId)
+        if command.cancelled() or command.exception() != None:
+            # the motor did not receive the STOP, the move goes on
+            if state.lastCommandTime == commandTime and state.target != None:
+                self.scheduleFinalPosition(shutterId, abs(state.target - state.positionAt(time.monotonic())) / state.rate, state.target)
+            self.completeFuture(done, command)
+            return
+        if state.lastCommandTime != commandTime:
+            # a newer command took the position from here
+            self.completeFuture(done, command)
+            return
+        # command.result() is when the motor acted on the STOP frame
+        newPosition = state.positionAt(command.result())
+        self.LogDebug("["+shutterId+"] Stopped going " + state.lastCommandDirection + " at position %.1f" % newPosition)
+        self.setPosition(shutterId, newPosition)
+
+        # Register command at the end to not impact the lastCommand timer
+        state.registerCommand(None)
+        self.completeFuture(done, command)
+
+    def getMetrics(self):
+        # timings of the commands sent, served by the web server (/cmd/getMetrics)
+        return dict((stats.name, stats.asDict()) for stats in (self.setupLatency, self.airtime, self.completionOvershoot, self.rfm69ReadyTime))
 
     # Push a set of buttons for a short or long press.
     def pressButtons(self, shutterId, buttons, longPress):
-        self.sendCommand(shutterId, buttons, 35 if longPress else 1)
+        return self.sendCommand(shutterId, buttons, 35 if longPress else 1)
 
     def program(self, shutterId):
-        self.sendCommand(shutterId, self.buttonProg, 1)
+        return self.sendCommand(shutterId, self.buttonProg, 1)
+
+    def stageWaves(self, shutterId = None):
+        # Build the waves of the next rolling code, run by the transmit worker when idle
+        if self.waveCache == None:
+            return
+        for id in ([shutterId] if shutterId != None else list(self.config.Shutters)):
+            if id in self.config.Shutters:
+                self.waveCache.stage(id, int(self.config.Shutters[id]['code']), self.config.SendRepeat, self.config.UseWaveChain,
+                                     (self.buttonUp, self.buttonDown, self.buttonStop))
+
+    def invalidateWaves(self, shutterId):
+        # To be called when a shutter is edited or deleted
+        if self.waveCache != None:
+            self.waveCache.invalidate(shutterId)
+            self.transmitter.submit(self.stageWaves, (shutterId,), priority = TransmitWorker.PRIORITY_LOW)
 
     def registerCallBack(self, callbackFunction):
-        self.callback.append(callbackFunction)
-
-    def sendCommand(self, shutterId, button, repetition): #Sending a frame
+        # called with (shutterId, position) on its own thread, not on the thread changing the
+        # position; a position changed again before delivery is only delivered once
+        self.events.subscribe(callbackFunction)
+
+    def applyConfigChanges(self, changes):
+        # Called by the ConfigWatcher after the config file was changed by hand
+        for shutterId in changes.shuttersRemoved:
+            if self.waveCache != None:
+                self.waveCache.invalidate(shutterId)
+            with self.sutterStateLock:
+                self.shutterStateList.pop(shutterId, None)
+            if self.positions != None:
+                self.positions.remove(shutterId)
+        for shutterId in changes.shuttersAdded + changes.shuttersChanged:
+            self.invalidateWaves(shutterId)
+
+    def sendCommand(self, shutterId, button, repetition): #Queue a frame
     # Sending more than two repetitions after the original frame means a button kept pressed and moves the blind in steps 
     # to adjust the tilt. Sending the original frame and three repetitions is the smallest adjustment, sending the original
     # frame and more repetitions moves the blinds up/down for a longer time.
     # To activate the program mode (to register or de-register additional remotes) of your Somfy blinds, long press the 
     # prog button (at least thirteen times after the original frame to activate the registration.
-        self.LogDebug("sendCommand: Waiting for Lock")
-        self.lock.acquire()
-        try:
-            
-            self.LogDebug("sendCommand: Lock aquired")
-            checksum = 0
-
-            teleco = int(shutterId, 16)
-            code = int(self.config.Shutters[shutterId]['code'])
-
-            # print (codecs.encode(shutterId, 'hex_codec'))
-            self.config.setCode(shutterId, code+1)
-
-            self.LogInfo ("Remote  :		" + "0x%0.2X" % teleco + ' (' + self.config.Shutters[shutterId]['name'] + ')')
-            self.LogInfo ("Button  :		" + "0x%0.2X" % button)
-            self.LogInfo ("Rolling code : " + str(code))
-            self.LogInfo ("")
-
-            wf = createWaveForm(self.TXGPIO, teleco, button, code, repetition, self.log)
-
-            if not (self.config.Rfm69Enabled):
-
-                pi = pigpio.pi(host=self.config.PIGPIOHost, port=self.config.PIGPIOPort) 
-
-                if not pi.connected:
-                    exit()
-
-                pi.wave_add_new()
-                pi.set_mode(self.TXGPIO, pigpio.OUTPUT)
-
-                pi.wave_add_generic(wf)
-                wid = pi.wave_create()
-        
-                pi.wave_send_once(wid)
-
-                while pi.wave_tx_busy():
-                    sleep(0.1)
-
-                pi.wave_delete(wid)
+    # The frame is sent by the transmit worker, the returned future completes once it has been sent.
+        if button in (self.buttonStop, self.buttonProg):
+            priority = TransmitWorker.PRIORITY_HIGH
+        else:
+            priority = TransmitWorker.PRIORITY_NORMAL
+        self.abortPreciseMove(shutterId)
+        state = self.shutterStateList.get(shutterId)
+        previousState = state.snapshot() if state != None else None
+        command = self.transmitter.submit(self.sendFrame, (shutterId, button, repetition), priority = priority,
+                                          key = shutterId, supersede = (button == self.buttonStop))
+        # taken before the caller registers the command, see stop
+        command.previousState = previousState
+        self.LogDebug("sendCommand: queued command " + str(command.commandId) + " for " + shutterId)
+        return command
+
+    def sendFrame(self, shutterId, button, repetition): #Sending a frame, called by the transmit worker only
+        checksum = 0
+
+        teleco = int(shutterId, 16)
+        code = int(self.config.Shutters[shutterId]['code'])
+
+        # print (codecs.encode(shutterId, 'hex_codec'))
+        self.config.setCode(shutterId, code+1)
+
+        self.LogInfo ("Remote  :		" + "0x%0.2X" % teleco + ' (' + self.config.Shutters[shutterId]['name'] + ')')
+        self.LogInfo ("Button  :		" + "0x%0.2X" % button)
+        self.LogInfo ("Rolling code : " + str(code))
+        self.LogInfo ("")
+
+        staged = None
+        if self.waveCache != None:
+            staged = self.waveCache.take(shutterId, button, code, repetition, self.config.UseWaveChain)
+
+        if staged != None:
+            self.LogDebug("Using staged waves for rolling code " + str(code))
+            wf, repeatWf, wids, micros = staged.waveform, staged.repeatWaveForm, staged.wids, staged.micros
+        elif self.config.UseWaveChain:
+            wf, repeatWf, wids, micros = createWaveFrames(self.TXGPIO, teleco, button, code, self.log, compact = True) + (None, None)
+        else:
+            wf, repeatWf, wids, micros = createWaveForm(self.TXGPIO, teleco, button, code, repetition, self.log, compact = True), None, None, None
 
-                pi.stop()
+        setupStartTime = time.monotonic()
+        for attempt in range(2):
+            try:
+                startTime = self.transmit(wf, repeatWf, repetition, setupStartTime, wids, micros)
+                break
+            except Exception as e1:
+                # the connection may be stale (e.g. pigpiod was restarted), reconnect and try once more
+                self.closeRfm69Tx()
+                self.pigpio.reset()
+                if self.waveCache != None:
+                    # the waves taken for this frame may not have been deleted by transmit
+                    self.waveCache.dropUploads([staged] if staged != None else [])
+                wids = None
+                if attempt > 0:
+                    raise
+                self.LogWarn("Transmit failed, reconnecting to pigpiod and retrying: " + str(e1))
+                setupStartTime = time.monotonic()
+
+        if self.waveCache != None:
+            self.transmitter.submit(self.stageWaves, (shutterId,), priority = TransmitWorker.PRIORITY_LOW)
+
+        # the result of the command future: when the motor acted on the frame
+        return startTime + self.motorReaction
+
+    def transmit(self, wf, repeatWf, repetition, setupStartTime, wids = None, micros = None):
+        pi = self.pigpio.get()
+
+        if not (self.config.Rfm69Enabled):
+            pi.set_mode(self.TXGPIO, pigpio.OUTPUT)
+            self.setupLatency.add(time.monotonic() - setupStartTime)
+            if wids != None: # waves already uploaded by the wave cache
+                try:
+                    airtime, overshoot = sendWaves(pi, wids, repetition, micros)
+                finally:
+                    deleteWaves(pi, wids)
             else:
-                with SomfyRfm69Tx(self.config.Rfm69ResetGPIO, self.TXGPIO, spichannel=self.config.Rfm69SPIChannel, pigpiohost=self.config.PIGPIOHost, pigpioport=self.config.PIGPIOPort) as s69Tx:
-
-                    s69Tx.sendWaveForm(wf)
-
-
-        finally:
-            self.lock.release()
-            self.LogDebug("sendCommand: Lock released")
-
-    
+                airtime, overshoot = transmitWaveForm(pi, wf, repeatWf, repetition)
+        else:
+            s69Tx = self.getRfm69Tx(pi)
+            connectedTime = time.monotonic()
+            airtime, overshoot = s69Tx.sendWaveForm(wf, repeatWf, repetition)
+            if s69Tx.lastWarmReset:
+                self.LogWarn("Rfm69 lost its registers while in standby (reset or brown out?), it was initialised again")
+            self.setupLatency.add(connectedTime - setupStartTime + s69Tx.lastSetupTime)
+            self.rfm69ReadyTime.add(s69Tx.lastReadyTime)
+            self.LogDebug("Rfm69 SPI transactions: " + str(s69Tx.lastSpiTransactions) + ", " + self.rfm69ReadyTime.summary())
+
+        self.airtime.add(airtime)
+        if overshoot != None:
+            self.completionOvershoot.add(overshoot)
+        self.LogDebug(self.setupLatency.summary())
+        self.LogDebug(self.airtime.summary() + ", " + self.completionOvershoot.summary())
+        # when the transmission started
+        return time.monotonic() - airtime
+
+    def getRfm69Tx(self, pi):
+        # The transmitter is kept between commands so a warm session can be re-used
+        if self.rfm69Tx != None and self.rfm69Tx.pi is not pi:
+            self.closeRfm69Tx()
+        if self.rfm69Tx == None:
+            self.rfm69Tx = SomfyRfm69Tx(self.config.Rfm69ResetGPIO, self.TXGPIO, spichannel=self.config.Rfm69SPIChannel, pigpiohost=self.config.PIGPIOHost, pigpioport=self.config.PIGPIOPort, pi=pi,
+                                        keepWarm=self.config.Rfm69KeepWarm, idleTimeout=self.config.Rfm69IdleTimeout,
+                                        readyBcmPinNumber=self.config.Rfm69Dio0GPIO if self.config.Rfm69Dio0GPIO >= 0 else None)
+        return self.rfm69Tx
+
+    def closeRfm69Tx(self):
+        if self.rfm69Tx != None:
+            try:
+                self.rfm69Tx.close()
+            except Exception as e1:
+                self.LogDebug("Error closing Rfm69 transmitter: " + str(e1))
+            self.rfm69Tx = None
 
 
 class operateShutters(MyLog):
@@ -322,9 +765,9 @@ class operateShutters(MyLog):
             else: 
                 copyfile(defaultConfigFile, self.ConfigFile)
 
-        # read config file
+        # read config file, the rolling code journal is only opened by the instance that runs
         self.config = MyConfig(filename = self.ConfigFile, log = self.console)
-        result = self.config.LoadConfig();
+        result = self.config.LoadConfig(openJournal = False);
         if not result:
             self.LogConsole("Failure to load configuration parameters")
             sys.exit(1)
@@ -338,19 +781,27 @@ class operateShutters(MyLog):
             self.LogWarn("operateShutters.py is already loaded.")
             sys.exit(1)
 
+        if self.config.RollingCodeJournal and not self.config.openCodeJournal():
+            self.LogConsole("Failure to open the rolling code journal")
+            sys.exit(1)
+
         if self.config.PIGPIOHost == "localhost" and not self.startPIGPIO():
             self.LogConsole("Not able to start PIGPIO")
             sys.exit(1)
 
         self.shutter = Shutter(log = self.log, config = self.config)
 
-        # atexit.register(self.Close)
-        # signal.signal(signal.SIGTERM, self.Close)
-        # signal.signal(signal.SIGINT, self.Close)
-
         self.schedule = Schedule(log = self.log, config = self.config)
+        self.sunTimes = SunTimes(self.config.FileName + ".suntimes", log = self.log, config = self.config)
         self.scheduler = None
         self.webServer = None
+        self.configWatcher = None
+        self.alexa = None
+        self.mqtt = None
+
+        # the config is closed on shutdown, so the rolling codes sent are on disk
+        signal.signal(signal.SIGTERM, self.Close)
+        signal.signal(signal.SIGINT, self.Close)
 
         if (args.echo == True):
             self.alexa = Alexa(kwargs={'log':self.log, 'shutter': self.shutter, 'config': self.config})
@@ -423,23 +874,23 @@ class operateShutters(MyLog):
             parser.print_help()
 
         elif ((args.shutterName != "") and (args.down == True)):
-            self.shutter.lower(self.config.ShuttersByName[args.shutterName])
+            self.shutter.lower(self.config.ShuttersByName[args.shutterName]).result()
         elif ((args.shutterName != "") and (args.up == True)):
-            self.shutter.rise(self.config.ShuttersByName[args.shutterName])
+            self.shutter.rise(self.config.ShuttersByName[args.shutterName]).result()
         elif ((args.shutterName != "") and (args.stop == True)):
-            self.shutter.stop(self.config.ShuttersByName[args.shutterName])
+            self.shutter.stop(self.config.ShuttersByName[args.shutterName]).result()
         elif ((args.shutterName != "") and (args.program == True)):
-            self.shutter.program(self.config.ShuttersByName[args.shutterName])
+            self.shutter.program(self.config.ShuttersByName[args.shutterName]).result()
         elif ((args.shutterName != "") and (args.demo == True)):
             self.LogInfo ("lowering shutter for 7 seconds")
-            self.shutter.lowerPartial(self.config.ShuttersByName[args.shutterName], 7)
+            self.shutter.lowerPartial(self.config.ShuttersByName[args.shutterName], 7).result()
             time.sleep(7)
             self.LogInfo ("rise shutter for 7 seconds")
-            self.shutter.risePartial(self.config.ShuttersByName[args.shutterName], 7)
+            self.shutter.risePartial(self.config.ShuttersByName[args.shutterName], 7).result()
         elif ((args.shutterName != "") and (args.duskdawn is not None)):
             self.schedule.addRepeatEventBySunrise([self.config.ShuttersByName[args.shutterName]], 'up', args.duskdawn[1], ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
             self.schedule.addRepeatEventBySunset([self.config.ShuttersByName[args.shutterName]], 'down', args.duskdawn[0], ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
-            self.scheduler = Scheduler(kwargs={'log':self.log, 'schedule':self.schedule, 'shutter': self.shutter, 'config': self.config})
+            self.scheduler = Scheduler(kwargs={'log':self.log, 'schedule':self.schedule, 'shutter': self.shutter, 'config': self.config, 'sunTimes': self.sunTimes})
             self.scheduler.setDaemon(True)
             self.scheduler.start()
             if (args.echo == True):
@@ -463,10 +914,20 @@ class operateShutters(MyLog):
             for btn in args.press:
                 buttons |= btnMap[btn]
 
-            self.shutter.pressButtons(self.config.ShuttersByName[args.shutterName], buttons, args.long)
+            self.shutter.pressButtons(self.config.ShuttersByName[args.shutterName], buttons, args.long).result()
         elif (args.auto == True):
             self.schedule.loadScheudleFromConfig()
-            self.scheduler = Scheduler(kwargs={'log':self.log, 'schedule':self.schedule, 'shutter': self.shutter, 'config': self.config})
+            self.configWatcher = ConfigWatcher(kwargs={'log':self.log, 'config': self.config})
+            self.configWatcher.registerCallBack(self.shutter.applyConfigChanges)
+            self.configWatcher.registerCallBack(self.schedule.applyConfigChanges)
+            if (args.echo == True):
+                self.configWatcher.registerCallBack(self.alexa.applyConfigChanges)
+            if (args.mqtt == True):
+                self.configWatcher.registerCallBack(self.mqtt.applyConfigChanges)
+            self.configWatcher.setDaemon(True)
+            self.configWatcher.start()
+            self.shutter.transmitter.submit(self.shutter.stageWaves, priority = TransmitWorker.PRIORITY_LOW)
+            self.scheduler = Scheduler(kwargs={'log':self.log, 'schedule':self.schedule, 'shutter': self.shutter, 'config': self.config, 'sunTimes': self.sunTimes})
             self.scheduler.setDaemon(True)
             self.scheduler.start()
             if (args.echo == True):
@@ -475,7 +936,7 @@ class operateShutters(MyLog):
             if (args.mqtt == True):
                 self.mqtt.setDaemon(True)
                 self.mqtt.start()
-            self.webServer = FlaskAppWrapper(name='WebServer', static_url_path=os.path.dirname(os.path.realpath(__file__))+'/html', log = self.log, shutter = self.shutter, schedule = self.schedule, config = self.config)
+            self.webServer = FlaskAppWrapper(name='WebServer', static_url_path=os.path.dirname(os.path.realpath(__file__))+'/html', log = self.log, shutter = self.shutter, schedule = self.schedule, config = self.config, sunTimes = self.sunTimes)
             self.webServer.run()
         else:
             parser.print_help()
@@ -497,6 +958,10 @@ class operateShutters(MyLog):
     #---------------------operateShutters::Close----------------------------------------
     def Close(self, signum = None, frame = None):
 
+        # called at the end of ProcessCommand and on SIGTERM/SIGINT, only the first call closes
+        if self.IsStopping:
+            return
+
         # we dont really care about the errors that may be generated on shutdown
         try:
             self.IsStopping = True
@@ -507,9 +972,13 @@ class operateShutters(MyLog):
 
         try:
             self.ProgramComplete = True
+            self.shutter.close()
+            if (not self.configWatcher == None):
+                self.configWatcher.shutdown_flag.set()
+                self.configWatcher.join()
             if (not self.scheduler == None):
                 self.LogError("Stopping Scheduler. This can take up to 1 second...")
-                self.scheduler.shutdown_flag.set()
+                self.scheduler.shutdown()
                 self.scheduler.join()
                 self.LogError("Scheduler stopped. Now exiting.")
             if (not self.alexa == None):
@@ -526,9 +995,12 @@ class operateShutters(MyLog):
                 self.LogError("Stopping WebServer. This can take up to 1 second...")
                 self.webServer.shutdown_server()
                 self.LogError("WebServer stopped. Now exiting.")
-            sys.exit(0)
         except:
             pass
+        finally:
+            # last, once nothing sends frames anymore
+            self.config.close()
+        sys.exit(0)
 
 #------------------- Command-line interface for monitor ------------------------
 
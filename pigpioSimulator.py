@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in for pigpiod, to run and benchmark the transmit path without a Raspberry Pi.
+
+SimulatedPi can be used wherever a pigpio.pi instance is expected (e.g. as the factory of
+mypigpio.PigpioConnection, or by setting PIGPIOHost = simulator in the config file).  It
+records GPIO writes, uploaded waves and SPI transfers with timestamps, plays waves and wave
+chains back in real time so wave_tx_busy behaves like on the real daemon, and emulates the
+registers of an RFM69 module connected to the SPI bus.
+
+Only the calls used by this project are implemented.
+"""
+
+import threading
+from time import monotonic
+
+try:
+    from pigpio import error
+except ImportError:
+    class error(Exception):
+        pass
+
+SIMULATOR_HOST = "simulator"     # as mypigpio.SIMULATOR_HOST
+
+MAX_WAVES = 250         # same limits as pigpiod with its default settings
+MAX_PULSES = 12000
+
+class SimulatedPulse(object):
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+class SimulatedCallback(object):
+    def __init__(self, pi, gpio, edge, func):
+        self.pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        with self.pi.lock:
+            if self in self.pi.callbacks:
+                self.pi.callbacks.remove(self)
+
+class SimulatedRfm69(object):
+    """Register file of an RFM69 module, enough for the Somfy transmitter"""
+
+    RESET_VALUES = {0x01: 0x04, 0x02: 0x00, 0x07: 0xE4, 0x08: 0xC0, 0x09: 0x00, 0x11: 0x9F, 0x13: 0x1A, 0x18: 0x08,
+                    0x19: 0x86, 0x25: 0x00, 0x26: 0x07, 0x27: 0x80, 0x5A: 0x55, 0x5C: 0x70}
+
+    def __init__(self, modeSwitchTime = 0.0005):
+        self.modeSwitchTime = modeSwitchTime
+        self.modeChangeListener = None
+        self.reset()
+
+    def reset(self):
+        self.registers = bytearray(0x80)
+        for address, value in self.RESET_VALUES.items():
+            self.registers[address] = value
+        self.modeReadyTime = monotonic()
+
+    def mode(self):
+        return (self.registers[0x01] >> 2) & 0x07
+
+    def isModeReady(self):
+        return monotonic() >= self.modeReadyTime
+
+    def read(self, address):
+        if address == 0x27:
+            flags = self.registers[0x27] & ~0xA0
+            if self.isModeReady():
+                flags |= 0x80                               # ModeReady
+                if self.mode() == 0x03:
+                    flags |= 0x20                           # TxReady
+            return flags
+        return self.registers[address]
+
+    def write(self, address, value):
+        previousMode = self.mode()
+        self.registers[address] = value
+        if address == 0x01 and self.mode() != previousMode:
+            self.modeReadyTime = monotonic() + self.modeSwitchTime
+            if self.modeChangeListener != None:
+                self.modeChangeListener(self)
+
+    def xfer(self, data):
+        # first byte is the address with the write flag in bit 7, the address auto-increments
+        address = data[0] & 0x7F
+        result = bytearray(len(data))
+        for i in range(1, len(data)):
+            register = (address + i - 1) & 0x7F
+            if data[0] & 0x80:
+                self.write(register, data[i])
+            else:
+                result[i] = self.read(register)
+        return result
+
+class SimulatedPi(object):
+    """Drop-in replacement for pigpio.pi talking to a simulated daemon"""
+
+    def __init__(self, host = SIMULATOR_HOST, port = 8888, rfm69ResetGpio = 25, rfm69 = None, rfm69Dio0Gpio = None):
+        self.connected = True
+        self.lock = threading.RLock()
+        self.startTime = monotonic()
+
+        self.modes = {}
+        self.levels = {}
+        self.callbacks = []
+        self.gpioWrites = []            # (time, gpio, level)
+
+        self.pendingPulses = []
+        self.waves = {}                 # wid -> list of (gpio_on, gpio_off, delay)
+        self.transmissions = []         # see _startTransmission
+        self.currentTransmission = None
+
+        self.rfm69ResetGpio = rfm69ResetGpio
+        self.rfm69 = rfm69 if rfm69 != None else SimulatedRfm69()
+        self.rfm69Dio0Gpio = rfm69Dio0Gpio
+        self.rfm69.modeChangeListener = self._rfm69ModeChanged
+        self.spiHandles = {}
+        self.spiTransfers = []          # (time, handle, data written, data read)
+
+    def stop(self):
+        self.connected = False
+
+    def get_current_tick(self):
+        self._checkConnected()
+        return int((monotonic() - self.startTime) * 1000000) & 0xFFFFFFFF
+
+    def get_pigpio_version(self):
+        return 79
+
+    #---------------------GPIO-------------------------------------------------
+    def set_mode(self, gpio, mode):
+        self._checkConnected()
+        self.modes[gpio] = mode
+        return 0
+
+    def get_mode(self, gpio):
+        return self.modes.get(gpio, 0)
+
+    def set_pull_up_down(self, gpio, pud):
+        self._checkConnected()
+        return 0
+
+    def read(self, gpio):
+        self._checkConnected()
+        return self.levels.get(gpio, 0)
+
+    def write(self, gpio, level):
+        self._checkConnected()
+        self._setLevel(gpio, 1 if level else 0)
+        if gpio == self.rfm69ResetGpio and level:
+            self.rfm69.reset()
+            self._rfm69ModeChanged(self.rfm69)
+        return 0
+
+    def callback(self, user_gpio, edge = 0, func = None):
+        cb = SimulatedCallback(self, user_gpio, edge, func)
+        with self.lock:
+            self.callbacks.append(cb)
+        return cb
+
+    def _setLevel(self, gpio, level):
+        with self.lock:
+            previous = self.levels.get(gpio, 0)
+            self.levels[gpio] = level
+            self.gpioWrites.append((monotonic(), gpio, level))
+            callbacks = [cb for cb in self.callbacks if cb.gpio == gpio]
+        if previous != level:
+            tick = self.get_current_tick()
+            for cb in callbacks:
+                # edge: 0 = rising, 1 = falling, 2 = either (as pigpio.RISING_EDGE, ...)
+                if cb.edge == 2 or cb.edge == (0 if level else 1):
+                    if cb.func != None:
+                        cb.func(gpio, level, tick)
+
+    def _rfm69ModeChanged(self, rfm69):
+        # DIO0 goes high once the module is ready in TX mode, if mapped to TxReady
+        if self.rfm69Dio0Gpio == None:
+            return
+        if rfm69.mode() != 0x03 or (rfm69.registers[0x25] >> 6) != 0x01:
+            self._setLevel(self.rfm69Dio0Gpio, 0)
+            return
+        modeReadyTime = rfm69.modeReadyTime
+        timer = threading.Timer(max(0, modeReadyTime - monotonic()), self._rfm69Dio0Ready, (rfm69, modeReadyTime))
+        timer.daemon = True
+        timer.start()
+
+    def _rfm69Dio0Ready(self, rfm69, modeReadyTime):
+        if rfm69.modeReadyTime == modeReadyTime and rfm69.mode() == 0x03:
+            self._setLevel(self.rfm69Dio0Gpio, 1)
+
+    #---------------------Waves------------------------------------------------
+    def wave_clear(self):
+        self._checkConnected()
+        with self.lock:
+            self.waves = {}
+            self.pendingPulses = []
+        return 0
+
+    def wave_add_new(self):
+        self._checkConnected()
+        self.pendingPulses = []
+        return 0
+
+    def wave_add_generic(self, pulses):
+        self._checkConnected()
+        for p in pulses:
+            self.pendingPulses.append((p.gpio_on, p.gpio_off, p.delay))
+        return len(self.pendingPulses)
+
+    def wave_get_micros(self):
+        return sum(p[2] for p in self.pendingPulses)
+
+    def wave_create(self):
+        self._checkConnected()
+        with self.lock:
+            if len(self.waves) >= MAX_WAVES:
+                raise error("no more waveform ids")
+            if sum(len(w) for w in self.waves.values()) + len(self.pendingPulses) > MAX_PULSES:
+                raise error("No more CBs for waveform")
+            wid = 0
+            while wid in self.waves:
+                wid += 1
+            self.waves[wid] = self.pendingPulses
+            self.pendingPulses = []
+        return wid
+
+    def wave_delete(self, wave_id):
+        self._checkConnected()
+        with self.lock:
+            if wave_id not in self.waves:
+                raise error("bad wave id")
+            del self.waves[wave_id]
+        return 0
+
+    def wave_send_once(self, wave_id):
+        self._checkConnected()
+        return self._startTransmission([wave_id], [('wave', wave_id)])
+
+    def wave_chain(self, data):
+        self._checkConnected()
+        segments, position = self._parseChain(list(data), 0)
+        return self._startTransmission(list(data), segments)
+
+    def wave_tx_busy(self):
+        self._checkConnected()
+        with self.lock:
+            return 1 if self.currentTransmission != None and monotonic() < self.currentTransmission['end'] else 0
+
+    def wave_tx_stop(self):
+        with self.lock:
+            if self.currentTransmission != None:
+                self.currentTransmission['end'] = min(self.currentTransmission['end'], monotonic())
+        return 0
+
+    def _parseChain(self, data, position, inLoop = False):
+        # returns the expanded list of ('wave', wid) / ('delay', micros) and the next position
+        segments = []
+        while position < len(data):
+            if data[position] != 255:
+                segments.append(('wave', data[position]))
+                position += 1
+            elif data[position + 1] == 0:                   # loop start
+                block, position = self._parseChain(data, position + 2, True)
+                count = data[position + 2] + 256 * data[position + 3]
+                segments += block * count
+                position += 4
+            elif data[position + 1] == 1:                   # loop end
+                if not inLoop:
+                    raise error("chain loop end without loop start")
+                return segments, position
+            elif data[position + 1] == 2:                   # delay
+                segments.append(('delay', data[position + 2] + 256 * data[position + 3]))
+                position += 4
+            else:
+                raise error("unsupported chain command " + str(data[position + 1]))
+        if inLoop:
+            raise error("chain loop start without loop end")
+        return segments, position
+
+    def _startTransmission(self, request, segments):
+        with self.lock:
+            startTime = monotonic()
+            offset = 0
+            events = []                                     # (offset in micros, wid or None for delays, micros)
+            for kind, value in segments:
+                if kind == 'wave':
+                    if value not in self.waves:
+                        raise error("bad wave id")
+                    micros = sum(p[2] for p in self.waves[value])
+                    events.append((offset, value, micros))
+                else:
+                    micros = value
+                    events.append((offset, None, micros))
+                offset += micros
+            transmission = {'start': startTime, 'end': startTime + offset / 1000000.0, 'micros': offset,
+                            'request': request, 'events': events}
+            self.transmissions.append(transmission)
+            self.currentTransmission = transmission
+        return len(events)
+
+    #---------------------SPI--------------------------------------------------
+    def spi_open(self, spi_channel, baud, spi_flags = 0):
+        self._checkConnected()
+        handle = len(self.spiHandles)
+        self.spiHandles[handle] = spi_channel
+        return handle
+
+    def spi_close(self, handle):
+        self.spiHandles.pop(handle, None)
+        return 0
+
+    def spi_xfer(self, handle, data):
+        self._checkConnected()
+        if handle not in self.spiHandles:
+            raise error("bad SPI handle")
+        data = bytearray(data)
+        with self.lock:
+            result = self.rfm69.xfer(data)
+            self.spiTransfers.append((monotonic(), handle, bytes(data), bytes(result)))
+        return len(result), result
+
+    def _checkConnected(self):
+        if not self.connected:
+            raise ConnectionResetError("simulated pigpio connection is closed")
+
+
+if __name__ == "__main__":
+    # Latency of the transmit path against the simulator: python3 pigpioSimulator.py
+    import logging
+    from somfyRtsWaveForm import createWaveForm, createWaveFrames, transmitWaveForm
+    from somfyRfm69Transmitter import SomfyRfm69Tx
+
+    logger = logging.getLogger("pigpioSimulator")
+    logger.setLevel(logging.CRITICAL)
+    pi = SimulatedPi()
+
+    for repetition in (1, 2):
+        wf = createWaveForm(4, 0x279621, 0x4, 42, repetition, logger, compact = True)
+        startTime = monotonic()
+        airtime, overshoot = transmitWaveForm(pi, wf)
+        print("GPIO  repetition=%d : command %6.1f ms, airtime %6.1f ms, overshoot %5.2f ms" %
+              (repetition, (monotonic() - startTime) * 1000, airtime * 1000, overshoot * 1000))
+
+    wf, repeatWf = createWaveFrames(26, 0x279621, 0x4, 43, logger, compact = True)
+    with SomfyRfm69Tx(pi = pi) as s69Tx:
+        startTime = monotonic()
+        airtime, overshoot = s69Tx.sendWaveForm(wf, repeatWf, 2)
+        print("RFM69 repetition=2 : command %6.1f ms, setup %5.1f ms, %d SPI transfers" %
+              ((monotonic() - startTime) * 1000, s69Tx.lastSetupTime * 1000, s69Tx.lastSpiTransactions))
+
+    with SomfyRfm69Tx(pi = pi, keepWarm = True) as s69Tx:
+        for code in (44, 45, 46):
+            wf, repeatWf = createWaveFrames(26, 0x279621, 0x4, code, logger, compact = True)
+            s69Tx.sendWaveForm(wf, repeatWf, 2)
+            print("RFM69 warm session  : setup %5.1f ms, %d SPI transfers" % (s69Tx.lastSetupTime * 1000, s69Tx.lastSpiTransactions))
+
+    pi = SimulatedPi(rfm69Dio0Gpio = 24)
+    for readyPin in (None, 24):
+        with SomfyRfm69Tx(pi = pi, keepWarm = True, readyBcmPinNumber = readyPin) as s69Tx:
+            for code in (47, 48, 49):
+                wf, repeatWf = createWaveFrames(26, 0x279621, 0x4, code, logger, compact = True)
+                s69Tx.sendWaveForm(wf, repeatWf, 2)
+                print("RFM69 %-13s : setup %5.1f ms, time to ready %5.2f ms, %d SPI transfers" % ("DIO0 callback" if readyPin else "polling",
+                      s69Tx.lastSetupTime * 1000, s69Tx.lastReadyTime * 1000, s69Tx.lastSpiTransactions))
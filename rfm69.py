@@ -14,48 +14,99 @@ ERROR = 1
 INFO = 2
 TRACE = 3
 
+# registers changing by themselves (FIFO, IRQ flags, RSSI and temperature readings), never shadowed
+VOLATILE_REGISTERS = frozenset([0x00, 0x0A, 0x23, 0x24, 0x27, 0x28, 0x4E, 0x4F])
+
 class Rfm69(object):
     """RFM69-Class"""
     # pylint: disable=too-many-instance-attributes, C0301, C0103
 
-    def __init__(self, host="localhost", port=8888, channel=0, baudrate=10000000, debug_level=0):
+    def __init__(self, host="localhost", port=8888, channel=0, baudrate=10000000, debug_level=0, pi=None):
         # general variables
         self.debug_level = debug_level
 
-        # RFM69-specific variables
-        self.pi = gpio.pi(host, port)
+        # RFM69-specific variables, re-use the caller's pigpio connection if given
+        self.ownPi = pi is None
+        self.pi = gpio.pi(host, port) if self.ownPi else pi
         self.handle = self.pi.spi_open(channel, baudrate, 0)    # Flags: CPOL=0 and CPHA=0
 
+        # last value known to be in each register, writes of unchanged values are skipped
+        self.shadow = {}
+        # number of SPI round trips to pigpiod
+        self.transactions = 0
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """clean up stuff"""
+        self.close()
+
+    def close(self):
+        """Release the SPI handle (and the pigpio connection if it is not shared)"""
         self.pi.spi_close(self.handle)
-        self.pi.stop()
+        if self.ownPi:
+            self.pi.stop()
 
     def debug(self, message, level=0):
         """Debug output depending on debug level."""
         if self.debug_level >= level:
             print (message)
 
+    def invalidate_shadow(self):
+        """Forget the known register values, e.g. after the module was reset"""
+        self.shadow = {}
+
+    def _xfer(self, data):
+        self.transactions += 1
+        return self.pi.spi_xfer(self.handle, data)
+
+    def _remember(self, address, values):
+        for i, value in enumerate(values):
+            if (address + i) not in VOLATILE_REGISTERS:
+                self.shadow[address + i] = value
+
     def read_single(self, address):
         """Read single register via spi"""
-        (count, data) = self.pi.spi_xfer(self.handle, [address & 0x7F, 0x00])
+        (count, data) = self._xfer([address & 0x7F, 0x00])
+        self._remember(address, [data[1]])
         return data[1]
 
     def write_single(self, address, value):
-        """Write single register via spi"""
-        (count, data) = self.pi.spi_xfer(self.handle, [address | 0x80, value])
+        """Write single register via spi, skipped if the register already holds value"""
+        if self.shadow.get(address) == value:
+            return True
+        (count, data) = self._xfer([address | 0x80, value])
+        self._remember(address, [value])
         return count == 2
 
     def write_burst(self, address, data):
-        """Write bytearray of data beginning at address"""
-        (count, data) = self.pi.spi_xfer(self.handle, [address | 0x80] + data)
+        """Write bytearray of data beginning at address, skipped if the registers already hold data"""
+        if all(self.shadow.get(address + i) == value for i, value in enumerate(data)):
+            return True
+        (count, result) = self._xfer([address | 0x80] + list(data))
+        self._remember(address, data)
         return count == (len(data)+1)
 
     def write_config(self, cfg):
-        """Write cfg-tuble like this: ((register1, value1), (register2, value2), ...)"""
-        for i in range(0, len(cfg)):
-            reg, val = cfg[i]
-            self.write_single(reg, val)
+        """Write cfg-tuble like this: ((register1, value1), (register2, value2), ...)
+
+        Registers already holding their value are skipped and runs of consecutive
+        addresses are merged into one burst, the order of the writes is kept."""
+        run_address, run = None, []
+        for reg, val in cfg:
+            # the value the register will hold once the run queued so far is written
+            if run and 0 <= reg - run_address < len(run):
+                current = run[reg - run_address]
+            else:
+                current = self.shadow.get(reg)
+            if current == val:
+                continue
+            if run and reg == run_address + len(run):
+                run.append(val)
+                continue
+            if run:
+                self.write_burst(run_address, run)
+            run_address, run = reg, [val]
+        if run:
+            self.write_burst(run_address, run)
@@ -19,16 +19,41 @@ the following files are needed:
 
 import sys
 
-from time import sleep
+import threading
+from time import sleep, monotonic
 import pigpio as gpio
 from rfm69 import Rfm69
 import json
-from somfyRtsWaveForm import createWaveForm
+from somfyRtsWaveForm import createWaveForm, transmitWaveForm
 
 # define pigpio GPIO-pins where self.RESETPIN- and self.DATAPIN-Pin of RFM69-Transceiver are connected
 RESETPINDEFAULT = 25
 DATAPINDEFAULT = 26
 
+# register values to transmit OOK at 433.42 MHz in continuous mode, written in this order
+TRANSMIT_CONFIG = (
+    (0x01, 0b00000100),     # OpMode: STDBY
+    #(0x07, 0x6C), (0x08, 0x9A), (0x09, 0x00), # Frf: Carrier Frequency 434.42MHz
+    (0x07, 0x6C), (0x08, 0x4F), (0x09, 0x5C), # Frf: Carrier Frequency 433.42MHz/61.03515625
+    # Use PA_BOOST
+    (0x13, 0x0F),
+    (0x5A, 0x5D),
+    (0x5C, 0x7C),
+    (0x11, 0b01111111),     # Use PA_BOOST
+    (0x18, 0b00000110),     # Lna: 50 Ohm, highest gain
+    (0x19, 0b01000000),     # RxBw: 4% DCC, BW=250kHz
+    # Transmit Mode
+    (0x02, 0b01101000),     # DataModul: continuous w/o bit sync, OOK, no shaping
+    (0x01, 0b00001100),     # OpMode: SequencerOn, TX
+)
+
+# RegDioMapping1: DIO0 signals TxReady in continuous transmit mode
+DIO_MAPPING_TXREADY = (0x25, 0b01000000)
+
+# RegDataModul, read back before a warm transmission: it resets to 0x00, so another value
+# than the one written shows the module was reset (e.g. a brown out) while in standby
+WARM_CHECK_REGISTER = 0x02
+
 class SomfyRfm69Tx(object):
 
     # define pigpio-host 
@@ -39,11 +64,17 @@ class SomfyRfm69Tx(object):
 
     clock = 640    
 
-    def __init__(self, resetBcmPinNumber = RESETPINDEFAULT, dataBcmPinNumber = DATAPINDEFAULT, pigpiohost="localhost", pigpioport=8888, spichannel=0, spibaudrate=32000):
+    def __init__(self, resetBcmPinNumber = RESETPINDEFAULT, dataBcmPinNumber = DATAPINDEFAULT, pigpiohost="localhost", pigpioport=8888, spichannel=0, spibaudrate=32000, pi=None, keepWarm=False, idleTimeout=300, readyBcmPinNumber=None):
 
         self.piconnected = False
-
-        self.pi = gpio.pi(pigpiohost, pigpioport)
+        self.lastSetupTime = None
+        self.lastSpiTransactions = None
+        self.lastReadyTime = None
+        self.lastWarmReset = False
+
+        # re-use the caller's pigpio connection if given, it is then left open on exit
+        self.ownPi = pi is None
+        self.pi = gpio.pi(pigpiohost, pigpioport) if self.ownPi else pi
         self.RESETPIN = resetBcmPinNumber
         self.DATAPIN = dataBcmPinNumber
         self.pigpiohost = pigpiohost
@@ -51,6 +82,20 @@ class SomfyRfm69Tx(object):
         self.spichannel = spichannel
         self.spibaudrate = spibaudrate
 
+        # In a warm session the module is initialised once and parked in standby between
+        # transmissions. It is only reset and initialised again after an error or when it
+        # has not been used for idleTimeout seconds.
+        self.keepWarm = keepWarm
+        self.idleTimeout = idleTimeout
+        self.rf = None
+        self.lastUsedTime = None
+
+        # If DIO0 of the module is connected, readiness is signalled by an edge on that
+        # pin instead of polling RegIrqFlags1 over SPI.
+        self.READYPIN = readyBcmPinNumber
+        self.readyEvent = threading.Event()
+        self.readyCallback = None
+
         if not self.pi.connected:
             raise RuntimeError("Cannot connect to pigpiod, is the daemon running? (sudo pigpiod)")
         self.piconnected = True
@@ -60,10 +105,47 @@ class SomfyRfm69Tx(object):
 
     def __exit__(self, exc_type, exc_value, traceback):
         """clean up stuff"""
-        if self.piconnected:
+        self.close()
+        if self.piconnected and self.ownPi:
             self.pi.stop()
 
+    def close(self):
+        """End a warm session, the module is reset and SPI released"""
+        if self.readyCallback != None:
+            callback, self.readyCallback = self.readyCallback, None
+            callback.cancel()
+        if self.rf != None:
+            try:
+                self._resetModule()
+            finally:
+                self._closeRf()
+
+    def _closeRf(self):
+        if self.rf != None:
+            rf, self.rf = self.rf, None
+            rf.close()
+
+    def _isWarm(self):
+        return self.rf != None and monotonic() - self.lastUsedTime < self.idleTimeout
+
+    def _resetModule(self):
+        self.pi.write(self.RESETPIN, 1)
+        self.pi.write(self.RESETPIN, 0)
+        sleep(.005)
+
     def _startTransmit(self):
+
+        self.lastWarmReset = False
+        if self._isWarm() and not self._lostConfig():
+            transactions = self.rf.transactions
+            readyStartTime = self._armReady()
+            self.rf.write_single(0x01, 0b00001100)     # OpMode: SequencerOn, TX
+            self._waitForReady(self.rf, readyStartTime)
+            self.lastSpiTransactions += self.rf.transactions - transactions
+            return
+
+        # cold start, e.g. first use or session timed out
+        self._closeRf()
         
         # prepare GPIO-Pins
         self.pi.set_mode(self.RESETPIN, gpio.OUTPUT)
@@ -72,70 +154,113 @@ class SomfyRfm69Tx(object):
         self.pi.write(self.DATAPIN, 0)
 
         # reset transmitter before use
-        self.pi.write(self.RESETPIN, 1)
-        self.pi.write(self.RESETPIN, 0)
-        sleep(.005)
+        self._resetModule()
 
-        with Rfm69(host=self.pigpiohost, channel=self.spichannel, baudrate=self.spibaudrate, debug_level=0) as rf:
+        rf = Rfm69(host=self.pigpiohost, port=self.pigpioport, channel=self.spichannel, baudrate=self.spibaudrate, debug_level=0, pi=self.pi)
+        try:
             # just to make sure SPI is working
             rx_data = rf.read_single(0x5A)
             if rx_data != 0x55:
                 raise RuntimeError(f"Unexpected response reading SPI value, expected {0x55}, got {rx_data}.  Check RFM69 device is properly connected.")
 
-            rf.write_single(0x01, 0b00000100)     # OpMode: STDBY
-
-            #rf.write_burst(0x07, [0x6C, 0x9A, 0x00]) # Frf: Carrier Frequency 434.42MHz
-            rf.write_burst(0x07, [0x6C, 0x4F, 0x5C]) # Frf: Carrier Frequency 433.42MHz/61.03515625 
-
-            # Use PA_BOOST
-            rf.write_single(0x13, 0x0F)
-            rf.write_single(0x5A, 0x5D)
-            rf.write_single(0x5C, 0x7C)
-            rf.write_single(0x11, 0b01111111)     # Use PA_BOOST
-
-            rf.write_single(0x18, 0b00000110)     # Lna: 50 Ohm, highest gain
-            rf.write_single(0x19, 0b01000000)     # RxBw: 4% DCC, BW=250kHz
-
-            # Transmit Mode
-            rf.write_single(0x02, 0b01101000)     # DataModul: continuous w/o bit sync, OOK, no shaping
-            rf.write_single(0x01, 0b00001100)     # OpMode: SequencerOn, TX
-
-            timeout = 1
-            timespent = 0
-            # wait for ready
-            while (rf.read_single(0x27) & 0x80) == 0 and timespent < timeout:
-                timespent += 0.005
-                sleep(.005)
-                pass
-                #print "waiting..."
-            if timespent >= timeout:
-                raise RuntimeError("Timed out waiting for ready signal after initialising RFM69")
+            readyStartTime = self._armReady()
+            if self.READYPIN != None:
+                rf.write_single(*DIO_MAPPING_TXREADY)
+            rf.write_config(TRANSMIT_CONFIG)
+
+            self._waitForReady(rf, readyStartTime)
+        except:
+            rf.close()
+            raise
+        finally:
+            self.lastSpiTransactions += rf.transactions
+
+        if self.keepWarm:
+            self.rf = rf
+            self.lastUsedTime = monotonic()
+        else:
+            rf.close()
+
+    def _lostConfig(self):
+        # one SPI read to make sure the module still holds the registers of the warm session
+        transactions = self.rf.transactions
+        value = self.rf.read_single(WARM_CHECK_REGISTER)
+        self.lastSpiTransactions += self.rf.transactions - transactions
+        if value == dict(TRANSMIT_CONFIG)[WARM_CHECK_REGISTER]:
+            return False
+        # initialise it again from scratch
+        self.lastWarmReset = True
+        self.rf.invalidate_shadow()
+        return True
+
+    def _armReady(self):
+        # must be called before switching to TX so the edge cannot be missed
+        if self.READYPIN != None:
+            if self.readyCallback == None:
+                self.pi.set_mode(self.READYPIN, gpio.INPUT)
+                self.readyCallback = self.pi.callback(self.READYPIN, gpio.RISING_EDGE, self._readyEdge)
+            self.readyEvent.clear()
+        return monotonic()
+
+    def _readyEdge(self, gpio, level, tick):
+        self.readyEvent.set()
+
+    def _waitForReady(self, rf, readyStartTime):
+        timeout = 1
+        if self.READYPIN != None:
+            # the register is only read if no edge arrived in time
+            if not self.readyEvent.wait(timeout) and (rf.read_single(0x27) & 0x80) == 0:
+                raise RuntimeError("Timed out waiting for ready signal on DIO0 after initialising RFM69")
+            self.lastReadyTime = monotonic() - readyStartTime
+            return
+
+        timespent = 0
+        # wait for ready
+        while (rf.read_single(0x27) & 0x80) == 0 and timespent < timeout:
+            timespent += 0.005
+            sleep(.005)
+            pass
+            #print "waiting..."
+        if timespent >= timeout:
+            raise RuntimeError("Timed out waiting for ready signal after initialising RFM69")
+        self.lastReadyTime = monotonic() - readyStartTime
 
     def _endTransmit(self):
-        # reset transmitter
-        self.pi.write(self.RESETPIN, 1)
-        self.pi.write(self.RESETPIN, 0)
-        sleep(.005)
+        if self.rf != None:
+            # park the module in standby until the next transmission
+            transactions = self.rf.transactions
+            self.rf.write_single(0x01, 0b00000100)     # OpMode: STDBY
+            self.lastSpiTransactions += self.rf.transactions - transactions
+            self.lastUsedTime = monotonic()
+        else:
+            # reset transmitter
+            self._resetModule()
 
-    def sendWaveForm(self, waveform):
-        
-        self._startTransmit()
+    def sendWaveForm(self, waveform, repeatWaveForm = None, repetition = 1):
+
+        try:
+            self.lastSpiTransactions = 0
+            setupStartTime = monotonic()
+            self._startTransmit()
+            self.lastSetupTime = monotonic() - setupStartTime
 
-        # delete existing waveforms
-        self.pi.wave_clear()
-        self.pi.wave_add_new()
+            # delete existing waveforms
+            self.pi.wave_clear()
 
-        self.pi.wave_add_generic(waveform)
-        wid = self.pi.wave_create()
-        self.pi.wave_send_once(wid)
+            airtime = transmitWaveForm(self.pi, waveform, repeatWaveForm, repetition)
 
-        # wait until finished
-        while self.pi.wave_tx_busy():
-            sleep(0.1)
+            self.pi.wave_clear()
 
-        self.pi.wave_clear()
+            self._endTransmit()
+        except:
+            # fully initialise the module again on the next transmission
+            try:
+                self.close()
+            except Exception:
+                pass
+            raise
 
-        self._endTransmit()
+        return airtime
 
     
 
@@ -1,12 +1,91 @@
 
 import pigpio
+from array import array
+from time import sleep, monotonic
 
-def createWaveForm(txBcmPinNum, teleco, button, code, repetition, logger = None):
+# Pulse durations of a Somfy RTS frame in microseconds
+WAKEUP_PULSE = 9415
+WAKEUP_SILENCE = 89565
+HW_SYNC = 2560
+SW_SYNC_HIGH = 4550
+SW_SYNC_LOW = 640
+SYMBOL = 640
+INTERFRAME_GAP = 30415
+FRAME_OCTETS = 7
+
+# A pulse of a compact waveform is one 32 bit value: the delay in the low bits, the
+# GPIO above it and the level in the top bit.
+_DELAY_BITS = 26
+_DELAY_MASK = (1 << _DELAY_BITS) - 1
+_HIGH = 1 << 31
+
+# The frame-independent pulse runs only depend on the TX GPIO, so they are
+# built once per GPIO and shared by every waveform created afterwards.
+_segmentCache = {}
+
+class _WaveSegments(object):
+
+    def __init__(self, txBcmPinNum):
+        on = 1<<txBcmPinNum
+        high = lambda delay: pigpio.pulse(on, 0, delay)
+        low = lambda delay: pigpio.pulse(0, on, delay)
+
+        self.firstHeader = [high(WAKEUP_PULSE), low(WAKEUP_SILENCE)] # wake up pulse and silence
+        for i in range(2): # hardware synchronization
+            self.firstHeader += [high(HW_SYNC), low(HW_SYNC)]
+        self.firstHeader += [high(SW_SYNC_HIGH), low(SW_SYNC_LOW)] # software synchronization
+
+        self.repeatHeader = []
+        for i in range(7): # hardware synchronization
+            self.repeatHeader += [high(HW_SYNC), low(HW_SYNC)]
+        self.repeatHeader += [high(SW_SYNC_HIGH), low(SW_SYNC_LOW)] # software synchronization
+
+        self.gap = [low(INTERFRAME_GAP)] # interframe gap
+
+        # manchester encoding of every possible payload octet
+        one = [low(SYMBOL), high(SYMBOL)]
+        zero = [high(SYMBOL), low(SYMBOL)]
+        self.octets = []
+        for octet in range(256):
+            pulses = []
+            for bit in range(7, -1, -1):
+                pulses += one if (octet >> bit) & 1 else zero
+            self.octets.append(pulses)
+
+        # same segments packed one value per pulse for compact waveforms
+        self.firstHeaderArray = _packPulses(txBcmPinNum, self.firstHeader)
+        self.repeatHeaderArray = _packPulses(txBcmPinNum, self.repeatHeader)
+        self.gapArray = _packPulses(txBcmPinNum, self.gap)
+        self.octetArrays = [_packPulses(txBcmPinNum, pulses) for pulses in self.octets]
+
+def _packPulses(txBcmPinNum, pulses):
+    packed = array('I')
+    for p in pulses:
+        packed.append((_HIGH if p.gpio_on else 0) | (txBcmPinNum << _DELAY_BITS) | p.delay)
+    return packed
+
+def _getSegments(txBcmPinNum):
+    segments = _segmentCache.get(txBcmPinNum)
+    if segments == None:
+        segments = _WaveSegments(txBcmPinNum)
+        _segmentCache[txBcmPinNum] = segments
+    return segments
+
+def _logFrame(title, frame, logger):
+    outstring = title
+    for octet in frame:
+        outstring = outstring + "0x%0.2X" % octet + ' '
+    if logger == None:
+        print(outstring)
+    else:
+        logger.info (outstring)
+
+def encodeFrame(teleco, button, code, logger = None, logFrame = True):
 
     checksum = 0
 
     frame = bytearray(7)
-    
+
     frame[0] = 0xA7;       # Encryption key. Doesn't matter much
     frame[1] = button << 4 # Which button did  you press? The 4 LSB will be the checksum
     frame[2] = code >> 8               # Rolling code (big endian)
@@ -16,13 +95,8 @@ def createWaveForm(txBcmPinNum, teleco, button, code, repetition, logger = None)
     frame[5] = ((teleco >>  8) & 0xFF) # Remote address
     frame[6] = (teleco & 0xFF)         # Remote address
 
-    outstring = "Frame  :    "
-    for octet in frame:
-        outstring = outstring + "0x%0.2X" % octet + ' '
-    if logger == None:
-        print(outstring)
-    else:
-        logger.info (outstring)
+    if logFrame:
+        _logFrame("Frame  :    ", frame, logger)
 
     for i in range(0, 7):
         checksum = checksum ^ frame[i] ^ (frame[i] >> 4)
@@ -31,63 +105,248 @@ def createWaveForm(txBcmPinNum, teleco, button, code, repetition, logger = None)
 
     frame[1] |= checksum;
 
-    outstring = "With cks  : "
-    for octet in frame:
-        outstring = outstring + "0x%0.2X" % octet + ' '
-    if logger == None:
-        print(outstring)
-    else:
-        logger.info (outstring)
-
+    if logFrame:
+        _logFrame("With cks  : ", frame, logger)
 
     for i in range(1, 7):
         frame[i] ^= frame[i-1];
 
-    outstring = "Obfuscated :"
-    for octet in frame:
-        outstring = outstring + "0x%0.2X" % octet + ' '
-    if logger == None:
-        print(outstring)
-    else:
-        logger.info (outstring)
+    if logFrame:
+        _logFrame("Obfuscated :", frame, logger)
+
+    return frame
+
+class _PulseView(object):
+    """Sequence of pigpio.pulse values read from a compact waveform.
+
+    A single pulse object is updated in place for every element, so callers must
+    consume each pulse before advancing (as wave_add_generic does)."""
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed)
 
+    def __iter__(self):
+        p = pigpio.pulse(0, 0, 0)
+        for value in self.packed:
+            gpio = 1 << ((value & ~_HIGH) >> _DELAY_BITS)
+            if value & _HIGH:
+                p.gpio_on, p.gpio_off = gpio, 0
+            else:
+                p.gpio_on, p.gpio_off = 0, gpio
+            p.delay = value & _DELAY_MASK
+            yield p
+
+def toPigpioPulses(waveform):
+    """Convert a waveform to what pigpio's wave_add_generic expects.
+
+    Compact waveforms (array of one packed value per pulse) are only turned into
+    pigpio.pulse objects while pigpio packs them for the daemon."""
+    if isinstance(waveform, array):
+        return _PulseView(waveform)
+    return waveform
+
+def createWaveFrames(txBcmPinNum, teleco, button, code, logger = None, compact = False, logFrame = True):
+    """Return the first frame and the repeat frame of a command as two waveforms"""
+
+    frame = encodeFrame(teleco, button, code, logger, logFrame)
 
     #This is where all the awesomeness is happening. You're telling the daemon what you wanna send
-    wf=[]
-    wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 9415)) # wake up pulse
-    wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 89565)) # silence
-    for i in range(2): # hardware synchronization
-        wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 2560))
-        wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 2560))
-    wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 4550)) # software synchronization
-    wf.append(pigpio.pulse(0, 1<<txBcmPinNum,  640))
-
-    for i in range (0, 56): # manchester enconding of payload data
-        if ((frame[int(i/8)] >> (7 - (i%8))) & 1):
-            wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 640))
-            wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 640))
-        else:
-            wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 640))
-            wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 640))
-
-    wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 30415)) # interframe gap
-
-    for j in range(1,repetition): # repeating frames
-                for i in range(7): # hardware synchronization
-                    wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 2560))
-                    wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 2560))
-                wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 4550)) # software synchronization
-                wf.append(pigpio.pulse(0, 1<<txBcmPinNum,  640))
-
-                for i in range (0, 56): # manchester enconding of payload data
-                    if ((frame[int(i/8)] >> (7 - (i%8))) & 1):
-                        wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 640))
-                        wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 640))
-                    else:
-                        wf.append(pigpio.pulse(1<<txBcmPinNum, 0, 640))
-                        wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 640))
-
-                wf.append(pigpio.pulse(0, 1<<txBcmPinNum, 30415)) # interframe gap
-
-
-    return wf
\ No newline at end of file
+    segments = _getSegments(txBcmPinNum)
+
+    if compact:
+        payload = array('I')
+        for octet in frame: # manchester enconding of payload data
+            payload += segments.octetArrays[octet]
+        return (segments.firstHeaderArray + payload + segments.gapArray,
+                segments.repeatHeaderArray + payload + segments.gapArray)
+
+    payload = []
+    for octet in frame: # manchester enconding of payload data
+        payload += segments.octets[octet]
+    return (segments.firstHeader + payload + segments.gap,
+            segments.repeatHeader + payload + segments.gap)
+
+def createWaveForm(txBcmPinNum, teleco, button, code, repetition, logger = None, compact = False, logFrame = True):
+
+    wf, repeatWf = createWaveFrames(txBcmPinNum, teleco, button, code, logger, compact, logFrame)
+
+    for j in range(1, repetition): # repeating frames
+        wf += repeatWf
+
+    return wf
+
+def uploadWaveForm(pi, waveform, repeatWaveForm = None):
+    """Upload a waveform (and optionally its repeat frame) to pigpiod, return the wave ids"""
+
+    pi.wave_add_new()
+    pi.wave_add_generic(toPigpioPulses(waveform))
+    wids = [pi.wave_create()]
+    if repeatWaveForm != None:
+        try:
+            pi.wave_add_generic(toPigpioPulses(repeatWaveForm))
+            wids.append(pi.wave_create())
+        except:
+            deleteWaves(pi, wids)
+            raise
+    return wids
+
+def deleteWaves(pi, wids):
+    for wid in wids:
+        pi.wave_delete(wid)
+
+def waveFormMicros(waveform, repeatWaveForm = None):
+    """Return the on-air duration in microseconds of a waveform and of its repeat frame"""
+
+    def micros(wf):
+        if wf == None:
+            return 0
+        if isinstance(wf, array):
+            return sum(value & _DELAY_MASK for value in wf)
+        return sum(p.delay for p in wf)
+
+    return (micros(waveform), micros(repeatWaveForm))
+
+def motorReactionMicros():
+    """Return the time in microseconds from the start of a command until a motor acts on it.
+
+    The receiver decodes the command at the end of the payload of the first frame. With
+    manchester encoding the duration of a frame does not depend on its content."""
+
+    return WAKEUP_PULSE + WAKEUP_SILENCE + 4 * HW_SYNC + SW_SYNC_HIGH + SW_SYNC_LOW + FRAME_OCTETS * 8 * 2 * SYMBOL
+
+def _repeatChain(wids, repetition):
+    # wave_chain commands sending wids[0] once followed by repetition-1 copies of wids[1]
+    count = repetition - 1
+    if count > 0xFFFF:
+        raise ValueError("Too many repetitions for a wave chain: " + str(repetition))
+    if len(wids) < 2 or count < 1:
+        return [wids[0]]
+    return [wids[0], 255, 0, wids[1], 255, 1, count & 0xFF, count >> 8]
+
+def _repeatMicros(micros, repetition):
+    return micros[0] + micros[1] * (repetition - 1)
+
+def delayChain(micros):
+    """Return the wave_chain commands for a pause of micros microseconds.
+
+    A single delay command is limited to 65535 us, longer pauses repeat it in a loop."""
+
+    micros = int(round(micros))
+    loops, rest = divmod(micros, 0xFFFF)
+    if loops > 0xFFFF:
+        raise ValueError("Delay too long for a wave chain: " + str(micros) + " us")
+    chain = []
+    if loops > 1:
+        chain += [255, 0, 255, 2, 0xFF, 0xFF, 255, 1, loops & 0xFF, loops >> 8]
+    elif loops == 1:
+        chain += [255, 2, 0xFF, 0xFF]
+    if rest > 0:
+        chain += [255, 2, rest & 0xFF, rest >> 8]
+    return chain
+
+def _waitForTransmission(pi, startTime, expected, abort = None):
+    # Sleeps for the expected airtime (in seconds, None if unknown) and then confirms the end
+    # with wave_tx_busy. If the abort event is set, the transmission is stopped.
+    pollInterval = 0.1
+    if expected != None:
+        remaining = startTime + expected - monotonic()
+        if remaining > 0:
+            if abort != None:
+                abort.wait(remaining)
+            else:
+                sleep(remaining)
+        pollInterval = 0.001
+
+    # wait until finished
+    while pi.wave_tx_busy():
+        if abort != None and abort.is_set():
+            pi.wave_tx_stop()
+            break
+        sleep(pollInterval)
+
+    airtime = monotonic() - startTime
+    return airtime, (airtime - expected if expected != None else None)
+
+def sendWaves(pi, wids, repetition = 1, micros = None):
+    """Send uploaded waves and wait until they have been transmitted.
+
+    With two wave ids the first wave is sent once followed by repetition-1 copies of
+    the second one, replayed by a wave_chain loop.
+    If the durations of the waves are given (see waveFormMicros), the wait sleeps for
+    the known airtime and then confirms the end with wave_tx_busy instead of polling
+    pigpiod all along. Returns the measured airtime and how much later than expected
+    the end of transmission was detected, both in seconds (overshoot is None if the
+    durations are not known)."""
+
+    chain = len(wids) > 1 and repetition > 1
+    if chain:
+        pi.wave_chain(_repeatChain(wids, repetition))
+    else:
+        pi.wave_send_once(wids[0])
+    startTime = monotonic()
+
+    expected = None
+    if micros != None:
+        expected = (_repeatMicros(micros, repetition) if chain else micros[0]) / 1000000.0
+    return _waitForTransmission(pi, startTime, expected)
+
+def sendMoveAndStop(pi, moveWids, stopWids, repetition, delayMicros, moveMicros, stopMicros, abort = None):
+    """Send a move frame, a pause and a STOP frame as a single wave chain.
+
+    Both frames are given as two wave ids (first frame and repeat frame, see
+    createWaveFrames) and sent with repetition-1 repeats. The STOP frame starts
+    delayMicros after the end of the move frames, timed by DMA in pigpiod rather
+    than by the Python scheduler. If the abort event is set while waiting (e.g. a
+    newer command for the shutter), the transmission is stopped. Returns the
+    airtime and completion overshoot in seconds, see sendWaves."""
+
+    chain = _repeatChain(moveWids, repetition) + delayChain(delayMicros) + _repeatChain(stopWids, repetition)
+    pi.wave_chain(chain)
+    startTime = monotonic()
+    expected = (_repeatMicros(moveMicros, repetition) + int(round(delayMicros)) + _repeatMicros(stopMicros, repetition)) / 1000000.0
+    return _waitForTransmission(pi, startTime, expected, abort)
+
+def transmitWaveForm(pi, waveform, repeatWaveForm = None, repetition = 1):
+    """Upload a waveform to pigpiod, send it and wait until it has been transmitted.
+
+    If repeatWaveForm is given, waveform is sent once followed by repetition-1
+    copies of repeatWaveForm. The copies are replayed by a wave_chain loop, so
+    only two small waves are uploaded whatever the number of repetitions.
+    Returns the measured airtime and completion overshoot, see sendWaves."""
+
+    if repetition <= 1:
+        repeatWaveForm = None
+    wids = uploadWaveForm(pi, waveform, repeatWaveForm)
+    try:
+        return sendWaves(pi, wids, repetition, waveFormMicros(waveform, repeatWaveForm))
+    finally:
+        deleteWaves(pi, wids)
+
+
+if __name__ == "__main__":
+    # Benchmark of the waveform creation, e.g. on a Pi Zero: python3 somfyRtsWaveForm.py
+    import logging, timeit, tracemalloc
+
+    logger = logging.getLogger("somfyRtsWaveForm")
+    logger.setLevel(logging.CRITICAL)
+
+    for compact in (False, True):
+        for repetition in (1, 2, 35):
+            number = 200 if repetition > 2 else 2000
+            seconds = timeit.timeit(lambda: createWaveForm(4, 0x279621, 0x4, 42, repetition, logger, compact = compact), number = number)
+            print("createWaveForm repetition=%2d compact=%-5s : %8.1f us" % (repetition, compact, seconds / number * 1e6))
+
+    # Peak memory of one long press, including the packing done by pigpio's wave_add_generic
+    for compact in (False, True):
+        tracemalloc.start()
+        wf = createWaveForm(4, 0x279621, 0x4, 42, 35, logger, compact = compact)
+        ext = bytearray()
+        for p in toPigpioPulses(wf):
+            ext.extend(array('I', (p.gpio_on, p.gpio_off, p.delay)).tobytes())
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del wf, ext
+        print("createWaveForm repetition=35 compact=%-5s : peak %7d bytes" % (compact, peak))
@@ -0,0 +1,32 @@
+import os, sys
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myconfig import MyConfig
+
+@pytest.fixture
+def log():
+    return logging.getLogger("tests")
+
+@pytest.fixture
+def makeConfig(tmp_path, log):
+    # writes a config file with the shutters given as {shutterId: (name, duration, code)}
+    # and the entries of [General] given, and loads it
+    def makeConfig(shutters = {}, openJournal = True, **general):
+        values = {'TXGPIO': 4, 'SendRepeat': 2, 'PIGPIOHost': 'simulator', 'RollingCodeJournal': False, 'PersistPositions': False}
+        values.update(general)
+        lines = ["[General]"] + ["%s = %s" % (key, value) for key, value in values.items()]
+        lines += ["[Shutters]"] + ["%s = %s,true,%d" % (shutterId, name, duration) for shutterId, (name, duration, code) in shutters.items()]
+        lines += ["[ShutterRollingCodes]"] + ["%s = %d" % (shutterId, code) for shutterId, (name, duration, code) in shutters.items()]
+        lines += ["[ShutterIntermediatePositions]"] + ["%s = None" % shutterId for shutterId in shutters]
+        lines += ["[Scheduler]"]
+        filename = str(tmp_path / "operateShutters.conf")
+        with open(filename, 'w') as configFile:
+            configFile.write("\n".join(lines) + "\n")
+        config = MyConfig(filename = filename, log = log)
+        assert config.LoadConfig(openJournal = openJournal)
+        return config
+    return makeConfig
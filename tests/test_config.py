@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+def test_transaction_writes_all_changes(makeConfig):
+    config = makeConfig(Latitude = 1.5, Longitude = 2.5)
+    with config.transaction():
+        config.WriteValue("Latitude", "10", section = "General")
+        config.WriteValue("Longitude", "20", section = "General")
+        assert config.ReadValue("Latitude", return_type = float, section = "General") == 1.5
+
+    assert not config.Dirty
+    with open(config.FileName) as configFile:
+        content = configFile.read()
+    assert "Latitude = 10\n" in content and "Longitude = 20\n" in content
+
+def test_transaction_failing_write_keeps_old_values(makeConfig):
+    config = makeConfig(Latitude = 1.5, Longitude = 2.5)
+    with open(config.FileName) as configFile:
+        content = configFile.read()
+    # the temporary file cannot be created, even when running as root
+    os.mkdir(config.FileName + ".tmp")
+
+    with pytest.raises(Exception):
+        with config.transaction():
+            config.WriteValue("Latitude", "10", section = "General")
+            config.WriteValue("Longitude", "20", section = "General")
+
+    assert config.ReadValue("Latitude", return_type = float, section = "General") == 1.5
+    assert config.ReadValue("Longitude", return_type = float, section = "General") == 2.5
+    assert not config.Dirty
+
+    # nothing of the transaction is written later on
+    os.rmdir(config.FileName + ".tmp")
+    config.WriteValue("0x279621", "5", section = "ShutterRollingCodes")
+    assert config.Flush()
+    with open(config.FileName) as configFile:
+        assert configFile.read() == content.replace("[ShutterRollingCodes]\n", "[ShutterRollingCodes]\n0x279621 = 5\n")
+
+def test_set_code_without_journal_is_written_through(makeConfig):
+    config = makeConfig({"0x279621": ("shutter", 10, 1)})
+    config.setCode("0x279621", 2)
+
+    assert not config.Dirty
+    with open(config.FileName) as configFile:
+        assert "0x279621 = 2\n" in configFile.read()
@@ -0,0 +1,39 @@
+from myconfigwatcher import ConfigWatcher
+
+def editConfig(config, edit):
+    with open(config.FileName) as configFile:
+        content = configFile.read()
+    with open(config.FileName, 'w') as configFile:
+        configFile.write(edit(content))
+
+def test_reload_changes_by_hand(makeConfig, log):
+    config = makeConfig({"0x279621": ("kitchen", 10, 5), "0x279622": ("bedroom", 10, 7)})
+    watcher = ConfigWatcher(kwargs = {'log': log, 'config': config})
+    received = []
+    watcher.registerCallBack(received.append)
+
+    editConfig(config, lambda content: content.replace("kitchen,true,10", "cooking,true,12")
+                                               .replace("0x279622 = bedroom", "0x279623 = attic")
+                                               .replace("0x279622 = ", "0x279623 = ")
+                                               .replace("0x279621 = 5", "0x279621 = 3"))
+    # applied once the file has stayed the same for one check
+    assert watcher.checkForChanges() == None
+    changes = watcher.checkForChanges()
+
+    assert received == [changes]
+    assert changes.shuttersAdded == ["0x279623"] and changes.shuttersRemoved == ["0x279622"]
+    assert changes.shuttersRenamed == {"0x279621": ("kitchen", "cooking")}
+    assert changes.shuttersChanged == ["0x279621"]
+    assert config.ShuttersByName["cooking"] == "0x279621" and "kitchen" not in config.ShuttersByName
+    assert config.Shutters["0x279621"]['durationDown'] == 12
+    # rolling codes never go backwards
+    assert config.Shutters["0x279621"]['code'] == 5
+
+def test_own_writes_are_not_reloaded(makeConfig, log):
+    config = makeConfig({"0x279621": ("kitchen", 10, 5)})
+    watcher = ConfigWatcher(kwargs = {'log': log, 'config': config})
+    config.WriteValue("Latitude", "10", section = "General")
+    assert config.Flush()
+
+    assert watcher.checkForChanges() == None
+    assert watcher.checkForChanges() == None
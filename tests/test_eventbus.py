@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from myeventbus import EventBus
+
+@pytest.fixture
+def bus(log):
+    bus = EventBus(log = log)
+    yield bus
+    bus.shutdown()
+
+def test_stalled_subscriber_does_not_block(bus):
+    release = threading.Event()
+    stalled, received = [], []
+    bus.subscribe(lambda key, value: stalled.append(value) or release.wait(5), name = "stalled")
+    done = threading.Event()
+    bus.subscribe(lambda key, value: received.append(value) or (value == 2 and done.set()), name = "fast")
+
+    startTime = time.monotonic()
+    for value in range(3):
+        bus.publish("0x279621", "0x279621", value)
+    # neither the publisher nor the other subscriber waits for the stalled one
+    assert time.monotonic() - startTime < 0.5
+    assert done.wait(5)
+    assert received[-1] == 2
+    release.set()
+
+def test_pending_events_are_coalesced_per_key(bus):
+    started, release = threading.Event(), threading.Event()
+    received = []
+    def callback(key, value):
+        started.set()
+        release.wait(5)
+        received.append((key, value))
+    subscriber = bus.subscribe(callback, name = "slow")
+
+    bus.publish("first", "first", 0)
+    assert started.wait(5)
+    # published while the callback runs: only the latest value of each key is delivered,
+    # keys in the order they became pending
+    for value in range(1, 4):
+        bus.publish("0x279621", "0x279621", value)
+        bus.publish("0x279622", "0x279622", value)
+    assert subscriber.backlog() == 2
+    release.set()
+    subscriber.shutdown()
+
+    assert received == [("first", 0), ("0x279621", 3), ("0x279622", 3)]
+    assert subscriber.coalesced == 4
+    assert subscriber.lag.asDict()['count'] == 3
@@ -0,0 +1,17 @@
+from operateShutters import Shutter
+
+shutterId = "0x279621"
+
+def test_metrics_of_sent_command(makeConfig, log):
+    config = makeConfig({shutterId: ("shutter", 10, 1)})
+    shutter = Shutter(log = log, config = config)
+    try:
+        shutter.sendCommand(shutterId, Shutter.buttonUp, 2).result(timeout = 5)
+        metrics = shutter.getMetrics()
+    finally:
+        shutter.close()
+
+    airtime = metrics["Transmit airtime"]
+    assert airtime['count'] == 1
+    assert airtime['min'] == airtime['max'] == airtime['mean'] == airtime['last'] > 0
+    assert metrics["Transmit setup latency"]['count'] == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from operateShutters import Shutter
+from pigpioSimulator import SimulatedPi
+from somfyRtsWaveForm import createWaveFrames, uploadWaveForm, deleteWaves, waveFormMicros, sendMoveAndStop
+
+shutterId = "0x279621"
+
+def stopOffset(transmission):
+    # offset in micros of the first wave sent after a pause of the chain
+    events = transmission['events']
+    for previous, event in zip(events, events[1:]):
+        if previous[1] == None and event[1] != None:
+            return event[0]
+    return None
+
+@pytest.mark.parametrize("delay", [0.05, 0.5, 1.5])
+def test_send_move_and_stop_offset(delay):
+    pi = SimulatedPi()
+    moveWf = createWaveFrames(4, 0x279621, Shutter.buttonDown, 50, compact = True, logFrame = False)
+    stopWf = createWaveFrames(4, 0x279621, Shutter.buttonStop, 51, compact = True, logFrame = False)
+    moveWids, stopWids = uploadWaveForm(pi, *moveWf), uploadWaveForm(pi, *stopWf)
+    moveMicros, stopMicros = waveFormMicros(*moveWf), waveFormMicros(*stopWf)
+    sendMoveAndStop(pi, moveWids, stopWids, 2, int(delay * 1000000), moveMicros, stopMicros)
+    deleteWaves(pi, moveWids + stopWids)
+
+    # the STOP starts the requested pause after the move frames, to the microsecond
+    assert stopOffset(pi.transmissions[-1]) - sum(moveMicros) - int(delay * 1000000) == 0
+
+def test_precise_partial_move_stop_offset(makeConfig, log):
+    config = makeConfig({shutterId: ("shutter", 2, 1)}, UseWaveChain = True, PrecisePartialStops = True)
+    shutter = Shutter(log = log, config = config)
+    try:
+        shutter.setPosition(shutterId, 100)
+        shutter.lowerPartial(shutterId, 50).result(timeout = 5)
+        assert shutter.getPosition(shutterId) == 50
+
+        # the motor acts on the STOP 1 second (50% of 2 seconds) after it acted on the move
+        offset = stopOffset(shutter.pigpio.get().transmissions[-1])
+        assert abs(offset / 1000000.0 - 1.0) <= 0.001
+    finally:
+        shutter.close()
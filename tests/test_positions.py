@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from operateShutters import Shutter
+
+shutterId = "0x279621"
+
+@pytest.fixture
+def shutters(makeConfig, log):
+    # shutters created on the same config file, as when the program is started again
+    def makeShutter(duration):
+        if makeShutter.config == None:
+            makeShutter.config = makeConfig({shutterId: ("shutter", duration, 1)}, PersistPositions = True)
+        shutter = Shutter(log = log, config = makeShutter.config)
+        makeShutter.shutters.append(shutter)
+        return shutter
+    makeShutter.config = None
+    makeShutter.shutters = []
+    yield makeShutter
+    for shutter in makeShutter.shutters:
+        shutter.close()
+
+def interruptMove(shutter):
+    # closing cancels the completion timer of the move, as a restart or a CLI run does
+    shutter.setPosition(shutterId, 100)
+    shutter.lower(shutterId).result(timeout = 5)
+    shutter.close()
+
+def test_restore_after_completed_move(shutters):
+    interruptMove(shutters(1))
+    time.sleep(1.2)
+
+    shutter = shutters(1)
+    assert shutter.getPosition(shutterId) == 0
+    assert shutter.getShutterState(shutterId).target == None
+
+def test_restore_during_move(shutters):
+    startTime = time.monotonic()
+    interruptMove(shutters(10))
+
+    shutter = shutters(10)
+    elapsed = time.monotonic() - startTime
+    state = shutter.getShutterState(shutterId)
+    assert state.target == 0
+    assert state.isMoving(time.monotonic())
+    assert 100 - elapsed * 10 - 1 <= shutter.getPosition(shutterId) < 100
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from mypositions import PositionStore
+
+@pytest.mark.parametrize("tail", [b"0x279622 4", b"0x279622 \xe2\x82", b"\xff\xfe\n"])
+def test_torn_journal_tail_is_truncated(tmp_path, log, tail):
+    filename = str(tmp_path / "shutters.positions")
+    store = PositionStore(filename, log = log)
+    store.load()
+    store.update("0x279621", 40.0, 'down', 1000.0, 0.0)
+    assert store.flush()
+    store.file.close()
+    size = os.path.getsize(store.JournalFileName)
+    # power lost while the next record was appended
+    with open(store.JournalFileName, 'ab') as journal:
+        journal.write(tail)
+
+    store = PositionStore(filename, log = log, compactEvery = 1000)
+    # the snapshot cannot be written, the journal is only cut
+    os.mkdir(filename + ".tmp")
+    assert store.load() == {"0x279621": (40.0, 'down', 1000.0, 0.0)}
+    assert os.path.getsize(store.JournalFileName) == size
+
+    # records appended after the torn one are read back
+    store.update("0x279622", 60.0, 'up', 1001.0)
+    assert store.flush()
+    store.file.close()
+    os.rmdir(filename + ".tmp")
+    store = PositionStore(filename, log = log)
+    assert store.load() == {"0x279621": (40.0, 'down', 1000.0, 0.0), "0x279622": (60.0, 'up', 1001.0, None)}
+    store.close()
@@ -0,0 +1,29 @@
+from rfm69 import Rfm69
+from pigpioSimulator import SimulatedPi
+from somfyRfm69Transmitter import TRANSMIT_CONFIG
+
+def test_write_config_transactions():
+    pi = SimulatedPi()
+    rf = Rfm69(pi = pi)
+
+    # cold: consecutive registers are merged, 12 writes in 9 bursts
+    rf.write_config(TRANSMIT_CONFIG)
+    assert rf.transactions == 9
+    for reg, val in TRANSMIT_CONFIG[1:]:
+        assert pi.rfm69.registers[reg] == val
+
+    # warm: only OpMode changes, to standby and back to transmit
+    rf.transactions = 0
+    rf.write_config(TRANSMIT_CONFIG)
+    assert rf.transactions == 2
+    assert len(pi.spiTransfers) == 11
+
+def test_write_config_register_written_twice():
+    pi = SimulatedPi()
+    rf = Rfm69(pi = pi)
+    rf.write_single(0x01, 0x0C)
+
+    # the second write of OpMode restores the value it had before the run
+    rf.write_config(((0x01, 0x04), (0x02, 0x68), (0x01, 0x0C)))
+    assert pi.rfm69.registers[0x01] == 0x0C
+    assert rf.shadow[0x01] == 0x0C
@@ -0,0 +1,30 @@
+from pigpioSimulator import SimulatedPi
+from somfyRfm69Transmitter import SomfyRfm69Tx, TRANSMIT_CONFIG
+from somfyRtsWaveForm import createWaveFrames
+
+def send(s69Tx, code):
+    wf, repeatWf = createWaveFrames(26, 0x279621, 0x4, code, compact = True, logFrame = False)
+    s69Tx.sendWaveForm(wf, repeatWf, 2)
+
+def test_warm_session_reinitialises_after_module_reset():
+    pi = SimulatedPi()
+    with SomfyRfm69Tx(pi = pi, keepWarm = True) as s69Tx:
+        send(s69Tx, 42)
+        send(s69Tx, 43)
+        assert not s69Tx.lastWarmReset
+        writes = [transfer for transfer in pi.spiTransfers if transfer[2][0] & 0x80]
+
+        # the module resets (e.g. a brown out) while parked in standby
+        pi.rfm69.reset()
+        modes = []
+        pi.rfm69.modeChangeListener = lambda rfm69: modes.append(rfm69.mode())
+        send(s69Tx, 44)
+        assert s69Tx.lastWarmReset
+        assert 0x03 in modes
+        for reg, val in TRANSMIT_CONFIG[1:-1]:
+            assert pi.rfm69.registers[reg] == val
+
+        send(s69Tx, 45)
+        assert not s69Tx.lastWarmReset
+    # the warm transmission only switched the mode
+    assert [transfer[2][0] & 0x7F for transfer in writes[-2:]] == [0x01, 0x01]
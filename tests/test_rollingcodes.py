@@ -0,0 +1,62 @@
+import os
+import zlib
+
+from myconfig import MyConfig
+from myrollingcodes import RollingCodeJournal
+
+def record(shutterId, leaseEnd):
+    line = "%s %d" % (shutterId, leaseEnd)
+    return line + " %08x" % zlib.crc32(line.encode())
+
+def test_record_without_newline_is_torn(tmp_path, log):
+    filename = str(tmp_path / "shutters.codes")
+    # power lost before the newline of the last record was written, so it was never fsynced
+    # and none of its codes were used
+    with open(filename, 'w') as journal:
+        journal.write(record("0x279620", 10) + "\n" + record("0x279621", 42))
+
+    journal = RollingCodeJournal(filename, log = log)
+    assert journal.load() == {"0x279620": 10}
+    assert os.path.getsize(filename) == len(record("0x279620", 10)) + 1
+    journal.lease("0x279621", 43)
+    journal.close()
+
+    # the lease taken after the torn record is read back
+    journal = RollingCodeJournal(filename, log = log)
+    assert journal.load() == {"0x279620": 10, "0x279621": 43 + 32}
+    journal.close()
+
+def journalRecords(config):
+    with open(config.FileName + ".codes") as journal:
+        return [line.split()[:2] for line in journal]
+
+def test_lease_refill(makeConfig):
+    config = makeConfig({"0x279621": ("shutter", 10, 1)}, RollingCodeJournal = True, RollingCodeLeaseSize = 4)
+    for code in range(2, 11):
+        config.setCode("0x279621", code)
+
+    # one record per block of 4 codes, written when the next code leaves the lease
+    assert journalRecords(config) == [["0x279621", "6"], ["0x279621", "11"]]
+    assert config.Shutters["0x279621"]['code'] == 10
+    config.close()
+
+def test_crash_recovery(makeConfig, log):
+    config = makeConfig({"0x279621": ("shutter", 10, 1)}, RollingCodeJournal = True, RollingCodeLeaseSize = 4)
+    for code in range(2, 9):
+        config.setCode("0x279621", code)
+    # power lost: neither compacted nor closed
+    config.CodeJournal.close()
+
+    # codes up to the end of the last lease may have been sent, the next one follows it
+    config = MyConfig(filename = config.FileName, log = log)
+    assert config.LoadConfig()
+    assert config.Shutters["0x279621"]['code'] == 11
+    assert journalRecords(config) == []
+    config.setCode("0x279621", 12)
+    config.close()
+
+    # a clean shutdown stores the code itself, no code is skipped on the next start
+    config = MyConfig(filename = config.FileName, log = log)
+    assert config.LoadConfig()
+    assert config.Shutters["0x279621"]['code'] == 12
+    config.close()
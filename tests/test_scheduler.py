@@ -0,0 +1,77 @@
+import datetime
+import heapq
+import threading
+
+import pytest
+
+from myscheduler import Event, Schedule, Scheduler
+
+class FixedSunTimes(object):
+    def get(self, day):
+        return (datetime.datetime.combine(day, datetime.time(7, 0)), datetime.datetime.combine(day, datetime.time(19, 0)))
+
+class StopRecorder(object):
+    # records the shutters the events stop
+    def __init__(self):
+        self.stopped = []
+        self.fired = threading.Event()
+
+    def stop(self, shutterId):
+        self.stopped.append((shutterId, datetime.datetime.now()))
+        self.fired.set()
+
+def onceAt(fireTime, shutterId = "0x279621"):
+    return Event('active', 'once', fireTime.strftime('%Y/%m/%d'), 'clock', fireTime.strftime('%H:%M:%S'), 'stop', [shutterId])
+
+@pytest.fixture
+def scheduler(makeConfig, log):
+    config = makeConfig()
+    schedule = Schedule(log = log, config = config)
+    shutter = StopRecorder()
+    scheduler = Scheduler(kwargs = {'log': log, 'schedule': schedule, 'shutter': shutter, 'config': config, 'sunTimes': FixedSunTimes()})
+    scheduler.daemon = True
+    yield scheduler
+    scheduler.shutdown()
+    if scheduler.is_alive():
+        scheduler.join(5)
+
+def test_heap_order_and_replaced_entries(scheduler):
+    now = datetime.datetime(2026, 10, 19, 12, 0)
+    weekDays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    scheduler.schedule.addEvent("1", Event('active', 'weekday', weekDays, 'astro', 'sunset+30', 'stop', ["0x279621"]))
+    scheduler.schedule.addEvent("2", Event('active', 'weekday', weekDays, 'clock', '13:00', 'stop', ["0x279621"]))
+    scheduler.schedule.addEvent("3", Event('active', 'weekday', weekDays, 'astro', 'sunrise', 'stop', ["0x279621"]))
+    scheduler.updateSchedule(now)
+
+    assert scheduler.nextEvent()[::2] == (datetime.datetime(2026, 10, 19, 13, 0), "2")
+    # an edited event replaces its heap entry, the old one is skipped
+    scheduler.schedule.getSchedule()["2"].timeValue = '20:00'
+    scheduler.reschedule("2", now)
+    fired = []
+    while scheduler.nextEvent() != None:
+        fireTime, version, id = heapq.heappop(scheduler.heap)
+        fired.append((fireTime, id))
+        del scheduler.entries[id]
+    assert fired == [(datetime.datetime(2026, 10, 19, 19, 30), "1"), (datetime.datetime(2026, 10, 19, 20, 0), "2"),
+                     (datetime.datetime(2026, 10, 20, 7, 0), "3")]
+
+def test_event_fires_on_time(scheduler):
+    fireTime = (datetime.datetime.now() + datetime.timedelta(seconds = 2)).replace(microsecond = 0)
+    scheduler.schedule.addEvent("1", onceAt(fireTime))
+    scheduler.start()
+
+    assert scheduler.shutter.fired.wait(5)
+    assert scheduler.shutter.stopped[0][0] == "0x279621"
+    assert fireTime <= scheduler.shutter.stopped[0][1] < fireTime + datetime.timedelta(seconds = 0.5)
+
+def test_edited_event_wakes_up_scheduler(scheduler):
+    scheduler.schedule.addEvent("1", onceAt(datetime.datetime.now() + datetime.timedelta(hours = 1)))
+    scheduler.start()
+
+    # the scheduler sleeps until the event in an hour, the edit wakes it up
+    fireTime = (datetime.datetime.now() + datetime.timedelta(seconds = 2)).replace(microsecond = 0)
+    scheduler.schedule.addEvent("1", onceAt(fireTime, "0x279622"))
+
+    assert scheduler.shutter.fired.wait(5)
+    assert scheduler.shutter.stopped[0][0] == "0x279622"
+    assert fireTime <= scheduler.shutter.stopped[0][1] < fireTime + datetime.timedelta(seconds = 0.5)
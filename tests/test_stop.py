@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from operateShutters import Shutter
+
+shutterId = "0x279621"
+
+@pytest.fixture
+def shutter(makeConfig, log):
+    config = makeConfig({shutterId: ("shutter", 10, 1)})
+    shutter = Shutter(log = log, config = config)
+    yield shutter
+    shutter.close()
+
+def holdTransmitter(shutter):
+    # keeps the transmit worker busy, the commands submitted meanwhile stay queued
+    started, release = threading.Event(), threading.Event()
+    def hold():
+        started.set()
+        release.wait(5)
+    shutter.transmitter.submit(hold)
+    started.wait(5)
+    return release
+
+def code(shutter):
+    return int(shutter.config.Shutters[shutterId]['code'])
+
+def test_stop_drops_queued_move(shutter):
+    shutter.setPosition(shutterId, 100)
+    release = holdTransmitter(shutter)
+    move = shutter.lower(shutterId)
+    stop = shutter.stop(shutterId)
+    release.set()
+    stop.result(timeout = 5)
+
+    # neither the move nor a STOP, which would drive the motor to its "My" position, is sent
+    assert move.cancelled()
+    shutter.transmitter.submit(lambda: None).result(timeout = 5)
+    assert code(shutter) == 1
+    state = shutter.getShutterState(shutterId)
+    assert shutter.getPosition(shutterId) == 100
+    assert state.target == None and state.lastCommandDirection == None
+
+def test_stop_after_move_on_air(shutter):
+    shutter.setPosition(shutterId, 100)
+    shutter.lower(shutterId).result(timeout = 5)
+    release = holdTransmitter(shutter)
+    move = shutter.rise(shutterId)
+    stop = shutter.stop(shutterId)
+    release.set()
+    stop.result(timeout = 5)
+
+    # the queued rise is dropped, the STOP stops the lowering already on air
+    assert move.cancelled()
+    assert code(shutter) == 3
+    state = shutter.getShutterState(shutterId)
+    assert state.target == None
+    assert 90 < shutter.getPosition(shutterId) < 100
+
+def test_stop_position_from_transmit_time(shutter):
+    shutter.setPosition(shutterId, 100)
+    moveTime = shutter.lower(shutterId).result(timeout = 5)
+    release = holdTransmitter(shutter)
+    stop = shutter.stop(shutterId)
+    time.sleep(1)
+    releaseTime = time.monotonic()
+    release.set()
+    stop.result(timeout = 5)
+
+    # the shutter stopped where it was once the delayed STOP reached the motor, not where
+    # it was when the STOP was queued
+    assert shutter.getPosition(shutterId) <= int(round(100 - (releaseTime + Shutter.motorReaction - moveTime) * 10))
+    assert shutter.getPosition(shutterId) >= int(round(100 - (time.monotonic() - moveTime) * 10))
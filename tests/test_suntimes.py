@@ -0,0 +1,23 @@
+import datetime
+import json
+
+import pytest
+
+from mysuntimes import SunTimes
+
+@pytest.mark.parametrize("content", ["", '{"latitude":51.4769,"longitude":0.0,"timezone":"UTC', "\x00\x00\x00\x00"])
+def test_unreadable_cache_is_computed_again(makeConfig, log, content):
+    config = makeConfig()
+    filename = config.FileName + ".suntimes"
+    with open(filename, 'w') as cache:
+        cache.write(content)
+
+    sunTimes = SunTimes(filename, log = log, config = config, days = 10)
+    assert sunTimes.start == None
+    sunrise, sunset = sunTimes.get(datetime.date.today())
+    assert sunrise < sunset
+
+    # the cache written instead can be read back
+    with open(filename) as cache:
+        assert len(json.load(cache)['table']) == 10
+    assert SunTimes(filename, log = log, config = config, days = 10).table == sunTimes.table
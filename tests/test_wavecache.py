@@ -0,0 +1,75 @@
+import pytest
+
+from operateShutters import Shutter
+from mytransmitter import TransmitWorker
+from pigpioSimulator import SimulatedPi, MAX_PULSES, MAX_WAVES
+
+@pytest.fixture
+def shutter(makeConfig, log):
+    def makeShutter(count):
+        shutters = dict(("0x%06x" % (0x279621 + i), ("shutter" + str(i), 10, 1)) for i in range(count))
+        config = makeConfig(shutters, UseWaveChain = True, PrestageWaves = True, PreUploadWaves = True)
+        shutter = Shutter(log = log, config = config)
+        # one daemon for all connections, pigpiod keeps the waves of a client that reconnects
+        pi = SimulatedPi()
+        def connect(host, port):
+            pi.connected = True
+            return pi
+        shutter.pigpio.factory = connect
+        shutter.pi = pi
+        makeShutter.shutters.append(shutter)
+        return shutter
+    makeShutter.shutters = []
+    yield makeShutter
+    for shutter in makeShutter.shutters:
+        shutter.close()
+
+def stageAll(shutter):
+    # staging runs on the transmit worker, after the commands queued before
+    shutter.transmitter.submit(shutter.stageWaves, priority = TransmitWorker.PRIORITY_LOW).result()
+
+def cachedWids(shutter):
+    return set(wid for entry in shutter.waveCache.entries.values() for wave in entry[3].values() for wid in (wave.wids or []))
+
+def test_failed_send_leaks_no_waves(shutter):
+    shutter = shutter(2)
+    pi = shutter.pi
+    stageAll(shutter)
+    assert len(pi.waves) == 2 * 3 * 2
+
+    failures = []
+    waveChain = pi.wave_chain
+    def failOnce(data):
+        if not failures:
+            failures.append(data)
+            raise ConnectionResetError("simulated failure")
+        return waveChain(data)
+    pi.wave_chain = failOnce
+
+    shutter.sendCommand("0x279621", Shutter.buttonUp, 2).result(timeout = 5)
+    stageAll(shutter)
+    assert len(failures) == 1
+    assert set(pi.waves) == cachedWids(shutter)
+    assert len(pi.waves) == 2 * 3 * 2
+
+def test_failed_sends_do_not_exhaust_pigpiod(shutter):
+    shutter = shutter(40)
+    pi = shutter.pi
+    stageAll(shutter)
+    assert sum(len(wave) for wave in pi.waves.values()) <= MAX_PULSES // 2
+    assert len(pi.waves) <= MAX_WAVES // 2
+    assert set(pi.waves) == cachedWids(shutter)
+
+    def fail(data):
+        raise ConnectionResetError("simulated failure")
+    pi.wave_chain = fail
+    for i in range(5):
+        with pytest.raises(ConnectionResetError):
+            shutter.sendCommand("0x279621", Shutter.buttonUp, 2).result(timeout = 5)
+    del pi.wave_chain
+
+    # there is room left for a command whose waves are not uploaded
+    stageAll(shutter)
+    shutter.sendCommand("0x279621", Shutter.buttonDown, 2).result(timeout = 5)
+    stageAll(shutter)
+    assert set(pi.waves) == cachedWids(shutter)
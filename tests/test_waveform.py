@@ -0,0 +1,12 @@
+import sys
+
+from somfyRtsWaveForm import createWaveForm, toPigpioPulses, waveFormMicros
+
+def test_compact_waveform_matches_pulses():
+    pulses = createWaveForm(4, 0x279621, 0x4, 42, 35, logFrame = False)
+    compact = createWaveForm(4, 0x279621, 0x4, 42, 35, compact = True, logFrame = False)
+
+    assert [(p.gpio_on, p.gpio_off, p.delay) for p in toPigpioPulses(compact)] == [(p.gpio_on, p.gpio_off, p.delay) for p in pulses]
+    assert waveFormMicros(compact) == waveFormMicros(pulses)
+    # one 32 bit value per pulse, half a list of references to shared pulses
+    assert sys.getsizeof(compact) < sys.getsizeof(pulses) * 0.6